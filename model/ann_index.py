@@ -0,0 +1,169 @@
+from typing import List, Optional
+from array import array
+import numpy as np
+import os
+
+CENTROIDS_FNAME = "ivf_centroids.npy"
+ASSIGNMENTS_FNAME = "ivf_assignments.npy"
+
+# 分塊計算與質心的內積，避免一次產生 (n, nlist) 的大矩陣
+_ASSIGN_BLOCK_ROWS = 32768
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFFlatIndex:
+    """純 NumPy 的 IVF-flat 近似最近鄰索引
+
+    以球面 k-means 把向量分到 nlist 個倒排列表，查詢時只掃描與查詢最接近的
+    nprobe 個列表。列表內存的是向量庫的列號，向量本身仍由向量庫保存。
+    """
+
+    def __init__(
+        self,
+        nlist: Optional[int] = None,  # 預設為 4 * sqrt(n)
+        nprobe: int = 8,
+        min_train_size: int = 4096,  # 向量數少於此值時直接精確搜尋
+        retrain_growth: float = 4.0,  # 資料量成長到訓練時的幾倍後重新訓練
+        kmeans_iters: int = 20,
+        max_train_samples: int = 100000,
+        seed: int = 0
+    ):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.retrain_growth = retrain_growth
+        self.kmeans_iters = kmeans_iters
+        self.max_train_samples = max_train_samples
+        self.seed = seed
+
+        self.reset()
+
+    def reset(self):
+        """清除質心與倒排列表"""
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_size = 0
+        self._assignments = array("i")
+        self._lists: List[array] = []
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def size(self) -> int:
+        return len(self._assignments)
+
+    def needs_retrain(self, n_rows: int) -> bool:
+        if not self.is_trained:
+            return n_rows >= self.min_train_size
+        return n_rows >= self.trained_size * self.retrain_growth
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        assignments = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], _ASSIGN_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + _ASSIGN_BLOCK_ROWS], dtype=np.float32)
+            assignments[start:start + block.shape[0]] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def _kmeans(self, samples: np.ndarray, nlist: int) -> np.ndarray:
+        """球面 k-means（向量已正規化，以內積為相似度）"""
+        rng = np.random.default_rng(self.seed)
+        centroids = samples[rng.choice(samples.shape[0], nlist, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assignments = np.argmax(samples @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, samples)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # 空的群重新挑選樣本作為質心
+                sums[empty] = samples[rng.choice(samples.shape[0], int(empty.sum()), replace=False)]
+            centroids = _normalize(sums)
+        return centroids.astype(np.float32)
+
+    def train(self, vectors: np.ndarray):
+        """以目前所有向量訓練質心並重建倒排列表"""
+        n_rows = vectors.shape[0]
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n_rows)))
+        nlist = min(nlist, n_rows)
+
+        rng = np.random.default_rng(self.seed)
+        if n_rows > self.max_train_samples:
+            sample_rows = np.sort(rng.choice(n_rows, self.max_train_samples, replace=False))
+            samples = np.asarray(vectors[sample_rows], dtype=np.float32)
+        else:
+            samples = np.asarray(vectors, dtype=np.float32)
+
+        self.centroids = self._kmeans(_normalize(samples), nlist)
+        self.trained_size = n_rows
+        self._set_assignments(self._assign(vectors))
+
+    def add(self, vectors: np.ndarray, start_row: int):
+        """把新的列加入最近的倒排列表"""
+        if not self.is_trained or vectors.shape[0] == 0:
+            return
+        if start_row != self.size:
+            raise ValueError(f"IVF rows out of sync: expected {self.size}, got {start_row}")
+        assignments = self._assign(vectors)
+        self._assignments.extend(assignments.tolist())
+        for offset, list_id in enumerate(assignments.tolist()):
+            self._lists[list_id].append(start_row + offset)
+
+    def compact(self, alive: np.ndarray):
+        """向量庫移除已刪除的列後，同步重新編號"""
+        if not self.is_trained:
+            return
+        assignments = np.frombuffer(self._assignments, dtype=np.int32)[alive]
+        self._set_assignments(assignments)
+
+    def _set_assignments(self, assignments: np.ndarray):
+        self._assignments = array("i", assignments.astype(np.int32).tobytes())
+        self._lists = [array("q") for _ in range(self.centroids.shape[0])]
+        order = np.argsort(assignments, kind="stable")
+        bounds = np.searchsorted(assignments[order], np.arange(self.centroids.shape[0] + 1))
+        for list_id in range(self.centroids.shape[0]):
+            rows = order[bounds[list_id]:bounds[list_id + 1]]
+            self._lists[list_id] = array("q", rows.astype(np.int64).tobytes())
+
+    def candidates(self, query: np.ndarray, nprobe: Optional[int] = None) -> np.ndarray:
+        """回傳最接近的 nprobe 個列表中的所有列號"""
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        centroid_scores = self.centroids @ np.asarray(query, dtype=np.float32)
+        if nprobe < centroid_scores.shape[0]:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(centroid_scores.shape[0])
+        lists = [np.frombuffer(self._lists[i], dtype=np.int64) for i in probe if len(self._lists[i])]
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(lists)
+
+    def save(self, persist_dir: str):
+        if not self.is_trained:
+            return
+        for fname, data in (
+            (CENTROIDS_FNAME, self.centroids),
+            (ASSIGNMENTS_FNAME, np.frombuffer(self._assignments, dtype=np.int32)),
+        ):
+            path = os.path.join(persist_dir, fname)
+            np.save(path + ".tmp.npy", data)
+            os.replace(path + ".tmp.npy", path)
+
+    def load(self, persist_dir: str, n_rows: int) -> bool:
+        """載入質心與列表分配；列數不一致時放棄，之後重新訓練"""
+        centroids_path = os.path.join(persist_dir, CENTROIDS_FNAME)
+        assignments_path = os.path.join(persist_dir, ASSIGNMENTS_FNAME)
+        if not (os.path.exists(centroids_path) and os.path.exists(assignments_path)):
+            return False
+        assignments = np.load(assignments_path)
+        if assignments.shape[0] != n_rows:
+            return False
+        self.centroids = np.load(centroids_path)
+        self.trained_size = n_rows
+        self._set_assignments(assignments)
+        return True
@@ -0,0 +1,217 @@
+from typing import Callable, Dict, Any, Optional, List, Tuple
+from collections import OrderedDict
+import copy
+import json
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+
+_PUNCTUATION = re.compile(r"[\s?？!！。.,，、：:;；\"'“”「」]+")
+
+
+def normalize_query(query_text: str) -> str:
+    """正規化查詢：全半形統一、小寫、移除空白與標點"""
+    text = unicodedata.normalize("NFKC", query_text).lower()
+    return _PUNCTUATION.sub("", text)
+
+
+class _CacheEntry:
+    __slots__ = ("key", "embedding", "result", "created", "size", "min_score", "terms")
+
+    def __init__(self, key, embedding, result, size, min_score, terms):
+        self.key = key
+        self.embedding = embedding
+        self.result = result
+        self.created = time.time()
+        self.size = size
+        self.min_score = min_score
+        self.terms = terms
+
+
+class AnswerCache:
+    """問答結果的語意快取
+
+    先以正規化後的查詢字串精確比對，未命中時再比較查詢向量的餘弦相似度，
+    高於門檻即視為同一個問題。以 LRU + TTL 淘汰，並限制總記憶體用量。
+    檢索含 BM25 時傳入 term_tokenizer：新節點的詞與查詢有交集也會使快取失效，
+    因為這類節點可能以很低的餘弦相似度經由 BM25 進入 top-k。
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = 0.95,
+        max_entries: int = 1024,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl_seconds: float = 3600,
+        term_tokenizer: Optional[Callable[[str], List[str]]] = None
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.term_tokenizer = term_tokenizer
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._entries: "OrderedDict[Tuple, _CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 語意比對用的向量矩陣，快取內容變動時才重建
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[Tuple] = []
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _make_key(query_text: str, top_k: int, response_mode: str, scope: str = "") -> Tuple:
+        return (normalize_query(query_text), top_k, response_mode, scope)
+
+    @staticmethod
+    def _normalize_embedding(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        self._matrix = None
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        deadline = time.time() - self.ttl_seconds
+        # OrderedDict 依使用順序排列，但 TTL 看的是建立時間，需完整掃描
+        for key in [k for k, e in self._entries.items() if e.created < deadline]:
+            self._remove(key)
+            self.evictions += 1
+
+    def _semantic_match(self, embedding: np.ndarray, params: Tuple) -> Optional[Tuple]:
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = (
+                np.stack([self._entries[k].embedding for k in self._matrix_keys])
+                if self._matrix_keys else None
+            )
+        if self._matrix is None:
+            return None
+        scores = self._matrix @ embedding
+        for row in np.argsort(-scores):
+            if scores[row] < self.similarity_threshold:
+                break
+            key = self._matrix_keys[row]
+            if key[1:] == params:
+                return key
+        return None
+
+    def lookup(
+        self,
+        query_text: str,
+        query_embedding,
+        top_k: int,
+        response_mode: str,
+        scope: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """查詢快取，命中時回傳結果的複本；scope 不同（如過濾條件）的結果不會互相命中"""
+        key = self._make_key(query_text, top_k, response_mode, scope)
+        with self._lock:
+            self._expire()
+            if key in self._entries:
+                self.exact_hits += 1
+            else:
+                params, key = key[1:], None
+                if query_embedding is not None:
+                    key = self._semantic_match(
+                        self._normalize_embedding(query_embedding),
+                        params
+                    )
+                if key is None:
+                    self.misses += 1
+                    return None
+                self.semantic_hits += 1
+            self._entries.move_to_end(key)
+            return copy.deepcopy(self._entries[key].result)
+
+    def store(
+        self,
+        query_text: str,
+        query_embedding,
+        top_k: int,
+        response_mode: str,
+        result: Dict[str, Any],
+        scope: str = ""
+    ):
+        """寫入快取；記錄檢索來源的最低分數，供新增文件時判斷是否失效"""
+        if query_embedding is None:
+            return
+        key = self._make_key(query_text, top_k, response_mode, scope)
+        embedding = self._normalize_embedding(query_embedding)
+        scores = [s.get("score") for s in result.get("sources", [])]
+        # 來源不足 top_k 或沒有分數時，任何新文件都可能改變檢索結果
+        if len(scores) < top_k or any(score is None for score in scores):
+            min_score = float("-inf")
+        else:
+            min_score = min(scores)
+        terms = frozenset(self.term_tokenizer(query_text)) if self.term_tokenizer else frozenset()
+        size = len(json.dumps(result, ensure_ascii=False, default=str).encode("utf-8")) + embedding.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _CacheEntry(key, embedding, copy.deepcopy(result), size, min_score, terms)
+            self._bytes += size
+            self._matrix = None
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_for(self, new_embeddings, new_texts: Optional[List[str]] = None):
+        """新增節點後，移除可能因新節點進入 top-k 而改變答案的快取項目
+
+        向量相似度達到項目的最低來源分數，或（有 term_tokenizer 時）new_texts 含有查詢的詞。
+        """
+        new_matrix = np.asarray(new_embeddings, dtype=np.float32)
+        if new_matrix.size == 0:
+            return
+        norms = np.linalg.norm(new_matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        new_matrix = new_matrix / norms
+        new_terms = set()
+        if self.term_tokenizer and new_texts:
+            for text in new_texts:
+                new_terms.update(self.term_tokenizer(text))
+        with self._lock:
+            stale = [
+                key for key, entry in self._entries.items()
+                if float(np.max(new_matrix @ entry.embedding)) >= entry.min_score
+                or not entry.terms.isdisjoint(new_terms)
+            ]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._matrix = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.exact_hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
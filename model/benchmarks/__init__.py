@@ -0,0 +1 @@
+"""離線效能基準測試，請在 model 資料夾下以 python -m benchmarks.<名稱> 執行"""
@@ -0,0 +1,99 @@
+"""IVF-flat 與精確搜尋的 recall@k / 延遲比較
+
+    cd model
+    python -m benchmarks.ann_benchmark --rows 200000 --dim 1024 --nprobe 1 4 16 64
+"""
+from typing import List
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from numpy_vector_store import NumpyVectorStore
+from ann_index import IVFFlatIndex
+import argparse
+import json
+import numpy as np
+import time
+
+
+def make_corpus(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """產生有群聚結構的合成向量，接近真實嵌入的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    noise = rng.standard_normal((rows, dim)).astype(np.float32) * 0.6
+    return centers[labels] + noise
+
+
+def build_store(vectors: np.ndarray, ann=None) -> NumpyVectorStore:
+    store = NumpyVectorStore(ann=ann)
+    node_ids = [str(i) for i in range(vectors.shape[0])]
+    store.add_embeddings(vectors, node_ids, node_ids)
+    return store
+
+
+def timed_queries(store: NumpyVectorStore, queries: np.ndarray, top_k: int, **kwargs):
+    results: List[List[str]] = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        result = store.query(
+            VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k),
+            **kwargs
+        )
+        latencies.append(time.perf_counter() - start)
+        results.append(result.ids)
+    return results, np.asarray(latencies) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = make_corpus(args.rows, args.dim, args.clusters, args.seed)
+    queries = make_corpus(args.queries, args.dim, args.clusters, args.seed + 1)
+
+    exact_store = build_store(vectors)
+    exact_ids, exact_ms = timed_queries(exact_store, queries, args.top_k)
+
+    start = time.perf_counter()
+    ann = IVFFlatIndex(nlist=args.nlist, min_train_size=0)
+    ann_store = build_store(vectors, ann=ann)
+    build_s = time.perf_counter() - start
+
+    report = {
+        "rows": args.rows,
+        "dim": args.dim,
+        "top_k": args.top_k,
+        "nlist": int(ann.centroids.shape[0]),
+        "ivf_build_s": round(build_s, 3),
+        "exact": {
+            "p50_ms": round(float(np.percentile(exact_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(exact_ms, 99)), 3),
+        },
+        "ivf": [],
+    }
+    for nprobe in args.nprobe:
+        ann_ids, ann_ms = timed_queries(ann_store, queries, args.top_k, nprobe=nprobe)
+        recall = np.mean([
+            len(set(found) & set(truth)) / len(truth)
+            for found, truth in zip(ann_ids, exact_ids)
+        ])
+        report["ivf"].append({
+            "nprobe": nprobe,
+            f"recall@{args.top_k}": round(float(recall), 4),
+            "p50_ms": round(float(np.percentile(ann_ms, 50)), 3),
+            "p99_ms": round(float(np.percentile(ann_ms, 99)), 3),
+            "speedup_p50": round(float(np.percentile(exact_ms, 50) / np.percentile(ann_ms, 50)), 2),
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
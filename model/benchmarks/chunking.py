@@ -0,0 +1,134 @@
+"""固定長度切塊與依來源切塊的節點數 / 嵌入成本比較
+
+    cd model
+    python -m benchmarks.chunking --pdf test_files/sample.pdf \
+        --transcript test_files/sample_transcript.txt --embed
+
+fixed 重現原本的做法：PDF 取整頁純文字、每行字幕各自成為文件，
+一律以 SimpleNodeParser(chunk_size=256, chunk_overlap=30) 切分並嵌入全部 metadata。
+嵌入成本以嵌入模型分詞器計算的 token 總數表示；加上 --embed 時實際嵌入並計時。
+"""
+from typing import Dict, List
+from llama_index.core import Document
+from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.schema import MetadataMode
+from transformers import AutoTokenizer
+from document_processor import DocumentProcessor, MultiModalDocument
+from chunking import SourceAwareChunker
+import argparse
+import fitz
+import json
+import os
+import time
+
+
+def fixed_nodes(documents: List[MultiModalDocument]):
+    parser = SimpleNodeParser.from_defaults(chunk_size=256, chunk_overlap=30, include_metadata=True)
+    return parser.get_nodes_from_documents([
+        Document(
+            text=doc.text,
+            metadata={
+                **doc.metadata,
+                "source_type": doc.source_type,
+                "page_number": doc.page_number,
+                "timestamp": doc.timestamp
+            }
+        )
+        for doc in documents
+    ])
+
+
+def raw_pdf_pages(pdf_path: str) -> List[MultiModalDocument]:
+    """原本的頁面擷取：page.get_text()，不保留區塊邊界"""
+    file_name = os.path.basename(pdf_path)
+    with fitz.open(pdf_path) as pdf_doc:
+        return [
+            MultiModalDocument(
+                text=page.get_text(),
+                metadata={"file_name": file_name, "page": i + 1, "total_pages": len(pdf_doc)},
+                source_type="pdf",
+                page_number=i + 1
+            )
+            for i, page in enumerate(pdf_doc)
+        ]
+
+
+def measure(nodes, tokenizer, model=None, batch_size: int = 32) -> Dict:
+    contents = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    tokens = [len(tokenizer.encode(content, add_special_tokens=False)) for content in contents]
+    result = {
+        "nodes": len(nodes),
+        "embed_tokens": sum(tokens),
+        "mean_tokens_per_node": round(sum(tokens) / max(len(tokens), 1), 1),
+        "max_tokens_per_node": max(tokens, default=0),
+    }
+    if model is not None:
+        start = time.perf_counter()
+        model.encode(contents, batch_size=batch_size)
+        result["embed_s"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def reduction(before: Dict, after: Dict) -> Dict:
+    result = {
+        "nodes": round(1 - after["nodes"] / max(before["nodes"], 1), 3),
+        "embed_tokens": round(1 - after["embed_tokens"] / max(before["embed_tokens"], 1), 3),
+    }
+    if "embed_s" in before:
+        result["embed_s"] = round(1 - after["embed_s"] / max(before["embed_s"], 1e-9), 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embed-model", default="BAAI/bge-large-zh-v1.5")
+    parser.add_argument("--pdf", nargs="*", default=["test_files/sample.pdf"])
+    parser.add_argument("--transcript", nargs="*", default=["test_files/sample_transcript.txt"])
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--window-seconds", type=float, default=60)
+    parser.add_argument("--embed", action="store_true", help="實際嵌入並計時")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.embed_model)
+    model = None
+    if args.embed:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(args.embed_model)
+        model.encode(["暖機"])
+
+    chunker = SourceAwareChunker(
+        chunk_size=args.chunk_size,
+        transcript_window_seconds=args.window_seconds,
+        tokenizer=lambda text: tokenizer.encode(text, add_special_tokens=False)
+    )
+    processor = DocumentProcessor()
+    sources = {}
+    for path in args.pdf:
+        sources[path] = (raw_pdf_pages(path), processor.process_pdf(path))
+    for path in args.transcript:
+        lines = processor.process_video_transcript(path, os.path.basename(path).rsplit(".", 1)[0] + ".mp4")
+        sources[path] = (lines, lines)
+
+    results = []
+    for path, (before_docs, after_docs) in sources.items():
+        before = measure(fixed_nodes(before_docs), tokenizer, model)
+        after = measure(chunker.get_nodes(after_docs), tokenizer, model)
+        results.append({
+            "source": path,
+            "fixed": before,
+            "source_aware": after,
+            "reduction": reduction(before, after),
+        })
+        print(json.dumps(results[-1], ensure_ascii=False), flush=True)
+
+    total_before = {key: sum(r["fixed"][key] for r in results) for key in ("nodes", "embed_tokens")}
+    total_after = {key: sum(r["source_aware"][key] for r in results) for key in ("nodes", "embed_tokens")}
+    print(json.dumps({
+        "embed_model": args.embed_model,
+        "results": results,
+        "total_reduction": reduction(total_before, total_after),
+    }, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
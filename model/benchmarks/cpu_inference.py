@@ -0,0 +1,207 @@
+"""CPU 推論：float32、int8 動態量化與 bf16 的記憶體 / 延遲 / 一致性比較
+
+    cd model
+    python -m benchmarks.cpu_inference --embed-model BAAI/bge-large-zh-v1.5 \
+        --llm yentinglin/Taiwan-LLM-7B-v2.0-base --modes fp32 int8 bf16
+
+每個設定在獨立的子行程中執行，peak_rss_mb 才不會互相影響。
+一致性以 fp32 為基準：嵌入看餘弦相似度與檢索 top-k 重疊率，
+LLM 看貪婪解碼輸出與 fp32 完全相同的比例及相同前綴長度。
+"""
+from typing import Dict, List, Optional
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import resource
+import sys
+import time
+
+TOPICS = ["機器學習", "卷積神經網路", "資料預處理", "特徵工程", "監督式學習", "梯度下降", "過擬合", "注意力機制"]
+
+PROMPTS = [
+    "什麼是機器學習？",
+    "請說明卷積神經網路的核心概念。",
+    "資料預處理有哪些步驟？",
+    "特徵工程的常見方法有哪些？",
+]
+
+
+def make_corpus(n_docs: int) -> List[str]:
+    return [
+        f"第 {i} 段：{TOPICS[i % len(TOPICS)]}是課程第 {i % 17 + 1} 週的主題，"
+        f"內容包含{TOPICS[(i * 3 + 1) % len(TOPICS)]}與{TOPICS[(i * 5 + 2) % len(TOPICS)]}的比較與實作練習。"
+        for i in range(n_docs)
+    ]
+
+
+def peak_rss_mb() -> float:
+    # Linux 的 ru_maxrss 單位為 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _quantization(mode: str) -> Optional[str]:
+    return None if mode == "fp32" else mode
+
+
+def run_embedding(args, mode: str) -> Dict:
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from cpu_inference import quantize_embedding_model
+    import torch
+    torch.set_num_threads(args.threads)
+
+    start = time.perf_counter()
+    embed_model = HuggingFaceEmbedding(model_name=args.embed_model, device="cpu")
+    if _quantization(mode):
+        quantize_embedding_model(embed_model, mode)
+    load_s = time.perf_counter() - start
+
+    corpus = make_corpus(args.docs)
+    embed_model.get_text_embedding_batch(corpus[:args.batch_size])  # 暖機
+    start = time.perf_counter()
+    vectors = []
+    for i in range(0, len(corpus), args.batch_size):
+        vectors.extend(embed_model.get_text_embedding_batch(corpus[i:i + args.batch_size]))
+    embed_s = time.perf_counter() - start
+
+    latencies = []
+    queries = []
+    for prompt in PROMPTS * 4:
+        start = time.perf_counter()
+        queries.append(embed_model.get_query_embedding(prompt))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "load_s": round(load_s, 2),
+        "docs_per_sec": round(len(corpus) / embed_s, 1),
+        "query_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "_vectors": vectors,
+        "_queries": queries[:len(PROMPTS)],
+    }
+
+
+def run_llm(args, mode: str) -> Dict:
+    from transformers import AutoTokenizer
+    from cpu_inference import load_cpu_llm
+    import torch
+    torch.set_num_threads(args.threads)
+
+    start = time.perf_counter()
+    tokenizer = AutoTokenizer.from_pretrained(args.llm, trust_remote_code=True)
+    model = load_cpu_llm(args.llm, _quantization(mode))
+    load_s = time.perf_counter() - start
+
+    outputs, latencies, new_tokens = [], [], 0
+    with torch.inference_mode():
+        for prompt in PROMPTS:
+            inputs = tokenizer(prompt, return_tensors="pt")
+            start = time.perf_counter()
+            generated = model.generate(
+                **inputs,
+                max_new_tokens=args.max_new_tokens,
+                do_sample=False,
+                num_beams=1,
+                pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+            tokens = generated[0, inputs["input_ids"].shape[1]:].tolist()
+            new_tokens += len(tokens)
+            outputs.append(tokens)
+    return {
+        "load_s": round(load_s, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "tokens_per_sec": round(new_tokens / (sum(latencies) / 1000), 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "_outputs": outputs,
+    }
+
+
+def _worker(fn, args, mode, queue):
+    sys.path.insert(0, ".")
+    queue.put(fn(args, mode))
+
+
+def in_subprocess(fn, args, mode: str) -> Dict:
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_worker, args=(fn, args, mode, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def embedding_parity(base: Dict, other: Dict, k: int) -> Dict:
+    a = np.asarray(base["_vectors"], dtype=np.float32)
+    b = np.asarray(other["_vectors"], dtype=np.float32)
+    cosine = np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    overlaps = []
+    for qa, qb in zip(base["_queries"], other["_queries"]):
+        top_a = set(np.argsort(-(a @ np.asarray(qa, dtype=np.float32)))[:k].tolist())
+        top_b = set(np.argsort(-(b @ np.asarray(qb, dtype=np.float32)))[:k].tolist())
+        overlaps.append(len(top_a & top_b) / k)
+    return {
+        "cosine_mean": round(float(cosine.mean()), 5),
+        "cosine_min": round(float(cosine.min()), 5),
+        f"top{k}_overlap": round(float(np.mean(overlaps)), 3),
+    }
+
+
+def generation_parity(base: Dict, other: Dict) -> Dict:
+    exact, prefix = 0, []
+    for a, b in zip(base["_outputs"], other["_outputs"]):
+        exact += a == b
+        n = 0
+        while n < min(len(a), len(b)) and a[n] == b[n]:
+            n += 1
+        prefix.append(n / max(len(a), 1))
+    return {
+        "exact_match": round(exact / len(base["_outputs"]), 3),
+        "common_prefix": round(float(np.mean(prefix)), 3),
+    }
+
+
+def public(result: Dict) -> Dict:
+    return {key: value for key, value in result.items() if not key.startswith("_")}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embed-model", default="BAAI/bge-large-zh-v1.5")
+    parser.add_argument("--llm", default="yentinglin/Taiwan-LLM-7B-v2.0-base")
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8", "bf16"])
+    parser.add_argument("--docs", type=int, default=512)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--skip-llm", action="store_true")
+    args = parser.parse_args()
+
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"]
+    embedding, llm = {}, {}
+    for mode in modes:
+        embedding[mode] = in_subprocess(run_embedding, args, mode)
+        print(json.dumps({"embedding": mode, **public(embedding[mode])}), flush=True)
+        if not args.skip_llm:
+            llm[mode] = in_subprocess(run_llm, args, mode)
+            print(json.dumps({"llm": mode, **public(llm[mode])}), flush=True)
+
+    results = {"embedding": [], "llm": []}
+    for mode in modes:
+        results["embedding"].append({
+            "mode": mode,
+            **public(embedding[mode]),
+            **embedding_parity(embedding["fp32"], embedding[mode], args.top_k)
+        })
+        if mode in llm:
+            results["llm"].append({
+                "mode": mode,
+                **public(llm[mode]),
+                **generation_parity(llm["fp32"], llm[mode])
+            })
+    print(json.dumps({"embed_model": args.embed_model, "llm": args.llm, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""動態批次生成的吞吐量與延遲比較
+
+    cd model
+    python -m benchmarks.generation_batching --model yentinglin/Taiwan-LLM-7B-v2.0-base \
+        --concurrency 16 --windows 0 5 20 50 --max-batch 1 4 8
+
+max_batch=1 即為逐一生成的基準。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from generation_batcher import GenerationBatcher
+from transformers import AutoTokenizer, AutoModelForCausalLM
+import argparse
+import json
+import numpy as np
+import time
+import torch
+
+PROMPTS = [
+    "什麼是機器學習？",
+    "請說明卷積神經網路的核心概念。",
+    "資料預處理有哪些步驟？",
+    "特徵工程的常見方法有哪些？",
+    "監督式學習與非監督式學習的差別是什麼？",
+    "深度學習中的神經網路是由什麼組成的？",
+]
+
+
+def run_setting(model, tokenizer, args, window_ms: float, max_batch: int):
+    batcher = GenerationBatcher(
+        model,
+        tokenizer,
+        max_batch_size=max_batch,
+        batch_window_ms=window_ms,
+        max_new_tokens=args.max_new_tokens,
+        generate_kwargs={"do_sample": False, "num_beams": args.num_beams}
+    )
+
+    def one_request(i: int) -> float:
+        start = time.perf_counter()
+        batcher.generate(PROMPTS[i % len(PROMPTS)])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = np.asarray(list(pool.map(one_request, range(args.requests)))) * 1000
+    wall = time.perf_counter() - start
+    stats = batcher.stats()
+    batcher.close()
+    return {
+        "batch_window_ms": window_ms,
+        "max_batch_size": max_batch,
+        "throughput_rps": round(args.requests / wall, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1),
+        "avg_batch_size": round(stats["avg_batch_size"], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="yentinglin/Taiwan-LLM-7B-v2.0-base")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 5, 20, 50])
+    parser.add_argument("--max-batch", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--num-beams", type=int, default=1)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(
+        args.model,
+        trust_remote_code=True,
+        torch_dtype=torch.float16 if args.device == "cuda" else torch.float32
+    ).to(args.device)
+    model.eval()
+
+    results = []
+    for max_batch in args.max_batch:
+        # max_batch=1 時視窗沒有意義，只跑一次
+        windows = [0] if max_batch == 1 else args.windows
+        for window_ms in windows:
+            results.append(run_setting(model, tokenizer, args, window_ms, max_batch))
+            print(json.dumps(results[-1]), flush=True)
+
+    print(json.dumps({"model": args.model, "device": args.device, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""cross-encoder 重新排序的延遲 / 品質 / 提示長度取捨
+
+    cd model
+    python -m benchmarks.rerank_tradeoff --rerank-model BAAI/bge-reranker-base \
+        --pools 10 20 50 --batch-sizes 8 32 --top-k 3
+
+以合成的課程週次語料建立索引，每個查詢只有一個正確片段。
+基準為不重新排序、直接取 top_k（含較大的 top_k 作對照），
+其餘設定先取 pool 個候選再由 cross-encoder 挑出 top_k。
+cold 為清空分數快取後的延遲，warm 為同一批查詢再跑一次（全部命中快取）。
+"""
+from typing import Dict, List
+from contextlib import redirect_stdout
+from llama_index.core.schema import MetadataMode
+from transformers import AutoTokenizer
+from multimodal_rag import MultiModalRAG
+from document_processor import MultiModalDocument
+from reranker import CrossEncoderReranker
+import argparse
+import io
+import json
+import numpy as np
+import tempfile
+import time
+import torch
+
+COURSES = ["人工智慧導論", "機器學習", "深度學習", "資料探勘", "電腦視覺", "自然語言處理"]
+TOPICS = ["線性迴歸", "邏輯迴歸", "決策樹", "支持向量機", "卷積神經網路", "循環神經網路",
+          "注意力機制", "生成對抗網路", "強化學習", "聚類分析", "降維", "特徵工程",
+          "模型評估", "正規化", "最佳化方法", "遷移學習"]
+
+
+def make_corpus(weeks: int):
+    documents, queries = [], []
+    for c, course in enumerate(COURSES):
+        for week in range(1, weeks + 1):
+            topic = TOPICS[(c * 3 + week) % len(TOPICS)]
+            homework = TOPICS[(c * 5 + week * 7) % len(TOPICS)]
+            # 主題相同、課程或週次不同的片段互為干擾項
+            documents.append(MultiModalDocument(
+                text=f"{course} 第 {week} 週的課程主題是{topic}，課後作業要實作{homework}。",
+                metadata={"course_name": course, "week": week},
+                source_type="text"
+            ))
+            queries.append((f"{course}第 {week} 週的作業要做什麼？", course, week))
+    return documents, queries
+
+
+def run_setting(rag: MultiModalRAG, queries, tokenizer, top_k: int, reranker=None, pool: int = 0, batch_size: int = 0) -> Dict:
+    rag.reranker = reranker
+    if reranker is not None:
+        reranker.batch_size = batch_size
+        reranker.clear()
+        rag.rerank_candidates = pool
+
+    def one_pass():
+        latencies, hits, reciprocal_ranks, prompt_tokens = [], 0, [], []
+        for query_text, course, week in queries:
+            start = time.perf_counter()
+            with redirect_stdout(io.StringIO()):
+                sources = rag.retrieve(query_text, top_k=top_k)["sources"]
+            latencies.append((time.perf_counter() - start) * 1000)
+            rank = next((
+                i + 1 for i, source in enumerate(sources)
+                if source["metadata"].get("course_name") == course and source["metadata"].get("week") == week
+            ), None)
+            hits += rank is not None
+            reciprocal_ranks.append(1 / rank if rank else 0.0)
+            prompt_tokens.append(sum(len(tokenizer.encode(source["text"], add_special_tokens=False)) for source in sources))
+        return np.asarray(latencies), hits / len(queries), float(np.mean(reciprocal_ranks)), float(np.mean(prompt_tokens))
+
+    cold, hit_rate, mrr, tokens = one_pass()
+    warm = one_pass()[0] if reranker is not None else cold
+    return {
+        "top_k": top_k,
+        "rerank_pool": pool or None,
+        "rerank_batch_size": batch_size or None,
+        f"hit@{top_k}": round(hit_rate, 3),
+        "mrr": round(mrr, 3),
+        "prompt_tokens": round(tokens, 1),
+        "cold_p50_ms": round(float(np.percentile(cold, 50)), 2),
+        "cold_p95_ms": round(float(np.percentile(cold, 95)), 2),
+        "warm_p50_ms": round(float(np.percentile(warm, 50)), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--embed-model", default="BAAI/bge-large-zh-v1.5")
+    parser.add_argument("--rerank-model", default="BAAI/bge-reranker-base")
+    parser.add_argument("--tokenizer", default="yentinglin/Taiwan-LLM-7B-v2.0-base", help="計算提示 token 數用的 LLM 分詞器")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--weeks", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--baseline-top-k", type=int, nargs="+", default=[10])
+    parser.add_argument("--pools", type=int, nargs="+", default=[10, 20, 50])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--no-hybrid", action="store_true")
+    args = parser.parse_args()
+
+    documents, queries = make_corpus(args.weeks)
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+    with tempfile.TemporaryDirectory() as folder:
+        rag = MultiModalRAG(
+            index_folder=folder,
+            embed_model_name=args.embed_model,
+            device=args.device,
+            answer_cache=False,
+            embedding_cache=False,
+            hybrid_search=not args.no_hybrid,
+            load_llm=False
+        )
+        rag.add_documents(documents)
+        reranker = CrossEncoderReranker(args.rerank_model, device=args.device)
+
+        results = []
+        for top_k in [args.top_k] + args.baseline_top_k:
+            results.append(run_setting(rag, queries, tokenizer, top_k))
+            print(json.dumps(results[-1]), flush=True)
+        for pool in args.pools:
+            for batch_size in args.batch_sizes:
+                results.append(run_setting(rag, queries, tokenizer, args.top_k, reranker, pool, batch_size))
+                print(json.dumps(results[-1]), flush=True)
+        rag.close()
+
+    print(json.dumps({
+        "embed_model": args.embed_model,
+        "rerank_model": args.rerank_model,
+        "documents": len(documents),
+        "queries": len(queries),
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
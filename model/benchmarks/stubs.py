@@ -0,0 +1,113 @@
+"""離線用的極小嵌入模型與 LLM，讓基準測試不需下載模型、不需 GPU
+
+    from benchmarks.stubs import StubEmbedding, StubLLM
+    rag = MultiModalRAG(embed_model=StubEmbedding(), llm=StubLLM(), device="cpu")
+
+StubEmbedding 以雜湊的字元 unigram / bigram 計數產生向量，相同的字詞會落在同一維，
+檢索結果仍有意義；StubLLM 回傳上下文的第一行，可設定固定延遲與每個 token 的生成時間，
+用來模擬生成的成本。兩者皆為確定性的輸出。
+"""
+from typing import Any, List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.base.llms.types import CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+import numpy as np
+import time
+import zlib
+
+BOS_TOKEN_ID = 1
+
+
+class CharTokenizer:
+    """每個字元一個 token，介面與 transformers 分詞器的 encode / decode 相同"""
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> List[int]:
+        ids = [ord(char) for char in text]
+        return [BOS_TOKEN_ID] + ids if add_special_tokens else ids
+
+    def decode(self, token_ids: List[int], skip_special_tokens: bool = False) -> str:
+        return "".join(
+            chr(token_id) for token_id in token_ids
+            if not (skip_special_tokens and token_id == BOS_TOKEN_ID)
+        )
+
+
+class StubEmbedding(BaseEmbedding):
+    """雜湊字元 n-gram 的詞袋向量（L2 正規化）"""
+
+    model_name: str = "stub-embedding"
+    dim: int = 256
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        grams = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+        for gram in grams:
+            if not gram.isspace():
+                # crc32 而非 hash()，向量才不會隨行程的雜湊種子改變
+                vector[zlib.crc32(gram.encode("utf-8")) % self.dim] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [self._vector(text) for text in texts]
+
+
+class StubLLM(CustomLLM):
+    """回傳提示中上下文的第一行（最多 max_new_tokens 個字元）"""
+
+    context_window: int = 512
+    max_new_tokens: int = 128
+    latency_ms: float = 0.0  # 每次呼叫的固定延遲，模擬 prefill
+    ms_per_token: float = 0.0  # 每個生成 token 的延遲
+
+    _tokenizer: CharTokenizer = PrivateAttr(default_factory=CharTokenizer)
+
+    @property
+    def tokenizer(self) -> CharTokenizer:
+        return self._tokenizer
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.max_new_tokens,
+            model_name="stub-llm"
+        )
+
+    def _answer(self, prompt: str) -> str:
+        # 提示模板以一行 "----" 包住上下文
+        parts = prompt.split("----------------")
+        context = parts[1] if len(parts) > 2 else prompt
+        lines = [line.strip() for line in context.splitlines() if line.strip()]
+        return (lines[0] if lines else "")[:self.max_new_tokens]
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        text = self._answer(prompt)
+        time.sleep((self.latency_ms + self.ms_per_token * len(text)) / 1000)
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        answer = self._answer(prompt)
+
+        def gen() -> CompletionResponseGen:
+            time.sleep(self.latency_ms / 1000)
+            text = ""
+            for delta in answer:
+                time.sleep(self.ms_per_token / 1000)
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
@@ -0,0 +1,394 @@
+"""可重現的匯入 / 查詢負載測試，取代 multimodal_test.py 只印出結果的手動檢查
+
+    cd model
+    # 不需網路與 GPU：stub 模型、合成語料、在程式內直接呼叫 MultiModalRAG
+    python -m benchmarks.suite --stub --pdfs 8 --pages 20 --videos 8 --lines 200 \
+        --ingest-concurrency 4 --query-concurrency 1 8 32 --output suite.json
+    # 經由 FastAPI app（程式內的 ASGI 用戶端，含路由、驗證與執行緒池）
+    python -m benchmarks.suite --stub --target app
+    # 對已啟動的伺服器：合成語料會寫入伺服器的索引，須另加 --allow-writes
+    python -m benchmarks.suite --target http://localhost:8000 --allow-writes
+
+語料依 --seed 產生：PDF 每頁一個編號標題加數段課程內容，字幕為 "HH:MM:SS 文字" 格式，
+查詢由同一組課程與主題組成。匯入以 ingest_concurrency 個執行緒同時上傳檔案，
+查詢對每個 query_concurrency 各送 --queries 個請求（retrieve 與 query 兩種模式）；
+query_batch 模式把所有查詢放進一個批次請求，延遲為每個結果送達的時間。
+
+輸出 JSON：匯入的 docs_per_s（PDF 頁與字幕行）/ nodes_per_s、各模式與並行數的
+qps 及 p50/p95/p99 延遲、行程的 peak_rss_mb，以及 metrics 記錄的各階段延遲；
+對遠端伺服器時只有用戶端量得到的數字。加上 --baseline 舊結果.json 會列出相對變化。
+"""
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+import argparse
+import fitz
+import json
+import logging
+import numpy as np
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+
+COURSES = ["人工智慧導論", "機器學習", "深度學習", "資料探勘", "電腦視覺", "自然語言處理"]
+TOPICS = ["線性迴歸", "邏輯迴歸", "決策樹", "支持向量機", "卷積神經網路", "循環神經網路",
+          "注意力機制", "生成對抗網路", "強化學習", "聚類分析", "降維", "特徵工程",
+          "模型評估", "正規化", "最佳化方法", "遷移學習"]
+PHRASES = ["的核心概念是", "常見的應用包括", "實作時要注意", "與其他方法相比", "的數學基礎是",
+           "在實務上經常搭配", "的缺點在於", "課堂範例使用"]
+QUERY_TEMPLATES = ["{course}中{topic}的核心概念是什麼？", "{topic}實作時要注意什麼？",
+                   "{topic}與{other}有什麼差別？", "{course}課堂範例如何使用{topic}？"]
+MODES = ("retrieve", "query", "query_batch")
+
+
+def peak_rss_mb() -> float:
+    # Linux 的 ru_maxrss 單位為 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _sentence(rng: random.Random, course: str) -> str:
+    topic, other = rng.sample(TOPICS, 2)
+    return f"{course}中，{topic}{rng.choice(PHRASES)}{other}，並以第 {rng.randint(1, 18)} 週的作業練習。"
+
+
+def write_pdf(path: str, rng: random.Random, course: str, pages: int):
+    with fitz.open() as pdf_doc:
+        for page_num in range(pages):
+            page = pdf_doc.new_page()
+            blocks = [f"{page_num + 1}. {rng.choice(TOPICS)}"]
+            blocks += ["".join(_sentence(rng, course) for _ in range(rng.randint(2, 5))) for _ in range(3)]
+            # china-t 為 PyMuPDF 內建的繁體中文字型
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), "\n\n".join(blocks), fontname="china-t", fontsize=10)
+        pdf_doc.save(path)
+
+
+def write_transcript(path: str, rng: random.Random, course: str, lines: int):
+    seconds = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(lines):
+            seconds += rng.randint(3, 12)
+            timestamp = f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+            f.write(f"{timestamp} {_sentence(rng, course)}\n")
+
+
+def make_corpus(folder: str, args) -> Dict:
+    """產生合成 PDF、字幕與查詢；相同的 seed 產生相同的語料"""
+    rng = random.Random(args.seed)
+    pdfs, transcripts = [], []
+    for i in range(args.pdfs):
+        path = os.path.join(folder, f"lecture_{i:03d}.pdf")
+        write_pdf(path, rng, COURSES[i % len(COURSES)], args.pages)
+        pdfs.append(path)
+    for i in range(args.videos):
+        path = os.path.join(folder, f"lecture_{i:03d}.txt")
+        write_transcript(path, rng, COURSES[i % len(COURSES)], args.lines)
+        transcripts.append(path)
+    queries = []
+    for _ in range(args.queries):
+        topic, other = rng.sample(TOPICS, 2)
+        queries.append(rng.choice(QUERY_TEMPLATES).format(course=rng.choice(COURSES), topic=topic, other=other))
+    return {
+        "pdfs": pdfs,
+        "transcripts": transcripts,
+        "queries": queries,
+        "documents": args.pdfs * args.pages + args.videos * args.lines,
+    }
+
+
+class LocalTarget:
+    """在同一個行程內直接呼叫 MultiModalRAG"""
+
+    def __init__(self, rag):
+        self.rag = rag
+
+    def add_pdf(self, path: str):
+        self.rag.add_pdf(path)
+
+    def add_video(self, path: str):
+        self.rag.add_video(os.path.basename(path).rsplit(".", 1)[0] + ".mp4", path)
+
+    def request(self, mode: str, query_text: str, top_k: int):
+        if mode == "retrieve":
+            self.rag.retrieve(query_text, top_k=top_k)
+        else:
+            self.rag.query(query_text, top_k=top_k)
+
+    def query_batch(self, queries: List[str], top_k: int):
+        return self.rag.query_batch(queries, top_k=top_k)
+
+
+class HTTPTarget:
+    """經由 HTTP API；client 為 httpx.Client 或 FastAPI 的 TestClient"""
+
+    def __init__(self, client, retries: int = 50):
+        self.client = client
+        self.retries = retries
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _post(self, path: str, **kwargs):
+        # 伺服器的執行緒池滿了會回 503，稍後重試並計入 rejected
+        for _ in range(self.retries):
+            response = self.client.post(path, **kwargs)
+            if response.status_code != 503:
+                response.raise_for_status()
+                return response
+            with self._lock:
+                self.rejected += 1
+            time.sleep(float(response.headers.get("Retry-After", 1)) / 10)
+        response.raise_for_status()
+
+    def add_pdf(self, path: str):
+        with open(path, "rb") as f:
+            self._post("/add_pdf", files={"file": (os.path.basename(path), f.read(), "application/pdf")})
+
+    def add_video(self, path: str):
+        with open(path, "rb") as f:
+            self._post(
+                "/add_video_transcript",
+                files={"transcript": (os.path.basename(path), f.read(), "text/plain")},
+                data={"video_name": os.path.basename(path).rsplit(".", 1)[0] + ".mp4"}
+            )
+
+    def request(self, mode: str, query_text: str, top_k: int):
+        self._post(f"/{mode}", json={"query": query_text, "top_k": top_k})
+
+    def query_batch(self, queries: List[str], top_k: int):
+        with self.client.stream("POST", "/query_batch", json={"queries": queries, "top_k": top_k}) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+def run_parallel(fn, items: List, concurrency: int) -> Dict:
+    """以 concurrency 個執行緒處理 items，回傳牆鐘時間、各項延遲與錯誤"""
+    latencies: List[Optional[float]] = [None] * len(items)
+    errors: List[str] = []
+
+    def one(i: int):
+        start = time.perf_counter()
+        try:
+            fn(items[i])
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies[i] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(len(items))))
+    return {
+        "wall_s": time.perf_counter() - start,
+        "latencies_ms": np.asarray([latency for latency in latencies if latency is not None]),
+        "errors": errors,
+    }
+
+
+def percentiles(latencies: np.ndarray) -> Dict[str, float]:
+    if not latencies.size:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+
+def run_ingest(target, corpus: Dict, concurrency: int, count_nodes) -> Dict:
+    jobs = [(target.add_pdf, path) for path in corpus["pdfs"]]
+    jobs += [(target.add_video, path) for path in corpus["transcripts"]]
+    nodes_before = count_nodes()
+    run = run_parallel(lambda job: job[0](job[1]), jobs, concurrency)
+    nodes = None if nodes_before is None else count_nodes() - nodes_before
+    return {
+        "concurrency": concurrency,
+        "files": len(jobs),
+        "documents": corpus["documents"],
+        "nodes": nodes,
+        "wall_s": round(run["wall_s"], 3),
+        "docs_per_s": round(corpus["documents"] / run["wall_s"], 2),
+        "nodes_per_s": None if nodes is None else round(nodes / run["wall_s"], 2),
+        "file_latency": percentiles(run["latencies_ms"]),
+        "errors": len(run["errors"]),
+        "first_error": run["errors"][0] if run["errors"] else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_queries(target, queries: List[str], mode: str, concurrency: int, top_k: int) -> Dict:
+    run = run_parallel(lambda query_text: target.request(mode, query_text, top_k), queries, concurrency)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": len(queries),
+        "qps": round(run["latencies_ms"].size / run["wall_s"], 2),
+        **percentiles(run["latencies_ms"]),
+        "errors": len(run["errors"]),
+        "first_error": run["errors"][0] if run["errors"] else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_query_batch(target, queries: List[str], top_k: int) -> Dict:
+    start = time.perf_counter()
+    latencies, errors = [], []
+    for event in target.query_batch(queries, top_k):
+        if event["event"] == "result":
+            latencies.append((time.perf_counter() - start) * 1000)
+        elif event["event"] == "error":
+            errors.append(event["detail"])
+    wall_s = time.perf_counter() - start
+    return {
+        "mode": "query_batch",
+        "concurrency": 1,
+        "requests": len(queries),
+        "qps": round(len(latencies) / wall_s, 2),
+        **percentiles(np.asarray(latencies)),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def build_rag(args, folder: str, load_llm: bool):
+    from multimodal_rag import MultiModalRAG
+    kwargs = {}
+    if args.stub:
+        from benchmarks.stubs import StubEmbedding, StubLLM
+        kwargs["embed_model"] = StubEmbedding()
+        kwargs["llm"] = StubLLM(latency_ms=args.llm_latency_ms, ms_per_token=args.llm_ms_per_token)
+    return MultiModalRAG(
+        index_folder=folder,
+        model_name=args.model,
+        embed_model_name=args.embed_model,
+        device=args.device,
+        # 重複的查詢不應該直接命中快取，除非要量的就是快取
+        answer_cache=args.answer_cache,
+        embedding_cache=args.embedding_cache,
+        load_llm=load_llm,
+        **kwargs
+    )
+
+
+def compare(result: Dict, baseline: Dict) -> Dict:
+    """主要指標相對於 baseline 的比例（> 1 表示數值變大）"""
+    def ratio(new, old):
+        return round(new / old, 3) if new is not None and old else None
+
+    comparison = {"ingest_docs_per_s": ratio(result["ingest"]["docs_per_s"], baseline["ingest"]["docs_per_s"])}
+    old_queries = {(q["mode"], q["concurrency"]): q for q in baseline.get("queries", [])}
+    for q in result["queries"]:
+        old = old_queries.get((q["mode"], q["concurrency"]))
+        if old is not None:
+            comparison[f"{q['mode']}_c{q['concurrency']}_qps"] = ratio(q["qps"], old["qps"])
+            comparison[f"{q['mode']}_c{q['concurrency']}_p95"] = ratio(q["p95_ms"], old["p95_ms"])
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="local", help="local、app 或伺服器網址（如 http://localhost:8000）")
+    parser.add_argument("--allow-writes", action="store_true", help="允許對伺服器網址匯入合成語料（會寫入該伺服器的索引）")
+    parser.add_argument("--stub", action="store_true", help="使用 benchmarks.stubs 的嵌入模型與 LLM")
+    parser.add_argument("--embed-model", default="BAAI/bge-large-zh-v1.5")
+    parser.add_argument("--model", default="yentinglin/Taiwan-LLM-7B-v2.0-base")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--llm-latency-ms", type=float, default=0, help="stub LLM 每次呼叫的固定延遲")
+    parser.add_argument("--llm-ms-per-token", type=float, default=0, help="stub LLM 每個 token 的延遲")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--lines", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=200, help="每個並行數送出的查詢數")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--ingest-concurrency", type=int, default=4)
+    parser.add_argument("--query-concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--embedding-cache", action="store_true")
+    parser.add_argument("--baseline", help="先前的結果 JSON，列出相對變化")
+    parser.add_argument("--output", help="結果另存的 JSON 檔")
+    parser.add_argument("--verbose", action="store_true", help="保留系統本身的輸出，並顯示每次匯入與查詢的計時")
+    args = parser.parse_args()
+    if args.target.startswith("http") and not args.allow_writes:
+        parser.error("--target 為伺服器網址時會把合成語料寫入其索引；請改用 --target app，或加上 --allow-writes 指向可丟棄的伺服器")
+
+    from metrics import METRICS
+    METRICS.reset()
+    local = not args.target.startswith("http")
+    devnull = open(os.devnull, "w")
+    quiet = nullcontext if args.verbose else lambda: redirect_stdout(devnull)
+    if args.verbose:
+        # 每次匯入與查詢的計時記錄在 DEBUG 層級
+        logging.basicConfig(format="%(name)s: %(message)s")
+        for name in ("multimodal_rag", "reranker"):
+            logging.getLogger(name).setLevel(logging.DEBUG)
+
+    with tempfile.TemporaryDirectory() as folder:
+        corpus_dir = os.path.join(folder, "corpus")
+        os.makedirs(corpus_dir)
+        corpus = make_corpus(corpus_dir, args)
+
+        rag = None
+        count_nodes = lambda: None
+        with quiet():
+            if local:
+                rag = build_rag(args, os.path.join(folder, "storage"), load_llm=any(mode.startswith("query") for mode in args.modes))
+                count_nodes = lambda: len(rag.index.index_struct.nodes_dict) if rag.index else 0
+            if args.target == "local":
+                target = LocalTarget(rag)
+            elif args.target == "app":
+                from fastapi.testclient import TestClient
+                import multimodal_main
+                # 不進入 TestClient 的 context，startup 不會執行，改用這裡建好的實例
+                multimodal_main.rag_instance = rag
+                target = HTTPTarget(TestClient(multimodal_main.app))
+            else:
+                import httpx
+                target = HTTPTarget(httpx.Client(base_url=args.target, timeout=300))
+
+        with quiet():
+            ingest = run_ingest(target, corpus, args.ingest_concurrency, count_nodes)
+        print(json.dumps({"ingest": ingest}, ensure_ascii=False), flush=True)
+
+        queries = []
+        for mode in args.modes:
+            if mode == "query_batch":
+                with quiet():
+                    run_query_batch(target, corpus["queries"][:8], args.top_k)
+                    queries.append(run_query_batch(target, corpus["queries"], args.top_k))
+                print(json.dumps(queries[-1], ensure_ascii=False), flush=True)
+                continue
+            for concurrency in args.query_concurrency:
+                with quiet():
+                    # 暖機：建立查詢引擎、載入分詞器等一次性成本不計入
+                    run_queries(target, corpus["queries"][:concurrency], mode, concurrency, args.top_k)
+                    queries.append(run_queries(target, corpus["queries"], mode, concurrency, args.top_k))
+                print(json.dumps(queries[-1], ensure_ascii=False), flush=True)
+
+        if rag is not None:
+            rag.close()
+
+    result = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "verbose")},
+        "ingest": ingest,
+        "queries": queries,
+        # 對遠端伺服器時只量得到用戶端本身的記憶體
+        "peak_rss_mb": round(peak_rss_mb(), 1) if local else None,
+        "rejected": getattr(target, "rejected", 0),
+        "stages": METRICS.snapshot()["stages"] if local else None,
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            result["comparison"] = compare(result, json.load(f))
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
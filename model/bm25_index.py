@@ -0,0 +1,218 @@
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from array import array
+from collections import Counter
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+
+BM25_FNAME = "bm25_index.npz"
+
+# 英數詞（CNN、cs101、112-1、v2.0）整個保留；中日韓文字切成相鄰雙字
+_TOKEN_PATTERN = re.compile(
+    r"[a-z0-9]+(?:[._\-][a-z0-9]+)*"
+    r"|[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """全半形統一、小寫後，英數取整個詞，CJK 連續字串取雙字（單一字時取單字）"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens
+
+
+class BM25Index:
+    """可增量更新的 BM25 倒排索引
+
+    每個詞對應 (文件編號, 詞頻) 兩個緊湊陣列，文件長度放在可成長的 NumPy 陣列；
+    新增文件只追加到對應的列表，不需要重建。以節點 id 識別文件，重複加入會略過。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, max_postings: int = 500000):
+        self.k1 = k1
+        self.b = b
+        # 單次查詢最多走訪的 posting 數，超過時略過剩下的低 idf 詞
+        self.max_postings = max_postings
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._node_ids: List[str] = []
+        self._doc_ids: Dict[str, int] = {}
+        self._lengths = np.empty(1024, dtype=np.int32)
+        self._total_length = 0
+        self._postings: Dict[str, Tuple[array, array]] = {}
+
+    @property
+    def n_docs(self) -> int:
+        return len(self._node_ids)
+
+    def add(self, node_ids: Sequence[str], texts: Sequence[str]):
+        with self._lock:
+            for node_id, text in zip(node_ids, texts):
+                if node_id in self._doc_ids:
+                    continue
+                doc_id = len(self._node_ids)
+                tokens = tokenize(text)
+                if doc_id >= self._lengths.shape[0]:
+                    grown = np.empty(self._lengths.shape[0] * 2, dtype=np.int32)
+                    grown[:doc_id] = self._lengths[:doc_id]
+                    self._lengths = grown
+                self._lengths[doc_id] = len(tokens)
+                self._total_length += len(tokens)
+                self._node_ids.append(node_id)
+                self._doc_ids[node_id] = doc_id
+                for term, tf in Counter(tokens).items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array("i"), array("i"))
+                    postings[0].append(doc_id)
+                    postings[1].append(tf)
+
+    def _scores(self, query: str, deadline: Optional[float] = None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """回傳 (文件編號, BM25 分數)，只包含至少命中一個詞的文件；超過 deadline 時回傳 None"""
+        n_docs = self.n_docs
+        if not n_docs:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        avgdl = self._total_length / n_docs
+        terms = []
+        for term, query_tf in Counter(tokenize(query)).items():
+            postings = self._postings.get(term)
+            if postings:
+                df = len(postings[0])
+                idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                terms.append((idf, query_tf, postings))
+        terms.sort(key=lambda item: -item[0])
+
+        doc_parts, score_parts = [], []
+        visited = 0
+        for idf, query_tf, (docs, tfs) in terms:
+            if visited and visited + len(docs) > self.max_postings:
+                break
+            if deadline is not None and time.monotonic() > deadline:
+                return None
+            visited += len(docs)
+            docs = np.array(docs, dtype=np.int64)
+            tfs = np.array(tfs, dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[docs] / avgdl)
+            doc_parts.append(docs)
+            score_parts.append(query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm))
+        if not doc_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(doc_parts) == 1:
+            return doc_parts[0], score_parts[0]
+        docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        return docs, np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        allowed: Optional[Set[str]] = None,
+        deadline: Optional[float] = None
+    ) -> Optional[List[Tuple[str, float]]]:
+        """回傳分數最高的 k 個 (節點 id, 分數)；allowed 為允許的節點 id（metadata 過濾的結果）
+
+        deadline 為 time.monotonic() 的時間點：等不到鎖或計分途中超過時放棄並回傳 None，
+        逾時的查詢不會繼續佔住索引，讓後面的查詢排隊。
+        """
+        if deadline is None:
+            timeout = -1
+        else:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                return None
+        if not self._lock.acquire(timeout=timeout):
+            return None
+        try:
+            scored = self._scores(query, deadline)
+            if scored is None:
+                return None
+            docs, scores = scored
+            if allowed is not None:
+                if len(allowed) < docs.shape[0]:
+                    # 符合條件的節點比命中的文件少：換成文件編號一次過濾
+                    allowed_docs = np.fromiter(
+                        (self._doc_ids[node_id] for node_id in allowed if node_id in self._doc_ids),
+                        dtype=np.int64
+                    )
+                    keep = np.isin(docs, allowed_docs)
+                else:
+                    keep = np.fromiter(
+                        (self._node_ids[doc] in allowed for doc in docs),
+                        dtype=bool,
+                        count=docs.shape[0]
+                    )
+                docs, scores = docs[keep], scores[keep]
+            if k < docs.shape[0]:
+                top = np.argpartition(-scores, k - 1)[:k]
+                order = top[np.argsort(-scores[top], kind="stable")]
+            else:
+                order = np.argsort(-scores, kind="stable")
+            return [(self._node_ids[docs[i]], float(scores[i])) for i in order]
+        finally:
+            self._lock.release()
+
+    def save(self, persist_dir: str):
+        """詞彙與各詞的 posting 串接成一個 .npz"""
+        with self._lock:
+            terms = list(self._postings)
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            for i, term in enumerate(terms):
+                offsets[i + 1] = offsets[i] + len(self._postings[term][0])
+            docs = np.empty(offsets[-1], dtype=np.int32)
+            tfs = np.empty(offsets[-1], dtype=np.int32)
+            for i, term in enumerate(terms):
+                docs[offsets[i]:offsets[i + 1]] = self._postings[term][0]
+                tfs[offsets[i]:offsets[i + 1]] = self._postings[term][1]
+            arrays = {
+                "node_ids": np.asarray(self._node_ids, dtype=str),
+                "lengths": self._lengths[:self.n_docs].copy(),
+                "terms": np.asarray(terms, dtype=str),
+                "offsets": offsets,
+                "docs": docs,
+                "tfs": tfs,
+            }
+
+        path = os.path.join(persist_dir, BM25_FNAME)
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def load(self, persist_dir: str) -> bool:
+        path = os.path.join(persist_dir, BM25_FNAME)
+        if not os.path.exists(path):
+            return False
+        with np.load(path) as data:
+            node_ids = data["node_ids"].tolist()
+            lengths = data["lengths"]
+            terms = data["terms"].tolist()
+            offsets = data["offsets"]
+            docs = data["docs"]
+            tfs = data["tfs"]
+        with self._lock:
+            self.reset()
+            self._node_ids = node_ids
+            self._doc_ids = {node_id: i for i, node_id in enumerate(node_ids)}
+            self._lengths = np.empty(max(1024, len(node_ids)), dtype=np.int32)
+            self._lengths[:len(node_ids)] = lengths
+            self._total_length = int(lengths.sum())
+            for i, term in enumerate(terms):
+                start, end = offsets[i], offsets[i + 1]
+                self._postings[term] = (
+                    array("i", docs[start:end].tobytes()),
+                    array("i", tfs[start:end].tobytes())
+                )
+        return True
@@ -0,0 +1,94 @@
+from typing import Any, AsyncIterator, Callable
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
+
+
+class ExecutorSaturated(Exception):
+    """等待中的工作已達上限"""
+
+
+class BoundedExecutor:
+    """有排隊上限的執行緒池
+
+    同時最多 max_workers 個工作在執行，另外最多 max_queue 個在排隊；
+    超過時直接拋出 ExecutorSaturated，讓伺服器回 503 而不是無限制累積請求。
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _check(self):
+        if self._in_flight >= self.max_workers + self.max_queue:
+            self.rejected += 1
+            raise ExecutorSaturated(f"{self.name} executor is saturated")
+
+    def _acquire(self):
+        with self._lock:
+            self._check()
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, fn: Callable, *args: Any, **kwargs: Any) -> Any:
+        """在執行緒池中執行同步函式，不阻塞事件迴圈"""
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                functools.partial(fn, *args, **kwargs)
+            )
+        finally:
+            self._release()
+
+    def stream(self, fn: Callable, *args: Any, **kwargs: Any) -> AsyncIterator:
+        """在執行緒池中逐項取出同步產生器的結果
+
+        呼叫時若已額滿立即拋出 ExecutorSaturated（不保留名額）；
+        名額在開始迭代時才保留，串流結束或被取消時釋放，
+        因此從未開始迭代的串流（例如用戶端提早斷線）不會佔住名額。
+        開始迭代時才額滿的話，ExecutorSaturated 由迭代拋出。
+        """
+        with self._lock:
+            self._check()
+        return self._iterate(functools.partial(fn, *args, **kwargs))
+
+    async def _iterate(self, fn: Callable) -> AsyncIterator:
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            iterator = await loop.run_in_executor(self._executor, lambda: iter(fn()))
+            done = object()
+            while True:
+                item = await loop.run_in_executor(self._executor, next, iterator, done)
+                if item is done:
+                    break
+                yield item
+        finally:
+            self._release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
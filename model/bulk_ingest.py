@@ -0,0 +1,256 @@
+from typing import List, Dict, Any, Optional, Callable
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from document_processor import DocumentProcessor, MultiModalDocument
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+STATE_FNAME = "ingest_state.json"
+PDF_EXTENSIONS = (".pdf",)
+TRANSCRIPT_EXTENSIONS = (".txt",)
+
+
+def collect_items(directory: str = None, manifest: str = None) -> List[Dict[str, Any]]:
+    """從資料夾或清單檔收集要匯入的檔案
+
+    清單檔為 JSON 陣列或每行一個 JSON 物件，格式如：
+        {"type": "pdf", "path": "notes.pdf"}
+        {"type": "video", "path": "lecture.txt", "video_name": "lecture.mp4"}
+    資料夾模式下 .pdf 視為 PDF，.txt 視為同名影片（.mp4）的字幕。
+    """
+    items = []
+    if manifest:
+        base_dir = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+        entries = json.loads(content) if content.startswith("[") else [
+            json.loads(line) for line in content.splitlines() if line.strip()
+        ]
+        for entry in entries:
+            path = entry["path"]
+            if not os.path.isabs(path):
+                path = os.path.join(base_dir, path)
+            item = {"type": entry.get("type", "pdf"), "path": os.path.abspath(path)}
+            if item["type"] == "video":
+                item["video_name"] = entry.get(
+                    "video_name",
+                    os.path.splitext(os.path.basename(path))[0] + ".mp4"
+                )
+            items.append(item)
+
+    if directory:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                path = os.path.abspath(os.path.join(root, name))
+                lower = name.lower()
+                if lower.endswith(PDF_EXTENSIONS):
+                    items.append({"type": "pdf", "path": path})
+                elif lower.endswith(TRANSCRIPT_EXTENSIONS):
+                    items.append({
+                        "type": "video",
+                        "path": path,
+                        "video_name": os.path.splitext(name)[0] + ".mp4"
+                    })
+    return items
+
+
+def file_fingerprint(item: Dict[str, Any]) -> str:
+    """路徑 + 大小 + 修改時間，檔案變動後會重新匯入"""
+    stat = os.stat(item["path"])
+    return f"{item['path']}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def _extract_item(item: Dict[str, Any]) -> List[MultiModalDocument]:
+    """在子行程中擷取單一檔案的文件"""
+    processor = DocumentProcessor()
+    if item["type"] == "pdf":
+        return processor.process_pdf(item["path"])
+    if item["type"] == "video":
+        return processor.process_video_transcript(item["path"], item["video_name"])
+    raise ValueError(f"Unknown item type: {item['type']}")
+
+
+class BulkIngestJob:
+    """批次匯入多個 PDF / 字幕檔
+
+    多個擷取行程平行解析檔案，結果交給同一個批次嵌入與索引階段；
+    每完成 checkpoint_every 個檔案寫出一次索引並記錄已完成的檔案，
+    中斷後重新執行會略過已完成的檔案。
+    """
+
+    def __init__(
+        self,
+        rag,
+        items: List[Dict[str, Any]],
+        state_path: str = None,
+        extract_workers: int = 4,
+        checkpoint_every: int = 20,
+        batch_documents: int = 256
+    ):
+        self.rag = rag
+        self.items = items
+        self.state_path = state_path or os.path.join(rag.index_folder, STATE_FNAME)
+        self.extract_workers = max(1, extract_workers)
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.batch_documents = batch_documents
+
+        self.completed = self._load_state()
+        self.status = "pending"
+        self.processed = 0
+        self.skipped = 0
+        self.documents = 0
+        self.failed: Dict[str, str] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _load_state(self) -> set:
+        if not os.path.exists(self.state_path):
+            return set()
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return set(json.load(f).get("completed", []))
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"completed": sorted(self.completed)}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def _checkpoint(self, done: List[str]):
+        """先寫出索引，再記錄已完成的檔案"""
+        self.rag.persist()
+        self.completed.update(done)
+        self._save_state()
+        done.clear()
+
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+            return {
+                "status": self.status,
+                "total": len(self.items),
+                "processed": self.processed,
+                "skipped": self.skipped,
+                "failed": dict(self.failed),
+                "documents": self.documents,
+                "elapsed_seconds": round(elapsed, 2),
+                "files_per_second": round(self.processed / elapsed, 3) if elapsed else 0.0,
+            }
+
+    def run(self, progress_callback: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+        """執行匯入，回傳最終進度
+
+        讀不到的檔案記在 failed 中並繼續；無論如何結束，status 都會是 completed 或 failed。
+        """
+        with self._lock:
+            self.status = "running"
+            self.started_at = time.time()
+
+        status = "failed"
+        try:
+            todo = []
+            for item in self.items:
+                try:
+                    fingerprint = file_fingerprint(item)
+                except OSError as e:
+                    with self._lock:
+                        self.failed[item["path"]] = str(e)
+                    continue
+                if fingerprint in self.completed:
+                    with self._lock:
+                        self.skipped += 1
+                else:
+                    todo.append((fingerprint, item))
+
+            done: List[str] = []
+            batch: List[MultiModalDocument] = []
+            # spawn 避免在已載入模型與執行緒的行程中 fork
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=self.extract_workers, mp_context=context) as pool:
+                pending = {}
+                queue = list(reversed(todo))
+                while queue or pending:
+                    # 同時最多 2 * workers 個檔案在擷取中
+                    while queue and len(pending) < 2 * self.extract_workers:
+                        fingerprint, item = queue.pop()
+                        pending[pool.submit(_extract_item, item)] = (fingerprint, item)
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        fingerprint, item = pending.pop(future)
+                        try:
+                            documents = future.result()
+                        except Exception as e:
+                            with self._lock:
+                                self.failed[item["path"]] = str(e)
+                            continue
+
+                        for document in documents:
+                            batch.append(document)
+                            if len(batch) >= self.batch_documents:
+                                self.rag.add_documents(batch, persist=False)
+                                batch = []
+                        # 檔案的文件全部進入索引後才算完成
+                        self.rag.add_documents(batch, persist=False)
+                        batch = []
+                        done.append(fingerprint)
+                        with self._lock:
+                            self.processed += 1
+                            self.documents += len(documents)
+
+                        if len(done) >= self.checkpoint_every:
+                            self._checkpoint(done)
+                        if progress_callback:
+                            progress_callback(self.progress())
+
+            self._checkpoint(done)
+            status = "completed"
+        finally:
+            with self._lock:
+                self.status = status
+                self.finished_at = time.time()
+        return self.progress()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次匯入 PDF 與影片字幕")
+    parser.add_argument("--dir", dest="directory", help="要匯入的資料夾")
+    parser.add_argument("--manifest", help="JSON / JSONL 清單檔")
+    parser.add_argument("--index-folder", default="./storage")
+    parser.add_argument("--workers", type=int, default=4, help="擷取行程數")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="每幾個檔案寫出一次索引")
+    parser.add_argument("--batch-documents", type=int, default=256)
+    args = parser.parse_args()
+    if not args.directory and not args.manifest:
+        parser.error("請指定 --dir 或 --manifest")
+
+    from multimodal_rag import MultiModalRAG
+    # 匯入只需要嵌入模型與索引
+    rag = MultiModalRAG(index_folder=args.index_folder, load_llm=False)
+    job = BulkIngestJob(
+        rag,
+        collect_items(args.directory, args.manifest),
+        extract_workers=args.workers,
+        checkpoint_every=args.checkpoint_every,
+        batch_documents=args.batch_documents
+    )
+    result = job.run(
+        progress_callback=lambda p: print(
+            f"進度: {p['processed'] + p['skipped']}/{p['total']} 檔案, "
+            f"{p['documents']} 文件, {p['files_per_second']} 檔案/秒"
+        )
+    )
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+from typing import Callable, Dict, List, Optional, Sequence
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, MetadataMode
+from llama_index.core.utils import get_tokenizer
+from document_processor import MultiModalDocument
+from metadata_index import sortable_value
+import re
+
+# 只用來追蹤來源的欄位，不放進嵌入與 LLM 看到的文字，每個節點都省下這些 token
+BOOKKEEPING_KEYS = ["page_number", "timestamp", "total_pages", "source_file"]
+
+BLOCK_SEPARATOR = "\n\n"
+
+# "3. Method"、"3.1 Foundation Model."、"第二章 ..."、"一、..."、"Abstract"；
+# 沒有句點的 "1 FNii-Shenzhen"（作者單位、表格數字）不算
+_HEADING_PATTERN = re.compile(
+    r"^(?:\d+\.(?:\d+\.?)*\s+\S"
+    r"|第[一二三四五六七八九十百\d]+[章節講課]"
+    r"|[一二三四五六七八九十]+、"
+    r"|(?:Abstract|Introduction|Conclusions?|References|Appendix)\b)"
+)
+
+
+def is_heading(block: str) -> bool:
+    """單行、夠短且符合章節編號格式的區塊視為標題"""
+    return "\n" not in block and len(block) <= 80 and bool(_HEADING_PATTERN.match(block))
+
+
+class SourceAwareChunker:
+    """依來源切塊，並以嵌入模型的 token 數計算長度
+
+    - 影片字幕：連續的單行字幕合併成時間視窗，保留 start_time / end_time
+    - PDF：依 document_processor 保留的區塊（段落、標題）邊界打包，遇到標題另起一塊，
+      metadata 帶上所屬章節
+    - 其他文字與超過長度的單一區塊交給 SentenceSplitter 依句子切分
+
+    打包時扣掉 metadata 佔用的 token，與 SentenceSplitter 的算法一致，
+    打包好的塊不會再被切開。
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 256,
+        chunk_overlap: int = 30,
+        transcript_window_seconds: float = 60,
+        tokenizer: Optional[Callable[[str], Sequence]] = None
+    ):
+        self.chunk_size = chunk_size
+        self.transcript_window_seconds = transcript_window_seconds
+        self._tokenizer = tokenizer or get_tokenizer()
+        self._splitter = SentenceSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            tokenizer=self._tokenizer,
+            include_metadata=True
+        )
+
+    def count_tokens(self, text: str) -> int:
+        return len(self._tokenizer(text))
+
+    def get_nodes(self, documents: List[MultiModalDocument]) -> List[BaseNode]:
+        return self._splitter.get_nodes_from_documents(self.to_documents(documents))
+
+    def to_documents(self, documents: List[MultiModalDocument]) -> List[Document]:
+        """轉成 llama_index Document：字幕合併成視窗、PDF 頁面依結構打包"""
+        result = []
+        transcript: List[MultiModalDocument] = []
+        sections: Dict[str, Optional[str]] = {}
+        for doc in documents:
+            if self._is_transcript_line(doc):
+                if transcript and transcript[-1].metadata.get("file_name") != doc.metadata.get("file_name"):
+                    result.extend(self._transcript_windows(transcript))
+                    transcript = []
+                transcript.append(doc)
+                continue
+            if transcript:
+                result.extend(self._transcript_windows(transcript))
+                transcript = []
+            if doc.source_type == "pdf":
+                result.extend(self._pdf_chunks(doc, sections))
+            else:
+                result.append(self._document(doc, doc.text))
+        if transcript:
+            result.extend(self._transcript_windows(transcript))
+        return result
+
+    @staticmethod
+    def _document(doc: MultiModalDocument, text: str, **extra) -> Document:
+        metadata = {
+            **doc.metadata,
+            "source_type": doc.source_type,
+            "page_number": doc.page_number,
+            "timestamp": doc.timestamp,
+            **extra
+        }
+        excluded = [key for key in BOOKKEEPING_KEYS if key in metadata]
+        return Document(
+            text=text,
+            metadata=metadata,
+            excluded_embed_metadata_keys=excluded,
+            excluded_llm_metadata_keys=excluded
+        )
+
+    def _budget(self, document: Document) -> int:
+        """chunk_size 扣掉 metadata 字串的 token 數（取嵌入與 LLM 兩者較長的）"""
+        metadata_str = max(
+            document.get_metadata_str(mode=MetadataMode.EMBED),
+            document.get_metadata_str(mode=MetadataMode.LLM),
+            key=len
+        )
+        return self.chunk_size - self.count_tokens(metadata_str)
+
+    @staticmethod
+    def _timestamp(doc: MultiModalDocument):
+        return doc.timestamp or doc.metadata.get("timestamp")
+
+    def _is_transcript_line(self, doc: MultiModalDocument) -> bool:
+        """已經帶有 end_time 的片段視為完整段落，不再合併"""
+        return (
+            doc.source_type in ("video", "audio")
+            and "end_time" not in doc.metadata
+            and isinstance(sortable_value(self._timestamp(doc)), (int, float))
+        )
+
+    def _transcript_windows(self, lines: List[MultiModalDocument]) -> List[Document]:
+        """依時間視窗與 token 預算合併連續字幕；end_time 取下一行的開始時間"""
+        windows = []
+        current: List[MultiModalDocument] = []
+        start = tokens = budget = 0
+        for line in lines:
+            seconds = sortable_value(self._timestamp(line))
+            cost = self.count_tokens(line.text) + 1
+            if current and (
+                seconds - start >= self.transcript_window_seconds
+                or seconds < start
+                or tokens + cost > budget
+            ):
+                windows.append(self._window(current, self._timestamp(line)))
+                current = []
+            if not current:
+                start, tokens = seconds, 0
+                timestamp = self._timestamp(line)
+                budget = self._budget(self._document(line, "", start_time=timestamp, end_time=timestamp))
+            current.append(line)
+            tokens += cost
+        if current:
+            windows.append(self._window(current, self._timestamp(current[-1])))
+        return windows
+
+    def _window(self, lines: List[MultiModalDocument], end_time: str) -> Document:
+        return self._document(
+            lines[0],
+            "\n".join(line.text for line in lines),
+            start_time=self._timestamp(lines[0]),
+            end_time=end_time
+        )
+
+    def _pdf_chunks(self, doc: MultiModalDocument, sections: Dict[str, Optional[str]]) -> List[Document]:
+        """依區塊邊界打包一頁；標題另起一塊，章節延續到同一檔案的後續頁面"""
+        file_name = doc.metadata.get("file_name")
+        section = sections.get(file_name)
+        separator_cost = self.count_tokens(BLOCK_SEPARATOR)
+        chunks = []
+        current: List[str] = []
+        current_section = section
+        has_body = False
+        tokens = budget = 0
+
+        def flush():
+            extra = {"section": current_section} if current_section else {}
+            chunks.append(self._document(doc, BLOCK_SEPARATOR.join(current), **extra))
+
+        for block in (block.strip() for block in doc.text.split(BLOCK_SEPARATOR)):
+            if not block:
+                continue
+            heading = is_heading(block)
+            if heading:
+                section = block
+            cost = self.count_tokens(block) + (separator_cost if current else 0)
+            # 連續的標題（"3. Method" 接著 "3.1 ..."）留在同一塊
+            if current and ((heading and has_body) or tokens + cost > budget):
+                flush()
+                current = []
+            if not current:
+                has_body = False
+                current_section = section
+                extra = {"section": section} if section else {}
+                budget = self._budget(self._document(doc, "", **extra))
+                tokens = 0
+                cost = self.count_tokens(block)
+            elif heading:
+                current_section = section
+                budget = self._budget(self._document(doc, "", section=section))
+            current.append(block)
+            has_body = has_body or not heading
+            tokens += cost
+        if current:
+            flush()
+        sections[file_name] = section
+        return chunks
@@ -0,0 +1,51 @@
+from typing import Optional
+from transformers import AutoModelForCausalLM
+import torch
+
+CPU_QUANTIZATION_MODES = ("int8", "bf16")
+
+
+def quantize_linear_layers(model: torch.nn.Module) -> torch.nn.Module:
+    """逐層把 nn.Linear 換成動態量化的 int8 Linear
+
+    一次只把一層轉回 float32 再量化，尖峰記憶體約為原模型加上一層，
+    不必先載入完整的 float32 模型。
+    """
+    qconfig = torch.ao.quantization.default_dynamic_qconfig
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if type(child) is torch.nn.Linear:
+                child.float()
+                child.qconfig = qconfig
+                setattr(parent, name, torch.ao.nn.quantized.dynamic.Linear.from_float(child))
+    # 量化 Linear 的輸入輸出都是 float32，其餘的層（embedding、norm）也要一致
+    return model.float()
+
+
+def quantize_embedding_model(embed_model, mode: str):
+    """就地量化 HuggingFaceEmbedding 底下的 SentenceTransformer"""
+    if mode not in CPU_QUANTIZATION_MODES:
+        raise ValueError(f"Unknown cpu_quantization: {mode}")
+    model = embed_model._model
+    if mode == "int8":
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    else:
+        model.to(torch.bfloat16)
+    model.eval()
+    return embed_model
+
+
+def load_cpu_llm(model_name: str, mode: Optional[str]):
+    """在 CPU 上載入 LLM：int8 動態量化、bf16，或 None 時為 float32"""
+    if mode is not None and mode not in CPU_QUANTIZATION_MODES:
+        raise ValueError(f"Unknown cpu_quantization: {mode}")
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        trust_remote_code=True,
+        torch_dtype=torch.float32 if mode is None else torch.bfloat16,
+        low_cpu_mem_usage=True
+    )
+    if mode == "int8":
+        model = quantize_linear_layers(model)
+    model.eval()
+    return model
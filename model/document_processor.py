@@ -1,47 +1,144 @@
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator
 import fitz  # PyMuPDF for PDF processing
 import os
-from dataclasses import dataclass
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from metrics import METRICS
 
-@dataclass
 class MultiModalDocument:
-    """多模態文檔的數據類"""
-    text: str
-    metadata: Dict[str, Any]
-    source_type: str  # "pdf", "video", "audio", "text"
-    page_number: Optional[int] = None
-    timestamp: Optional[str] = None
-    confidence: Optional[float] = None
+    """多模態文檔的數據類
+
+    匯入時每頁、每行字幕各有一個，以 __slots__ 省去每個實例的 __dict__。
+    """
+    __slots__ = ("text", "metadata", "source_type", "page_number", "timestamp", "confidence")
+
+    def __init__(
+        self,
+        text: str,
+        metadata: Dict[str, Any],
+        source_type: str,  # "pdf", "video", "audio", "text"
+        page_number: Optional[int] = None,
+        timestamp: Optional[str] = None,
+        confidence: Optional[float] = None
+    ):
+        self.text = text
+        self.metadata = metadata
+        self.source_type = source_type
+        self.page_number = page_number
+        self.timestamp = timestamp
+        self.confidence = confidence
+
+    def _fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"MultiModalDocument({fields})"
+
+# 英文行尾的連字號斷字（"rec-\nommendations"）
+_HYPHEN_BREAK = re.compile(r"(?<=[A-Za-z])-\n(?=[a-z])")
+_ASCII_LINE_BREAK = re.compile(r"(?<=[\x21-\x7e])\n(?=[\x21-\x7e])")
+
+def _page_text(page) -> str:
+    """依 PyMuPDF 的文字區塊擷取頁面，區塊之間以空行分隔，保留段落與標題的邊界
+
+    區塊內的排版換行：英文接回斷字並改為空格，中文直接相連。
+    """
+    blocks = []
+    for block in page.get_text("blocks", sort=False):
+        if block[6] != 0:  # 圖片區塊
+            continue
+        text = _HYPHEN_BREAK.sub("", block[4].strip())
+        text = _ASCII_LINE_BREAK.sub(" ", text).replace("\n", "")
+        if text:
+            blocks.append(text)
+    return "\n\n".join(blocks)
+
+def _page_document(
+    text: str,
+    file_name: str,
+    page_num: int,
+    total_pages: int
+) -> MultiModalDocument:
+    return MultiModalDocument(
+        text=text,
+        metadata={
+            "file_name": file_name,
+            "page": page_num + 1,
+            "total_pages": total_pages
+        },
+        source_type="pdf",
+        page_number=page_num + 1
+    )
+
+def _extract_page_range(
+    pdf_path: str,
+    start: int,
+    end: int
+) -> List[MultiModalDocument]:
+    """在子行程中擷取 [start, end) 頁（需為模組層級函式才能被 pickle）"""
+    file_name = os.path.basename(pdf_path)
+    documents = []
+    with fitz.open(pdf_path) as pdf_doc:
+        total_pages = len(pdf_doc)
+        for page_num in range(start, min(end, total_pages)):
+            documents.append(
+                _page_document(_page_text(pdf_doc[page_num]), file_name, page_num, total_pages)
+            )
+    return documents
 
 class DocumentProcessor:
     """處理不同類型文檔的類"""
     
     def process_pdf(self, pdf_path: str) -> List[MultiModalDocument]:
         """處理 PDF 文件"""
+        return list(self.iter_pdf(pdf_path))
+
+    def iter_pdf(
+        self,
+        pdf_path: str,
+        workers: int = 1,
+        pages_per_task: int = 16
+    ) -> Iterator[MultiModalDocument]:
+        """逐頁產生 PDF 文件，workers > 1 時以多行程平行擷取頁面範圍"""
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"PDF file not found: {pdf_path}")
-            
-        documents = []
-        pdf_doc = fitz.open(pdf_path)
-        file_name = os.path.basename(pdf_path)
-        
-        for page_num in range(len(pdf_doc)):
-            page = pdf_doc[page_num]
-            text = page.get_text()
-            
-            doc = MultiModalDocument(
-                text=text,
-                metadata={
-                    "file_name": file_name,
-                    "page": page_num + 1,
-                    "total_pages": len(pdf_doc)
-                },
-                source_type="pdf",
-                page_number=page_num + 1
-            )
-            documents.append(doc)
-            
-        return documents
+
+        if workers <= 1:
+            file_name = os.path.basename(pdf_path)
+            with fitz.open(pdf_path) as pdf_doc:
+                total_pages = len(pdf_doc)
+                for page_num in range(total_pages):
+                    with METRICS.stage("pdf_page_extract"):
+                        text = _page_text(pdf_doc[page_num])
+                    METRICS.inc("pdf_pages")
+                    yield _page_document(text, file_name, page_num, total_pages)
+            return
+
+        with fitz.open(pdf_path) as pdf_doc:
+            total_pages = len(pdf_doc)
+        ranges = deque(
+            (start, start + pages_per_task)
+            for start in range(0, total_pages, pages_per_task)
+        )
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # 同時最多只有 2 * workers 個範圍在處理中，記憶體用量不隨頁數成長
+            pending = deque()
+            while ranges or pending:
+                while ranges and len(pending) < 2 * workers:
+                    start, end = ranges.popleft()
+                    pending.append(pool.submit(_extract_page_range, pdf_path, start, end))
+                # 平行時只能量到等待子行程的時間（已擷取完的範圍幾乎為 0）
+                with METRICS.stage("pdf_range_wait"):
+                    documents = pending.popleft().result()
+                METRICS.inc("pdf_pages", len(documents))
+                yield from documents
 
     def process_video_transcript(
         self,
@@ -55,7 +152,7 @@ class DocumentProcessor:
         documents = []
         video_name = os.path.basename(video_path)
         
-        with open(transcript_path, 'r', encoding='utf-8') as f:
+        with METRICS.stage("transcript_parse"), open(transcript_path, 'r', encoding='utf-8') as f:
             for line in f:
                 # 假設格式: "HH:MM:SS 文本內容"
                 if ' ' in line:
@@ -0,0 +1,96 @@
+from typing import Dict, List, Iterable, Set
+import hashlib
+import os
+import sqlite3
+import threading
+import numpy as np
+
+
+def content_hash(text: str) -> str:
+    """節點內容（含嵌入時可見的 metadata）的雜湊"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """以內容雜湊為鍵的持久化嵌入快取（SQLite）
+
+    embeddings 表以 (模型名稱, 內容) 的雜湊保存向量，重新上傳相同內容時不必再嵌入；
+    indexed_chunks 表記錄已寫入索引的內容雜湊，用來略過重複的節點。
+    """
+
+    def __init__(self, db_path: str, model_name: str):
+        self.db_path = db_path
+        self.model_name = model_name
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS indexed_chunks (hash TEXT PRIMARY KEY)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def embedding_key(self, text: str) -> str:
+        return content_hash(f"{self.model_name}\0{text}")
+
+    @staticmethod
+    def _chunks(items: List[str], size: int = 500) -> Iterable[List[str]]:
+        # SQLite 單一語句的參數數量有上限
+        for start in range(0, len(items), size):
+            yield items[start:start + size]
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for chunk in self._chunks(list(set(keys))):
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        self.hits += len(found)
+        self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, embeddings: Dict[str, List[float]]):
+        rows = []
+        for key, embedding in embeddings.items():
+            vector = np.asarray(embedding, dtype=np.float32)
+            rows.append((key, vector.shape[0], vector.tobytes()))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def indexed(self, hashes: List[str]) -> Set[str]:
+        """回傳已在索引中的內容雜湊"""
+        found: Set[str] = set()
+        with self._lock:
+            for chunk in self._chunks(list(set(hashes))):
+                rows = self._conn.execute(
+                    f"SELECT hash FROM indexed_chunks WHERE hash IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def mark_indexed(self, hashes: List[str]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO indexed_chunks (hash) VALUES (?)",
+                [(h,) for h in hashes]
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
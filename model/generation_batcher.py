@@ -0,0 +1,226 @@
+from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import Future
+from llama_index.core.base.llms.types import CompletionResponse, CompletionResponseGen
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.llms.huggingface import HuggingFaceLLM
+from transformers import TextIteratorStreamer
+import queue
+import threading
+import time
+import torch
+
+
+class GenerationBatcher:
+    """LLM 生成的動態微批次排程器
+
+    在 batch_window_ms 內到達的提示（最多 max_batch_size 個）會左側補齊後
+    以單一次 generate 產生，再把各自的輸出交回等待中的請求。
+    串流請求也由同一個背景執行緒生成，模型同時只有一個 generate 在跑；
+    TextIteratorStreamer 不支援 beam search，串流固定 num_beams=1 且不併批。
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        max_batch_size: int = 8,
+        batch_window_ms: float = 10,
+        max_new_tokens: int = 128,
+        generate_kwargs: Dict[str, Any] = None,
+        stopping_criteria=None,
+        tokenizer_outputs_to_remove: List[str] = None
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max(1, max_batch_size)
+        self.batch_window = batch_window_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self.generate_kwargs = generate_kwargs or {}
+        self.stopping_criteria = stopping_criteria
+        self.tokenizer_outputs_to_remove = tokenizer_outputs_to_remove or []
+
+        # decoder-only 模型批次生成需要左側補齊
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        self._queue: "queue.Queue[Optional[Tuple[str, Future, Optional[TextIteratorStreamer]]]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.requests = 0
+        self.batches = 0
+        self.streams = 0
+        self._closed = False
+        self._worker = threading.Thread(target=self._loop, name="generation-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, streamer: Optional[TextIteratorStreamer] = None) -> Future:
+        """放入佇列；有 streamer 時逐段寫入 streamer，Future 在生成結束（或失敗）時完成"""
+        if self._closed:
+            raise RuntimeError("GenerationBatcher is closed")
+        future: Future = Future()
+        self._queue.put((prompt, future, streamer))
+        return future
+
+    def generate(self, prompt: str) -> str:
+        return self.submit(prompt).result()
+
+    def _collect(self, first: Tuple) -> Tuple[List[Tuple], List[Tuple]]:
+        """從第一個請求開始，收集視窗時間內陸續到達的請求；串流請求另外列出，於本批之後依序生成"""
+        batch = [first]
+        streams = []
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            (streams if item[2] is not None else batch).append(item)
+        return batch, streams
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            if first[2] is not None:
+                self._run_stream(*first)
+                continue
+            batch, streams = self._collect(first)
+            try:
+                outputs = self._run_batch([prompt for prompt, _, _ in batch])
+                for (_, future, _), output in zip(batch, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            for item in streams:
+                self._run_stream(*item)
+
+    def _encode(self, prompts: List[str]):
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True)
+        inputs = inputs.to(self.model.device)
+        for key in self.tokenizer_outputs_to_remove:
+            inputs.pop(key, None)
+        return inputs
+
+    def _run_batch(self, prompts: List[str]) -> List[str]:
+        inputs = self._encode(prompts)
+        with torch.inference_mode():
+            tokens = self.model.generate(
+                **inputs,
+                max_new_tokens=self.max_new_tokens,
+                stopping_criteria=self.stopping_criteria,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **self.generate_kwargs
+            )
+        prompt_length = inputs["input_ids"].size(1)
+        with self._stats_lock:
+            self.requests += len(prompts)
+            self.batches += 1
+        return self.tokenizer.batch_decode(tokens[:, prompt_length:], skip_special_tokens=True)
+
+    def _run_stream(self, prompt: str, future: Future, streamer: TextIteratorStreamer):
+        try:
+            with torch.inference_mode():
+                self.model.generate(
+                    **self._encode([prompt]),
+                    streamer=streamer,
+                    max_new_tokens=self.max_new_tokens,
+                    stopping_criteria=self.stopping_criteria,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **{**self.generate_kwargs, "num_beams": 1}
+                )
+        except Exception as e:
+            # 讓讀取端結束迭代，再由 Future 拋出錯誤
+            streamer.end()
+            future.set_exception(e)
+            return
+        with self._stats_lock:
+            self.streams += 1
+        future.set_result(None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "requests": self.requests,
+                "batches": self.batches,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "streams": self.streams,
+                "queued": self._queue.qsize(),
+            }
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join()
+
+
+class BatchedHuggingFaceLLM(HuggingFaceLLM):
+    """complete() 經由 GenerationBatcher 與其他同時到達的請求合併生成
+
+    max_batch_size=1 時不合併，但仍由同一個背景執行緒依序生成。
+    stream_complete() 也排入同一個執行緒，以 TextIteratorStreamer 逐段回傳；
+    串流不支援 beam search，改用 num_beams=1，答案可能與 complete() 不同。
+    """
+
+    _batcher: Any = PrivateAttr(default=None)
+
+    def __init__(self, *args: Any, max_batch_size: int = 8, batch_window_ms: float = 10, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._batcher = GenerationBatcher(
+            self._model,
+            self._tokenizer,
+            max_batch_size=max_batch_size,
+            batch_window_ms=batch_window_ms,
+            max_new_tokens=self.max_new_tokens,
+            generate_kwargs=self.generate_kwargs,
+            stopping_criteria=self._stopping_criteria,
+            tokenizer_outputs_to_remove=self.tokenizer_outputs_to_remove
+        )
+
+    @property
+    def batcher(self) -> GenerationBatcher:
+        return self._batcher
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer
+
+    def _full_prompt(self, prompt: str, formatted: bool) -> str:
+        full_prompt = prompt
+        if not formatted:
+            if self.query_wrapper_prompt:
+                full_prompt = self.query_wrapper_prompt.format(query_str=prompt)
+            if self.completion_to_prompt:
+                full_prompt = self.completion_to_prompt(full_prompt)
+            elif self.system_prompt:
+                full_prompt = f"{self.system_prompt} {full_prompt}"
+        return full_prompt
+
+    def submit(self, prompt: str, formatted: bool = False) -> Future:
+        """不等待結果，直接把提示放進批次佇列；一次送出多個提示時可湊滿整批"""
+        return self._batcher.submit(self._full_prompt(prompt, formatted))
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.submit(prompt, formatted).result())
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        streamer = TextIteratorStreamer(self._tokenizer, skip_prompt=True, skip_special_tokens=True)
+        future = self._batcher.submit(self._full_prompt(prompt, formatted), streamer)
+
+        def gen() -> CompletionResponseGen:
+            text = ""
+            for delta in streamer:
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+            # 生成失敗時在這裡拋出
+            future.result()
+
+        return gen()
@@ -0,0 +1,136 @@
+"""只負責 LLM 生成的服務，讓多個查詢工作者共用同一份模型
+
+    cd model
+    RAG_DEVICE=cuda uvicorn generation_server:app --port 8002 --workers 1
+
+查詢工作者設定 RAG_LLM_URL=http://127.0.0.1:8002 後不載入 LLM，只載入分詞器，
+提示經由 POST /generate 或 /generate_stream 送到這裡；serve.py 會一併啟動。
+各工作者同時送來的提示由同一個 GenerationBatcher 合併成批生成。
+"""
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import Optional
+from bounded_executor import BoundedExecutor, ExecutorSaturated
+from generation_batcher import BatchedHuggingFaceLLM
+import json
+import os
+import threading
+import uvicorn
+
+
+app = FastAPI()
+llm_instance = None
+load_error: Optional[str] = None
+
+# 要大於等於 LLM 的批次大小，同時到達的請求才能合併成一批生成
+generation_executor = BoundedExecutor(
+    "generation",
+    max_workers=int(os.environ.get("RAG_GENERATION_WORKERS", 32)),
+    max_queue=int(os.environ.get("RAG_GENERATION_QUEUE", 128))
+)
+
+
+class GenerateInput(BaseModel):
+    prompt: str
+    # 與 LLM.complete 相同：False 時套用模型的提示包裝
+    formatted: Optional[bool] = False
+
+
+def load_llm():
+    global llm_instance, load_error
+    from multimodal_rag import load_generation_llm
+    device = os.environ.get("RAG_DEVICE", "cuda")
+    try:
+        llm_instance = load_generation_llm(
+            os.environ.get("RAG_MODEL_NAME", "yentinglin/Taiwan-LLM-7B-v2.0-base"),
+            device,
+            load_in_8bit=device == "cuda",
+            cpu_quantization=(os.environ.get("RAG_CPU_QUANTIZATION") or None) if device == "cpu" else None,
+            max_batch_size=int(os.environ.get("RAG_LLM_BATCH_SIZE", 8)),
+            batch_window_ms=float(os.environ.get("RAG_LLM_BATCH_WINDOW_MS", 10))
+        )
+    except Exception as e:
+        load_error = f"{type(e).__name__}: {e}"
+        raise
+
+
+def require_llm():
+    if llm_instance is not None:
+        return llm_instance
+    if load_error:
+        raise HTTPException(status_code=500, detail=f"llm failed to load: {load_error}")
+    raise HTTPException(status_code=503, detail="llm is still loading", headers={"Retry-After": "5"})
+
+
+@app.on_event("startup")
+async def startup_event():
+    # 模型在背景載入，以 /ready 確認是否就緒
+    if llm_instance is None:
+        threading.Thread(target=load_llm, name="load-llm", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    generation_executor.shutdown(wait=False)
+
+
+@app.post("/generate")
+async def generate(generate_input: GenerateInput):
+    llm = require_llm()
+    try:
+        response = await generation_executor.run(llm.complete, generate_input.prompt, formatted=generate_input.formatted)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return {"text": response.text}
+
+
+@app.post("/generate_stream")
+async def generate_stream(generate_input: GenerateInput):
+    """以 NDJSON 逐行回傳 {"delta": ...}；回應開始後的錯誤以 {"error": ...} 一行通知"""
+    llm = require_llm()
+
+    def deltas():
+        for response in llm.stream_complete(generate_input.prompt, formatted=generate_input.formatted):
+            yield response.delta
+
+    try:
+        events = generation_executor.stream(deltas)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    async def ndjson_stream():
+        try:
+            async for delta in events:
+                yield json.dumps({"delta": delta}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"{type(e).__name__}: {e}"}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
+
+
+@app.get("/ready")
+async def ready():
+    """模型就緒才回 200，並附上查詢工作者組提示時需要的 context_window 與 max_new_tokens"""
+    if llm_instance is not None:
+        return {
+            "ready": True,
+            "status": "ready",
+            "context_window": llm_instance.context_window,
+            "max_new_tokens": llm_instance.max_new_tokens,
+        }
+    if load_error:
+        return JSONResponse(status_code=500, content={"ready": False, "status": "failed", "error": load_error})
+    return JSONResponse(status_code=503, content={"ready": False, "status": "loading"})
+
+
+@app.get("/health")
+async def health():
+    stats = {"executor": generation_executor.stats()}
+    if isinstance(llm_instance, BatchedHuggingFaceLLM):
+        stats["batcher"] = llm_instance.batcher.stats()
+    return {"status": "ok", **stats}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=8002)
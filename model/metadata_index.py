@@ -0,0 +1,314 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+from array import array
+from llama_index.core.vector_stores.types import (
+    FilterCondition,
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
+import json
+import os
+import re
+import threading
+import numpy as np
+
+POSTINGS_FNAME = "metadata_postings.npy"
+FIELDS_FNAME = "metadata_index.json"
+
+_TIME_PATTERN = re.compile(r"^(\d+):(\d{1,2})(?::(\d{1,2}(?:\.\d+)?))?$")
+
+_RANGE_OPERATORS = (FilterOperator.GT, FilterOperator.GTE, FilterOperator.LT, FilterOperator.LTE)
+
+# API 以字典描述過濾條件時使用的運算子名稱
+_OPERATOR_NAMES = {
+    "eq": FilterOperator.EQ,
+    "ne": FilterOperator.NE,
+    "in": FilterOperator.IN,
+    "nin": FilterOperator.NIN,
+    "gt": FilterOperator.GT,
+    "gte": FilterOperator.GTE,
+    "lt": FilterOperator.LT,
+    "lte": FilterOperator.LTE,
+}
+
+
+def sortable_value(value: Any) -> Optional[float]:
+    """數值或 HH:MM:SS / MM:SS 時間字串轉成可比較的數字，其他回傳 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = _TIME_PATTERN.match(value.strip())
+        if match:
+            first, second, third = match.groups()
+            if third is None:
+                return int(first) * 60 + int(second)
+            return int(first) * 3600 + int(second) * 60 + float(third)
+    return None
+
+
+def build_metadata_filters(spec: Union[Dict[str, Any], MetadataFilters, None]) -> Optional[MetadataFilters]:
+    """把 API 的過濾字典轉成 llama_index 的 MetadataFilters（條件之間為 AND）
+
+        {"course_name": "人工智慧導論"}               等於
+        {"source_type": ["pdf", "video"]}            in
+        {"page": {"gte": 10, "lte": 30}}             數值範圍
+        {"start_time": {"gte": "00:10:00"}}          時間範圍
+    """
+    if spec is None or isinstance(spec, MetadataFilters):
+        return spec
+    filters = []
+    for key, condition in spec.items():
+        if isinstance(condition, dict):
+            for name, value in condition.items():
+                if name not in _OPERATOR_NAMES:
+                    raise ValueError(f"Unsupported filter operator: {name}")
+                # 範圍的界限在這裡就檢查，API 回 400 而不是查詢時才出錯
+                if _OPERATOR_NAMES[name] in _RANGE_OPERATORS and sortable_value(value) is None:
+                    raise ValueError(f"Range filter on '{key}' needs a number or HH:MM:SS time, got {value!r}")
+                filters.append(MetadataFilter(key=key, value=value, operator=_OPERATOR_NAMES[name]))
+        elif isinstance(condition, list):
+            filters.append(MetadataFilter(key=key, value=condition, operator=FilterOperator.IN))
+        else:
+            filters.append(MetadataFilter(key=key, value=condition, operator=FilterOperator.EQ))
+    return MetadataFilters(filters=filters) if filters else None
+
+
+def metadata_matches(metadata: Dict[str, Any], filters: MetadataFilters) -> bool:
+    """逐筆檢查 metadata 是否符合條件，語意與 MetadataIndex 相同（用於索引以外的候選）"""
+    results = []
+    for f in filters.filters:
+        if isinstance(f, MetadataFilters):
+            results.append(metadata_matches(metadata, f))
+            continue
+        value = metadata.get(f.key)
+        if isinstance(value, bool):
+            value = None
+        if f.operator == FilterOperator.EQ:
+            results.append(value is not None and value == f.value)
+        elif f.operator == FilterOperator.NE:
+            results.append(value is None or value != f.value)
+        elif f.operator in (FilterOperator.IN, FilterOperator.NIN):
+            values = f.value if isinstance(f.value, list) else [f.value]
+            found = value is not None and value in values
+            results.append(found if f.operator == FilterOperator.IN else not found)
+        elif f.operator in _RANGE_OPERATORS:
+            number, bound = sortable_value(value), sortable_value(f.value)
+            if bound is None:
+                raise ValueError(f"Range filter on '{f.key}' needs a number or HH:MM:SS time, got {f.value!r}")
+            if number is None:
+                results.append(False)
+            elif f.operator == FilterOperator.GT:
+                results.append(number > bound)
+            elif f.operator == FilterOperator.GTE:
+                results.append(number >= bound)
+            elif f.operator == FilterOperator.LT:
+                results.append(number < bound)
+            else:
+                results.append(number <= bound)
+        else:
+            raise ValueError(f"Unsupported filter operator: {f.operator}")
+    if (filters.condition or FilterCondition.AND) == FilterCondition.OR:
+        return any(results)
+    return all(results)
+
+
+class MetadataIndex:
+    """節點 metadata 的倒排索引
+
+    每個 (欄位, 值) 對應一個遞增的列號列表，等於與 in 條件直接合併列表；
+    可排序的值（數字、時間字串）另外依值排序，範圍條件以 searchsorted 找出
+    範圍內的值再合併其列表。查詢成本與符合條件的列數成正比。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.n_rows = 0
+        self._postings: Dict[str, Dict[Any, array]] = {}
+        # 欄位 -> (排序後的數值, 對應的值)，出現新的值後才重建
+        self._sorted: Dict[str, Tuple[np.ndarray, List[Any]]] = {}
+
+    def add(self, metadatas: List[Dict[str, Any]], start_row: int):
+        """新增連續列的 metadata"""
+        with self._lock:
+            if start_row != self.n_rows:
+                raise ValueError(f"Metadata rows out of sync: expected {self.n_rows}, got {start_row}")
+            for offset, metadata in enumerate(metadatas):
+                row = start_row + offset
+                for field, value in (metadata or {}).items():
+                    # llama_index 的過濾條件只接受字串與數字
+                    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                        continue
+                    field_postings = self._postings.setdefault(field, {})
+                    postings = field_postings.get(value)
+                    if postings is None:
+                        postings = field_postings[value] = array("q")
+                        self._sorted.pop(field, None)
+                    postings.append(row)
+            self.n_rows = start_row + len(metadatas)
+
+    def compact(self, alive: np.ndarray):
+        """向量庫移除已刪除的列後，同步重新編號"""
+        with self._lock:
+            new_rows = np.cumsum(alive) - 1
+            for field, field_postings in self._postings.items():
+                for key in list(field_postings):
+                    rows = np.frombuffer(field_postings[key], dtype=np.int64)
+                    rows = new_rows[rows[alive[rows]]]
+                    if rows.size:
+                        field_postings[key] = array("q", rows.astype(np.int64).tobytes())
+                    else:
+                        del field_postings[key]
+                        self._sorted.pop(field, None)
+            self.n_rows = int(alive.sum())
+
+    def _rows(self, field: str, key: Any) -> np.ndarray:
+        postings = self._postings.get(field, {}).get(key)
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        return np.array(postings, dtype=np.int64)
+
+    def _union(self, parts: List[np.ndarray], disjoint: bool = False) -> np.ndarray:
+        """合併多個遞增列表；同一欄位不同值的列表互不重疊，只需排序"""
+        parts = [part for part in parts if part.size]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0]
+        rows = np.concatenate(parts)
+        return np.sort(rows) if disjoint else np.unique(rows)
+
+    def _complement(self, rows: np.ndarray) -> np.ndarray:
+        mask = np.ones(self.n_rows, dtype=bool)
+        mask[rows] = False
+        return np.nonzero(mask)[0]
+
+    def _sorted_values(self, field: str) -> Tuple[np.ndarray, List[Any]]:
+        cached = self._sorted.get(field)
+        if cached is None:
+            # 只依數值排序，12 與 "00:00:12" 這類不同型別的值才不會互相比較
+            pairs = sorted((
+                (number, value)
+                for value in self._postings.get(field, {})
+                for number in [sortable_value(value)]
+                if number is not None
+            ), key=lambda pair: pair[0])
+            cached = (
+                np.asarray([number for number, _ in pairs], dtype=np.float64),
+                [value for _, value in pairs]
+            )
+            self._sorted[field] = cached
+        return cached
+
+    def _range_rows(self, field: str, range_filters: List[MetadataFilter]) -> np.ndarray:
+        """同一欄位的範圍條件合併成一個區間，只取區間內的值"""
+        numbers, values = self._sorted_values(field)
+        start, end = 0, len(values)
+        for metadata_filter in range_filters:
+            bound = sortable_value(metadata_filter.value)
+            if bound is None:
+                raise ValueError(
+                    f"Range filter on '{field}' needs a number or HH:MM:SS time, got {metadata_filter.value!r}"
+                )
+            operator = metadata_filter.operator
+            if operator == FilterOperator.GT:
+                start = max(start, int(np.searchsorted(numbers, bound, side="right")))
+            elif operator == FilterOperator.GTE:
+                start = max(start, int(np.searchsorted(numbers, bound, side="left")))
+            elif operator == FilterOperator.LT:
+                end = min(end, int(np.searchsorted(numbers, bound, side="left")))
+            else:
+                end = min(end, int(np.searchsorted(numbers, bound, side="right")))
+        return self._union([self._rows(field, value) for value in values[start:end]], disjoint=True)
+
+    def _filter_rows(self, metadata_filter: MetadataFilter) -> np.ndarray:
+        field, operator, value = metadata_filter.key, metadata_filter.operator, metadata_filter.value
+        if operator == FilterOperator.EQ:
+            return self._rows(field, value)
+        if operator == FilterOperator.NE:
+            return self._complement(self._rows(field, value))
+        if operator in (FilterOperator.IN, FilterOperator.NIN):
+            values = set(value) if isinstance(value, list) else {value}
+            rows = self._union([self._rows(field, v) for v in values], disjoint=True)
+            return rows if operator == FilterOperator.IN else self._complement(rows)
+        if operator in _RANGE_OPERATORS:
+            return self._range_rows(field, [metadata_filter])
+        raise ValueError(f"Unsupported filter operator: {operator}")
+
+    def _evaluate(self, filters: MetadataFilters) -> np.ndarray:
+        condition = filters.condition or FilterCondition.AND
+        parts = []
+        ranges: Dict[str, List[MetadataFilter]] = {}
+        for f in filters.filters:
+            if isinstance(f, MetadataFilters):
+                parts.append(self._evaluate(f))
+            elif condition == FilterCondition.AND and f.operator in _RANGE_OPERATORS:
+                ranges.setdefault(f.key, []).append(f)
+            else:
+                parts.append(self._filter_rows(f))
+        parts.extend(self._range_rows(field, range_filters) for field, range_filters in ranges.items())
+        if not parts:
+            return np.arange(self.n_rows, dtype=np.int64)
+        if condition == FilterCondition.OR:
+            return self._union(parts)
+        # 由最短的列表開始交集，結果只會越來越小
+        parts.sort(key=lambda part: part.size)
+        rows = parts[0]
+        for part in parts[1:]:
+            if not rows.size:
+                break
+            rows = np.intersect1d(rows, part, assume_unique=True)
+        return rows
+
+    def candidates(self, filters: MetadataFilters) -> np.ndarray:
+        """回傳符合條件的列號（遞增）"""
+        with self._lock:
+            return self._evaluate(filters)
+
+    def save(self, persist_dir: str):
+        """列號串接成一個 .npy，欄位與值的位移記錄在 JSON"""
+        with self._lock:
+            fields = {}
+            chunks = []
+            offset = 0
+            for field, field_postings in self._postings.items():
+                entries = []
+                for value, postings in field_postings.items():
+                    entries.append([value, offset, offset + len(postings)])
+                    chunks.append(np.frombuffer(postings, dtype=np.int64).copy())
+                    offset += len(postings)
+                fields[field] = entries
+            rows = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+            n_rows = self.n_rows
+
+        postings_path = os.path.join(persist_dir, POSTINGS_FNAME)
+        np.save(postings_path + ".tmp.npy", rows)
+        os.replace(postings_path + ".tmp.npy", postings_path)
+        fields_path = os.path.join(persist_dir, FIELDS_FNAME)
+        with open(fields_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"n_rows": n_rows, "fields": fields}, f, ensure_ascii=False)
+        os.replace(fields_path + ".tmp", fields_path)
+
+    def load(self, persist_dir: str, n_rows: int) -> bool:
+        """載入已寫出的索引；列數不一致時放棄，由呼叫端重建"""
+        fields_path = os.path.join(persist_dir, FIELDS_FNAME)
+        postings_path = os.path.join(persist_dir, POSTINGS_FNAME)
+        if not (os.path.exists(fields_path) and os.path.exists(postings_path)):
+            return False
+        with open(fields_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data["n_rows"] != n_rows:
+            return False
+        rows = np.load(postings_path)
+        with self._lock:
+            self.reset()
+            for field, entries in data["fields"].items():
+                field_postings = self._postings[field] = {}
+                for value, start, end in entries:
+                    field_postings[value] = array("q", rows[start:end].astype(np.int64).tobytes())
+            self.n_rows = n_rows
+        return True
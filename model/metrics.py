@@ -0,0 +1,149 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+import time
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 目前請求的各階段耗時（毫秒），由 request_trace 開啟
+_trace: "ContextVar[Optional[Dict[str, float]]]" = ContextVar("rag_trace", default=None)
+
+
+def _labels(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], **extra) -> str:
+    pairs = list(labels) + [(key, str(value)) for key, value in extra.items()]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+class _Stage:
+    __slots__ = ("samples", "count", "total")
+
+    def __init__(self, window: int):
+        # 分位數以最近 window 筆計算；count 與 total 為累計值
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+
+class MetricsRegistry:
+    """行程內的輕量指標：各階段延遲、計數器與量測值
+
+    階段延遲保留最近 window 筆計算 p50/p95/p99，另外累計次數與總時間；
+    以 Prometheus 文字格式輸出（summary / counter / gauge）。
+    多個 worker 行程各自有一份，由 Prometheus 依 instance 彙總。
+    """
+
+    def __init__(self, prefix: str = "rag", window: int = 1024):
+        self.prefix = prefix
+        self.window = window
+        self._stages: Dict[str, _Stage] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = _Stage(self.window)
+            entry.samples.append(seconds)
+            entry.count += 1
+            entry.total += seconds
+        timings = _trace.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds * 1000
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """各階段的次數與 p50/p95/p99（毫秒）及計數器"""
+        with self._lock:
+            stages = {name: (np.asarray(entry.samples), entry.count, entry.total) for name, entry in self._stages.items()}
+            counters = dict(self._counters)
+        result = {"stages": {}, "counters": {}}
+        for name, (samples, count, total) in sorted(stages.items()):
+            quantiles = np.quantile(samples, QUANTILES) * 1000 if samples.size else [0.0] * len(QUANTILES)
+            result["stages"][name] = {
+                "count": count,
+                "mean_ms": round(total / count * 1000, 3) if count else 0.0,
+                **{f"p{int(q * 100)}_ms": round(float(v), 3) for q, v in zip(QUANTILES, quantiles)},
+            }
+        for (name, labels), value in sorted(counters.items()):
+            result["counters"][name + _format_labels(labels)] = value
+        return result
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Prometheus 文字格式；gauges 為呼叫端在輸出當下收集的量測值（如快取命中率）"""
+        with self._lock:
+            stages = {name: (list(entry.samples), entry.count, entry.total) for name, entry in self._stages.items()}
+            counters = dict(self._counters)
+
+        lines: List[str] = []
+        metric = f"{self.prefix}_stage_seconds"
+        lines.append(f"# HELP {metric} Latency of each pipeline stage")
+        lines.append(f"# TYPE {metric} summary")
+        for name, (samples, count, total) in sorted(stages.items()):
+            stage_label = (("stage", name),)
+            if samples:
+                for q, value in zip(QUANTILES, np.quantile(samples, QUANTILES)):
+                    lines.append(f"{metric}{_format_labels(stage_label, quantile=q)} {value:.6f}")
+            lines.append(f"{metric}_sum{_format_labels(stage_label)} {total:.6f}")
+            lines.append(f"{metric}_count{_format_labels(stage_label)} {count}")
+
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            metric = f"{self.prefix}_{name}_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_format_labels(labels)} {value:g}")
+
+        for name, value in sorted((gauges or {}).items()):
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {float(value):g}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+@contextmanager
+def request_trace() -> Iterator[Dict[str, float]]:
+    """收集這個請求（同一執行緒內）各階段的耗時，結束時字典內為毫秒"""
+    timings: Dict[str, float] = {}
+    token = _trace.set(timings)
+    try:
+        yield timings
+    finally:
+        _trace.reset(token)
+        # 逾時的背景工作（如 BM25）可能稍後才寫入，先取快照再四捨五入
+        for name, value in list(timings.items()):
+            timings[name] = round(value, 3)
@@ -1,14 +1,91 @@
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form  # 添加 Form
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import List, Dict, Any, Optional
 import uvicorn
-from multimodal_rag import MultiModalRAG
+from multimodal_rag import MultiModalRAG, ComponentNotReady, IndexReadOnly
 from document_processor import MultiModalDocument
+from bulk_ingest import BulkIngestJob, collect_items
+from bounded_executor import BoundedExecutor, ExecutorSaturated
+from metadata_index import build_metadata_filters
+from metrics import METRICS
+import json
+import logging
 import os
+import shutil
+import threading
+import uuid
 
 
+# 元件載入與索引世代切換記錄在 INFO；RAG_LOG_LEVEL=DEBUG 另外列出每次匯入與查詢的計時
+logging.basicConfig(
+    level=os.environ.get("RAG_LOG_LEVEL", "INFO"),
+    format="%(asctime)s %(name)s %(levelname)s: %(message)s"
+)
 app = FastAPI()
 rag_instance = None
+# standalone：單一行程讀寫；writer：只負責匯入，不載入 LLM；reader：唯讀的查詢工作者
+ROLE = os.environ.get("RAG_ROLE", "standalone")
+if ROLE not in ("standalone", "writer", "reader"):
+    raise ValueError(f"Unknown RAG_ROLE: {ROLE}")
+bulk_jobs: Dict[str, BulkIngestJob] = {}
+# /bulk_ingest 只能讀取這個資料夾下的檔案；保留最近幾個已結束的工作供查詢進度
+INGEST_ROOT = os.path.realpath(os.environ.get("RAG_INGEST_ROOT", "./ingest"))
+BULK_JOBS_KEEP = int(os.environ.get("RAG_BULK_JOBS_KEEP", 16))
+
+# 同步的匯入與生成工作在獨立的執行緒池中執行，避免阻塞事件迴圈；
+# 排隊超過上限時回 503，可用環境變數調整
+ingest_executor = BoundedExecutor(
+    "ingest",
+    max_workers=int(os.environ.get("RAG_INGEST_WORKERS", 1)),
+    max_queue=int(os.environ.get("RAG_INGEST_QUEUE", 8))
+)
+inference_executor = BoundedExecutor(
+    "inference",
+    # 要大於等於 LLM 的批次大小，同時到達的請求才能合併成一批生成
+    max_workers=int(os.environ.get("RAG_INFERENCE_WORKERS", 8)),
+    max_queue=int(os.environ.get("RAG_INFERENCE_QUEUE", 32))
+)
+
+# 單一 /query_batch 請求的問題數上限
+QUERY_BATCH_MAX = int(os.environ.get("RAG_QUERY_BATCH_MAX", 10000))
+
+async def run_bounded(executor: BoundedExecutor, fn, *args, **kwargs):
+    try:
+        return await executor.run(fn, *args, **kwargs)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+def require(*components: str):
+    """元件尚未就緒時直接回 503，不進入執行緒池"""
+    if not rag_instance:
+        raise HTTPException(status_code=500, detail="RAG system not initialized")
+    rag_instance.require(*components)
+
+def require_writer():
+    """匯入端點：唯讀的查詢工作者直接回 403"""
+    require("embedder", "index")
+    rag_instance.require_writable()
+
+def parse_filters(filters: Optional[Dict[str, Any]]):
+    try:
+        return build_metadata_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def ingest_upload(filename: str, content: bytes, ingest_fn):
+    """把上傳內容寫到暫存檔並匯入，結束後刪除"""
+    # 每個請求用獨立資料夾，同名檔案同時上傳也不會互相覆蓋，檔名仍保留在 metadata 中
+    upload_dir = os.path.join("./uploads", uuid.uuid4().hex)
+    os.makedirs(upload_dir, exist_ok=True)
+    file_path = os.path.join(upload_dir, os.path.basename(filename))
+    try:
+        with open(file_path, "wb") as f:
+            f.write(content)
+        ingest_fn(file_path)
+    finally:
+        # 清理臨時文件
+        shutil.rmtree(upload_dir, ignore_errors=True)
 
 class DocumentInput(BaseModel):
     text: str
@@ -20,20 +97,75 @@ class DocumentInput(BaseModel):
 class QueryInput(BaseModel):
     query: str
     top_k: Optional[int] = 3
+    # compact 只呼叫一次 LLM；tree_summarize 等多次呼叫的模式需明確指定
+    response_mode: Optional[str] = "compact"
+    # 例如 {"course_name": "人工智慧導論", "page": {"gte": 10, "lte": 30}, "source_type": ["pdf"]}
+    filters: Optional[Dict[str, Any]] = None
+    # 在回應中附上各階段耗時（timings_ms），串流查詢不支援
+    include_timings: Optional[bool] = False
+
+class QueryBatchInput(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = 3
+    response_mode: Optional[str] = "compact"
+    # 套用到批次中的每個問題
+    filters: Optional[Dict[str, Any]] = None
+    # 一次把所有提示送進 LLM 的批次佇列；false 時逐一生成
+    batch_generation: Optional[bool] = True
+
+class RetrieveInput(BaseModel):
+    query: str
+    top_k: Optional[int] = 3
+    filters: Optional[Dict[str, Any]] = None
+    include_timings: Optional[bool] = False
+
+class BulkIngestInput(BaseModel):
+    directory: Optional[str] = None
+    manifest: Optional[str] = None
+    workers: Optional[int] = 4
+    checkpoint_every: Optional[int] = 20
+
+@app.exception_handler(ComponentNotReady)
+async def component_not_ready_handler(request, exc: ComponentNotReady):
+    # 載入失敗不會自行恢復，回 500；仍在載入中回 503 讓用戶端稍後重試
+    if exc.error:
+        return JSONResponse(status_code=500, content={"detail": str(exc)})
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "5"})
+
+@app.exception_handler(IndexReadOnly)
+async def index_read_only_handler(request, exc: IndexReadOnly):
+    return JSONResponse(status_code=403, content={"detail": str(exc)})
 
 @app.on_event("startup")
 async def startup_event():
     global rag_instance
+    # 模型與索引在背景載入，伺服器立即開始服務；以 /ready 確認是否就緒
     rag_instance = MultiModalRAG(
         model_name="yentinglin/Taiwan-LLM-7B-v2.0-base",
         index_folder="./storage",
-        device="cuda"  # 或 "cuda"
+        device=os.environ.get("RAG_DEVICE", "cuda"),  # 或 "cpu"
+        # CPU 部署可設為 "int8" 或 "bf16"
+        cpu_quantization=os.environ.get("RAG_CPU_QUANTIZATION") or None,
+        # 例如 "BAAI/bge-reranker-base"；先取較多候選，再以 cross-encoder 挑出 top_k
+        rerank_model=os.environ.get("RAG_RERANK_MODEL") or None,
+        rerank_candidates=int(os.environ.get("RAG_RERANK_CANDIDATES", 20)),
+        lazy_load=True,
+        load_llm=ROLE != "writer",
+        # 設定時 LLM 由 generation_server 行程提供（serve.py 會設定），這裡只載入分詞器
+        llm_url=os.environ.get("RAG_LLM_URL") or None,
+        read_only=ROLE == "reader"
     )
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if rag_instance:
+        rag_instance.close()
+    ingest_executor.shutdown(wait=False)
+    inference_executor.shutdown(wait=False)
+
 @app.post("/add_documents")
 async def add_documents(documents: List[DocumentInput]):
-    if not rag_instance:
-        raise HTTPException(status_code=500, detail="RAG system not initialized")
+    require_writer()
     
     docs = [
         MultiModalDocument(
@@ -46,66 +178,246 @@ async def add_documents(documents: List[DocumentInput]):
         for doc in documents
     ]
     
-    rag_instance.add_documents(docs)
+    await run_bounded(ingest_executor, rag_instance.add_documents, docs)
     return {"status": "success", "message": f"Added {len(docs)} documents"}
 
 @app.post("/add_pdf")
 async def add_pdf(file: UploadFile = File(...)):
-    if not rag_instance:
-        raise HTTPException(status_code=500, detail="RAG system not initialized")
-    
-    # 保存上傳的文件
-    file_path = f"./uploads/{file.filename}"
-    os.makedirs("./uploads", exist_ok=True)
+    require_writer()
     
+    content = await file.read()
     try:
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        rag_instance.add_pdf(file_path)
+        await run_bounded(ingest_executor, ingest_upload, file.filename, content, rag_instance.add_pdf)
         return {"status": "success", "message": "PDF added successfully"}
+    except (HTTPException, ComponentNotReady, IndexReadOnly):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # 清理臨時文件
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
 @app.post("/add_video_transcript")
 async def add_video_transcript(
     video_name: str = Form(...),  # 改用 Form
     transcript: UploadFile = File(...)
 ):
-    if not rag_instance:
-        raise HTTPException(status_code=500, detail="RAG system not initialized")
-    
-    transcript_path = f"./uploads/{transcript.filename}"
-    os.makedirs("./uploads", exist_ok=True)
+    require_writer()
     
+    content = await transcript.read()
     try:
-        with open(transcript_path, "wb") as f:
-            content = await transcript.read()
-            f.write(content)
-        
-        rag_instance.add_video(video_name, transcript_path)
+        await run_bounded(
+            ingest_executor,
+            ingest_upload,
+            transcript.filename,
+            content,
+            lambda path: rag_instance.add_video(video_name, path)
+        )
         return {"status": "success", "message": "Video transcript added successfully"}
+    except (HTTPException, ComponentNotReady, IndexReadOnly):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(transcript_path):
-            os.remove(transcript_path)
 
 @app.post("/query")
 async def query(query_input: QueryInput):
-    if not rag_instance:
-        raise HTTPException(status_code=500, detail="RAG system not initialized")
+    require("embedder", "index", "llm")
     
-    result = rag_instance.query(
+    result = await run_bounded(
+        inference_executor,
+        rag_instance.query,
         query_text=query_input.query,
-        top_k=query_input.top_k
+        top_k=query_input.top_k,
+        response_mode=query_input.response_mode,
+        filters=parse_filters(query_input.filters),
+        include_timings=bool(query_input.include_timings)
     )
     return result
 
+@app.post("/retrieve")
+async def retrieve(retrieve_input: RetrieveInput):
+    """只回傳檢索到的片段與 metadata，不生成回答"""
+    require("embedder", "index")
+
+    return await run_bounded(
+        inference_executor,
+        rag_instance.retrieve,
+        query_text=retrieve_input.query,
+        top_k=retrieve_input.top_k,
+        filters=parse_filters(retrieve_input.filters),
+        include_timings=bool(retrieve_input.include_timings)
+    )
+
+@app.post("/query_stream")
+async def query_stream(query_input: QueryInput):
+    """以 Server-Sent Events 串流回答：先送出 sources，再逐段送出 token，最後是 done"""
+    require("embedder", "index", "llm")
+
+    try:
+        events = inference_executor.stream(
+            rag_instance.stream_query,
+            query_text=query_input.query,
+            top_k=query_input.top_k,
+            response_mode=query_input.response_mode,
+            filters=parse_filters(query_input.filters)
+        )
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    async def event_stream():
+        try:
+            async for event in events:
+                yield f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            # 回應標頭已送出，只能以 error 事件通知用戶端
+            yield f"event: error\ndata: {json.dumps({'event': 'error', 'detail': str(e)}, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/query_batch")
+async def query_batch(batch_input: QueryBatchInput):
+    """批次查詢：以 NDJSON 逐行回傳完成的結果（含 index 對應 queries 中的位置），最後一行是 done"""
+    require("embedder", "index", "llm")
+    if len(batch_input.queries) > QUERY_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QUERY_BATCH_MAX} queries per batch")
+
+    try:
+        # 整個批次只佔執行緒池的一個名額
+        events = inference_executor.stream(
+            rag_instance.query_batch,
+            queries=batch_input.queries,
+            top_k=batch_input.top_k,
+            response_mode=batch_input.response_mode,
+            filters=parse_filters(batch_input.filters),
+            batch_generation=bool(batch_input.batch_generation)
+        )
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    async def ndjson_stream():
+        try:
+            async for event in events:
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"event": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(
+        ndjson_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def resolve_ingest_path(path: str) -> str:
+    """相對路徑以 INGEST_ROOT 為基準；解析符號連結後仍須位於 INGEST_ROOT 之下"""
+    full_path = os.path.realpath(os.path.join(INGEST_ROOT, path))
+    if os.path.commonpath([full_path, INGEST_ROOT]) != INGEST_ROOT:
+        raise HTTPException(status_code=400, detail=f"Path is outside the ingest root: {path}")
+    return full_path
+
+def prune_bulk_jobs():
+    finished = [job_id for job_id, job in bulk_jobs.items() if job.finished]
+    for job_id in finished[:max(0, len(finished) - BULK_JOBS_KEEP)]:
+        del bulk_jobs[job_id]
+
+@app.post("/bulk_ingest")
+async def bulk_ingest(job_input: BulkIngestInput):
+    require_writer()
+    if not job_input.directory and not job_input.manifest:
+        raise HTTPException(status_code=400, detail="directory or manifest is required")
+    # 同時只執行一個批次匯入
+    running = next((job_id for job_id, job in bulk_jobs.items() if not job.finished), None)
+    if running:
+        raise HTTPException(status_code=409, detail=f"Bulk ingest job {running} is still running")
+
+    directory = resolve_ingest_path(job_input.directory) if job_input.directory else None
+    manifest = resolve_ingest_path(job_input.manifest) if job_input.manifest else None
+    if directory and not os.path.isdir(directory):
+        raise HTTPException(status_code=400, detail=f"Directory not found: {job_input.directory}")
+    if manifest and not os.path.isfile(manifest):
+        raise HTTPException(status_code=400, detail=f"Manifest not found: {job_input.manifest}")
+
+    try:
+        items = collect_items(directory, manifest)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 清單檔中的路徑同樣不能指向 INGEST_ROOT 以外
+    for item in items:
+        item["path"] = resolve_ingest_path(item["path"])
+
+    job = BulkIngestJob(
+        rag_instance,
+        items,
+        extract_workers=job_input.workers,
+        checkpoint_every=job_input.checkpoint_every
+    )
+    job_id = uuid.uuid4().hex
+    prune_bulk_jobs()
+    bulk_jobs[job_id] = job
+    # 匯入可能要數小時，在背景執行緒中進行，以 GET /bulk_ingest/{job_id} 查詢進度
+    threading.Thread(target=job.run, daemon=True).start()
+    return {"status": "started", "job_id": job_id, "total": len(items)}
+
+@app.get("/bulk_ingest/{job_id}")
+async def bulk_ingest_status(job_id: str):
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job.progress()
+
+@app.get("/health")
+async def health():
+    """伺服器存活即回 200，並列出各元件的載入狀態"""
+    if not rag_instance:
+        return {"status": "starting"}
+    return {"status": "ok", **rag_instance.status()}
+
+@app.get("/ready")
+async def ready():
+    """所有元件（含 LLM）就緒才回 200；writer 不載入 LLM，檢索就緒即可"""
+    if not rag_instance:
+        return JSONResponse(status_code=503, content={"ready": False})
+    status = rag_instance.status()
+    ready = status["retrieval"] if ROLE == "writer" else status["generation"]
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, **status}
+    )
+
+@app.get("/cache_stats")
+async def cache_stats():
+    if not rag_instance:
+        raise HTTPException(status_code=500, detail="RAG system not initialized")
+    stats = {"enabled": False}
+    if rag_instance.answer_cache is not None:
+        stats = {"enabled": True, **rag_instance.answer_cache.stats()}
+    if rag_instance.reranker is not None:
+        stats["reranker"] = rag_instance.reranker.stats()
+    return stats
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus 文字格式：各階段延遲的 p50/p95/p99、計數器與快取命中率"""
+    gauges = {}
+    for executor in (ingest_executor, inference_executor):
+        stats = executor.stats()
+        gauges[f"{executor.name}_in_flight"] = stats["in_flight"]
+        gauges[f"{executor.name}_rejected"] = stats["rejected"]
+    if rag_instance:
+        gauges["index_generation"] = rag_instance.generation
+        gauges["applied_segment"] = rag_instance.applied_seq
+        if rag_instance.answer_cache is not None:
+            stats = rag_instance.answer_cache.stats()
+            gauges["answer_cache_entries"] = stats["entries"]
+            gauges["answer_cache_hit_rate"] = stats["hit_rate"]
+        if rag_instance.reranker is not None:
+            stats = rag_instance.reranker.stats()
+            gauges["rerank_cache_entries"] = stats["cache_entries"]
+            gauges["rerank_cache_hit_rate"] = stats["cache_hit_rate"]
+    return PlainTextResponse(
+        METRICS.render_prometheus(gauges),
+        media_type="text/plain; version=0.0.4"
+    )
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
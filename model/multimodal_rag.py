@@ -1,22 +1,216 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Iterator, Optional
 import torch
 from document_processor import DocumentProcessor, MultiModalDocument
 from llama_index.core import (
     VectorStoreIndex,
-    Document,
     Settings,
     StorageContext,
     load_index_from_storage
 )
-from llama_index.llms.huggingface import HuggingFaceLLM
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core.node_parser import SimpleNodeParser
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.prompts import PromptTemplate
+from llama_index.core.schema import QueryBundle, MetadataMode, NodeWithScore
 from transformers import AutoTokenizer, AutoModelForCausalLM
+from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.storage.docstore import SimpleDocumentStore
+from segment_log import SegmentLog
+from writer_lock import WriterLock
+from numpy_vector_store import NumpyVectorStore
+from sqlite_docstore import SQLiteDocumentStore
+from ann_index import IVFFlatIndex
+from answer_cache import AnswerCache
+from generation_batcher import BatchedHuggingFaceLLM
+from remote_llm import RemoteLLM
+from embedding_cache import EmbeddingCache, content_hash
+from metadata_index import build_metadata_filters, metadata_matches
+from bm25_index import BM25Index, tokenize as bm25_tokenize
+from reranker import CrossEncoderReranker, RankedNode
+from chunking import SourceAwareChunker
+from metrics import METRICS, request_trace
+from cpu_inference import CPU_QUANTIZATION_MODES, load_cpu_llm, quantize_embedding_model
+import numpy as np
 import os
+import shutil
+import contextvars
+import logging
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+
+# 載入與世代切換記錄在 INFO；每次匯入與查詢的計時只在 DEBUG 層級輸出，各階段延遲以 METRICS 為準
+logger = logging.getLogger(__name__)
+
+# 單次 LLM 呼叫的回應模式；其他模式交給 llama_index 的回應合成器
+COMPACT_MODE = "compact"
+
+# 背景載入的元件；index 需要先有 embedder
+COMPONENTS = ("embedder", "index", "llm")
+
+
+class ComponentNotReady(Exception):
+    """元件尚未載入完成或載入失敗"""
+
+    def __init__(self, component: str, error: str = None):
+        self.component = component
+        self.error = error
+        if error:
+            super().__init__(f"{component} failed to load: {error}")
+        else:
+            super().__init__(f"{component} is still loading")
+
+
+class IndexReadOnly(Exception):
+    """唯讀模式（查詢工作者）不能寫入索引"""
+
+
+class EmbeddingPipeline:
+    """批次嵌入管線
+
+    先依 token 長度排序以減少 padding，再依設定的批次大小嵌入；
+    背景執行緒預先把後面幾批分詞好，與模型前向運算重疊。
+    """
+
+    def __init__(self, embed_model, batch_size: int = 32, num_workers: int = 2):
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.num_workers = max(1, num_workers)
+
+    def _sentence_transformer(self):
+        # HuggingFaceEmbedding 內部是 SentenceTransformer，其他嵌入模型走通用路徑
+        model = getattr(self.embed_model, "_model", None)
+        if model is not None and hasattr(model, "tokenize") and hasattr(model, "tokenizer"):
+            return model
+        return None
+
+    def _token_lengths(self, model, texts: List[str], pool: ThreadPoolExecutor) -> List[int]:
+        if model is None:
+            return [len(text) for text in texts]
+        chunks = [texts[i:i + 256] for i in range(0, len(texts), 256)]
+        lengths = []
+        for ids in pool.map(lambda chunk: model.tokenizer(chunk)["input_ids"], chunks):
+            lengths.extend(len(x) for x in ids)
+        return lengths
+
+    def _forward(self, model, features) -> List[List[float]]:
+        device = model.device
+        features = {key: value.to(device) for key, value in features.items()}
+        with torch.inference_mode():
+            embeddings = model(features)["sentence_embedding"]
+            if getattr(self.embed_model, "normalize", True):
+                embeddings = torch.nn.functional.normalize(embeddings, p=2, dim=1)
+        return embeddings.float().cpu().tolist()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """嵌入文字並依原順序回傳向量"""
+        if not texts:
+            return []
+        start = time.time()
+        embeddings, lengths = self._encode(texts, "text")
+        elapsed = time.time() - start
+        METRICS.observe("embed", elapsed)
+        METRICS.inc("embedded_nodes", len(texts))
+        if lengths is not None:
+            METRICS.inc("embedded_tokens", sum(lengths))
+        logger.debug("嵌入 %d 個節點: %.2f秒 (%.1f 節點/秒)", len(texts), elapsed, len(texts) / max(elapsed, 1e-9))
+        return embeddings
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """以查詢用的提示（如 bge 的查詢指令）批次嵌入多個問題"""
+        if not queries:
+            return []
+        with METRICS.stage("query_embed_batch"):
+            embeddings, _ = self._encode(queries, "query")
+        return embeddings
+
+    def _encode(self, texts: List[str], prompt_name: str) -> Tuple[List[List[float]], Optional[List[int]]]:
+        """回傳向量與各段文字的 token 數（非 SentenceTransformer 模型時為 None）"""
+        model = self._sentence_transformer()
+        prompt = ""
+        if model is not None:
+            prompt = (getattr(model, "prompts", None) or {}).get(prompt_name, "") or ""
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            lengths = self._token_lengths(model, texts, pool)
+            order = sorted(range(len(texts)), key=lambda i: lengths[i])
+            batches = [
+                order[i:i + self.batch_size]
+                for i in range(0, len(order), self.batch_size)
+            ]
+
+            embeddings: List[List[float]] = [None] * len(texts)
+            if model is None:
+                for batch in batches:
+                    if prompt_name == "query":
+                        # llama_index 沒有批次的查詢嵌入介面
+                        vectors = [self.embed_model.get_query_embedding(texts[i]) for i in batch]
+                    else:
+                        vectors = self.embed_model.get_text_embedding_batch([texts[i] for i in batch])
+                    for i, vector in zip(batch, vectors):
+                        embeddings[i] = vector
+            else:
+                def tokenize(batch):
+                    return model.tokenize([prompt + texts[i] for i in batch])
+
+                # 預先送出 num_workers 批分詞，模型運算時背景持續分詞
+                pending = [pool.submit(tokenize, batch) for batch in batches[:self.num_workers]]
+                for n, batch in enumerate(batches):
+                    features = pending[n].result()
+                    if n + self.num_workers < len(batches):
+                        pending.append(pool.submit(tokenize, batches[n + self.num_workers]))
+                    for i, vector in zip(batch, self._forward(model, features)):
+                        embeddings[i] = vector
+        return embeddings, None if model is None else lengths
+
+def load_generation_llm(
+    model_name: str,
+    device: str,
+    load_in_8bit: bool = False,
+    cpu_quantization: str = None,
+    max_batch_size: int = 8,
+    batch_window_ms: float = 10
+) -> BatchedHuggingFaceLLM:
+    """載入 LLM 並包成批次生成的 BatchedHuggingFaceLLM（MultiModalRAG 與 generation_server 共用）"""
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        trust_remote_code=True
+    )
+
+    if device == "cpu":
+        # CPU 的精度由 cpu_quantization 決定
+        model = load_cpu_llm(model_name, cpu_quantization)
+    else:
+        model_kwargs = {
+            "trust_remote_code": True,
+            "torch_dtype": torch.float16 if device == "cuda" else torch.float32,
+        }
+        if device == "cuda" and load_in_8bit:
+            model_kwargs.update({
+                "device_map": "auto",
+                "load_in_8bit": True,
+            })
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            **model_kwargs
+        )
+
+    return BatchedHuggingFaceLLM(
+        tokenizer=tokenizer,
+        model=model,
+        device_map="auto" if device == "cuda" else device,
+        context_window=512,
+        max_new_tokens=128,
+        generate_kwargs={
+            "temperature": 0.3,
+            "top_p": 0.85,
+            "do_sample": True,
+            "num_beams": 3
+        },
+        max_batch_size=max_batch_size,
+        batch_window_ms=batch_window_ms
+    )
+
 
 class MultiModalRAG:
     def __init__(
@@ -25,7 +219,44 @@ class MultiModalRAG:
         model_name: str = "yentinglin/Taiwan-LLM-7B-v2.0-base",
         embed_model_name: str = "BAAI/bge-large-zh-v1.5",
         device: str = None,  # 自動選擇設備
-        load_in_8bit: bool = True  # 啟用 8-bit 量化
+        load_in_8bit: bool = None,  # GPU 上的 8-bit 量化，None 時 GPU 預設啟用
+        cpu_quantization: str = None,  # CPU 上的 "int8" 動態量化或 "bf16"，None 為 float32
+        persist_mode: str = "segment",  # "segment" 追加分段 / "full" 每次完整寫出
+        compact_every: int = 16,  # 累積多少分段後壓縮成完整索引
+        vector_backend: str = "numpy",  # "numpy" mmap 矩陣 / "simple" llama_index 預設
+        docstore_backend: str = "sqlite",  # "sqlite" 節點留在磁碟、查詢時才讀取 / "json" llama_index 預設
+        vector_dtype: str = "float32",  # numpy 後端的向量精度，可用 "float16" 省一半空間
+        ann_index: str = None,  # "ivf" 啟用近似最近鄰搜尋（需 numpy 後端）
+        ann_nprobe: int = 8,  # 每次查詢掃描的 IVF 列表數，越大召回越高但越慢
+        ann_min_train_size: int = 4096,  # 向量數達到此值才訓練 IVF，之前維持精確搜尋
+        answer_cache: bool = True,  # 啟用問答語意快取
+        answer_cache_threshold: float = 0.95,  # 查詢向量餘弦相似度高於此值視為同一問題
+        answer_cache_ttl: float = 3600,  # 快取存活秒數
+        answer_cache_max_entries: int = 1024,
+        answer_cache_max_bytes: int = 64 * 1024 * 1024,
+        embedding_cache: bool = True,  # 以內容雜湊快取嵌入
+        dedupe: bool = True,  # 略過內容與已索引節點完全相同的節點，不受 embedding_cache 影響
+        embed_batch_size: int = 32,  # 嵌入批次大小
+        embed_workers: int = 2,  # 預先分詞的執行緒數
+        chunk_size: int = 256,  # 每個節點的 token 上限（以嵌入模型的分詞器計算，含 metadata）
+        chunk_overlap: int = 30,  # 句子切分時相鄰節點重疊的 token 數
+        transcript_window_seconds: float = 60,  # 連續字幕合併成一個節點的時間長度
+        llm_batch_size: int = 8,  # 同時生成的最大請求數，1 表示不合併批次
+        llm_batch_window_ms: float = 10,  # 等待其他請求加入同一批次的時間
+        hybrid_search: bool = True,  # 向量檢索之外加上 BM25 詞彙檢索，以 RRF 融合
+        hybrid_candidates: int = 20,  # 兩路各取多少候選參與融合
+        hybrid_budget_ms: float = 50,  # BM25 超過此時間（自查詢開始）就只用向量結果
+        rrf_k: int = 60,
+        rerank_model: str = None,  # cross-encoder 名稱，如 "BAAI/bge-reranker-base"；None 不重新排序
+        rerank_candidates: int = 20,  # 重新排序前先檢索的候選數
+        rerank_batch_size: int = 16,  # cross-encoder 每批評分的 (查詢, 片段) 對數
+        lazy_load: bool = False,  # 在背景平行載入模型與索引，建構子立即返回
+        load_llm: bool = True,  # 只做匯入或檢索時可不載入 LLM
+        read_only: bool = False,  # 查詢工作者：唯讀開啟索引，輪詢寫入端的新世代與分段
+        refresh_interval: float = 2.0,  # 唯讀模式檢查 manifest 的間隔秒數
+        embed_model=None,  # 直接使用的 llama_index 嵌入模型（如 benchmarks.stubs），指定時忽略 embed_model_name
+        llm=None,  # 直接使用的 LLM，需有 tokenizer、context_window 與 max_new_tokens；指定時忽略 model_name
+        llm_url: str = None  # generation_server 的網址；指定時不載入模型，只載入 model_name 的分詞器
     ):
         # 自動選擇設備
         self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
@@ -36,61 +267,262 @@ class MultiModalRAG:
         初始化多模態 RAG 系統
         """
         self.index_folder = index_folder
+        if cpu_quantization not in (None,) + CPU_QUANTIZATION_MODES:
+            raise ValueError(f"Unknown cpu_quantization: {cpu_quantization}")
+        if load_in_8bit and cpu_quantization and self.device == "cpu":
+            raise ValueError("load_in_8bit only applies on GPU; use cpu_quantization alone on CPU")
+        load_in_8bit = self.device == "cuda" if load_in_8bit is None else load_in_8bit
+        # 只在 CPU 上生效；GPU 仍使用 load_in_8bit
+        self.cpu_quantization = cpu_quantization if self.device == "cpu" else None
         self.doc_processor = DocumentProcessor()
+        self.index = None
+        self.storage_context = None
+        self.llm = None
+        self._embed_model = embed_model
+        self._llm = llm
+        self.llm_url = llm_url
+        self._ready = {name: threading.Event() for name in COMPONENTS}
+        self._load_errors: Dict[str, str] = {}
+        if persist_mode not in ("segment", "full"):
+            raise ValueError(f"Unknown persist_mode: {persist_mode}")
+        self.persist_mode = persist_mode
+        self.segment_log = SegmentLog(index_folder, compact_every=compact_every)
+        # 目前載入的索引世代與已套用到的分段序號
+        self.generation = 0
+        self.applied_seq = 0
+        self.read_only = read_only
+        self.refresh_interval = refresh_interval
+        self._closed = threading.Event()
+        self._writer_lock = None
+        if vector_backend not in ("numpy", "simple"):
+            raise ValueError(f"Unknown vector_backend: {vector_backend}")
+        self.vector_backend = vector_backend
+        if docstore_backend not in ("sqlite", "json"):
+            raise ValueError(f"Unknown docstore_backend: {docstore_backend}")
+        self.docstore_backend = docstore_backend
+        # 所有世代共用的 SQLite 文件庫，取得寫入鎖之後才開啟
+        self.docstore = None
+        self.vector_dtype = vector_dtype
+        if ann_index not in (None, "ivf"):
+            raise ValueError(f"Unknown ann_index: {ann_index}")
+        if ann_index and vector_backend != "numpy":
+            raise ValueError("ann_index requires vector_backend='numpy'")
+        self.ann_index = ann_index
+        self.ann_nprobe = ann_nprobe
+        self.ann_min_train_size = ann_min_train_size
+        self.hybrid_candidates = hybrid_candidates
+        self.hybrid_budget_ms = hybrid_budget_ms
+        self.rrf_k = rrf_k
+        self.hybrid_search = hybrid_search
+        self.rerank_model = rerank_model
+        self.rerank_candidates = rerank_candidates
+        self.rerank_batch_size = rerank_batch_size
+        self.reranker = None
+        self.bm25_index = BM25Index() if hybrid_search else None
+        self.hybrid_timeouts = 0
+        self._sparse_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25") if hybrid_search else None
+
+        # 以 (top_k, response_mode) 快取建好的查詢引擎，索引變動時清空
+        self._query_engines: Dict[Tuple[int, str, bool], RetrieverQueryEngine] = {}
+        self._retrievers: Dict[int, VectorIndexRetriever] = {}
+        self._engine_lock = threading.RLock()
+
+        # 寫入索引與持久化共用一把鎖；尚未寫出的節點與其內容雜湊暫存在記憶體
+        self._write_lock = threading.RLock()
+        self._unpersisted_nodes = []
+        self._unpersisted_hashes = set()
+
+        self.answer_cache = None
+        if answer_cache:
+            self.answer_cache = AnswerCache(
+                similarity_threshold=answer_cache_threshold,
+                max_entries=answer_cache_max_entries,
+                max_bytes=answer_cache_max_bytes,
+                ttl_seconds=answer_cache_ttl,
+                # BM25 以詞比對，向量相似度低的新節點也可能進入 top-k
+                term_tokenizer=bm25_tokenize if hybrid_search else None
+            )
         
-        # 設定嵌入模型
-        Settings.embed_model = HuggingFaceEmbedding(
-            model_name=embed_model_name,
-            device=device
-        )
-        
-        # 設定 LLM
-        self.setup_llm(model_name, load_in_8bit)
+        self.embedding_cache = None
+        self.chunk_registry = None
+        # 嵌入快取與已索引內容的雜湊只在匯入時使用，唯讀行程不開啟以免與寫入端爭用 SQLite
+        if (embedding_cache or dedupe) and not read_only:
+            cache_name = embed_model_name
+            if embed_model is not None:
+                cache_name = embed_model.model_name
+            elif self.cpu_quantization:
+                # 量化後的向量與原模型略有差異，分開快取
+                cache_name = f"{embed_model_name}:{self.cpu_quantization}"
+            # 同一個 SQLite 檔：embeddings 表為嵌入快取，indexed_chunks 表供去重
+            self.chunk_registry = EmbeddingCache(
+                os.path.join(index_folder, "embedding_cache.sqlite"),
+                model_name=cache_name
+            )
+            if embedding_cache:
+                self.embedding_cache = self.chunk_registry
+        self.dedupe = dedupe and self.chunk_registry is not None
         
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.transcript_window_seconds = transcript_window_seconds
+        self.llm_batch_size = llm_batch_size
+        self.llm_batch_window_ms = llm_batch_window_ms
+
         # 設定提示模板
         self.setup_prompts()
-        
-        # 載入或創建索引
-        self.load_or_create_index()
-        
-    def setup_llm(self, model_name: str, load_in_8bit: bool):
-        """設定語言模型"""
-        tokenizer = AutoTokenizer.from_pretrained(
-            model_name,
-            trust_remote_code=True
-        )
-        
-        model_kwargs = {
-            "trust_remote_code": True,
-            "torch_dtype": torch.float16 if self.device == "cuda" else torch.float32,
+
+        if not read_only:
+            # 同一個索引目錄只能有一個寫入者，其他行程以 read_only 開啟
+            self._writer_lock = WriterLock(index_folder)
+            self._writer_lock.acquire()
+
+        # 嵌入模型 → 索引 與 LLM 兩條路線互不相依；
+        # 背景載入時檢索與匯入在嵌入模型與索引就緒後即可使用，不必等 LLM
+        def load_retrieval(raise_errors: bool):
+            if self._load_component("embedder", raise_errors, self.setup_embedder,
+                                    embed_model_name, embed_batch_size, embed_workers):
+                if self._load_component("index", raise_errors, self.load_or_create_index) and self.read_only:
+                    threading.Thread(target=self._refresh_loop, name="index-refresh", daemon=True).start()
+            else:
+                self._load_errors["index"] = "embedder failed to load"
+
+        def load_generation(raise_errors: bool):
+            self._load_component("llm", raise_errors, self.setup_llm, model_name, load_in_8bit)
+
+        if not load_llm:
+            self._load_errors["llm"] = "disabled (load_llm=False)"
+        if lazy_load:
+            threading.Thread(target=load_retrieval, args=(False,), name="load-retrieval", daemon=True).start()
+            if load_llm:
+                threading.Thread(target=load_generation, args=(False,), name="load-llm", daemon=True).start()
+        else:
+            load_retrieval(True)
+            if load_llm:
+                load_generation(True)
+
+    def _load_component(self, name: str, raise_errors: bool, load_fn, *args) -> bool:
+        """載入單一元件並記錄狀態，回傳是否成功"""
+        start = time.time()
+        try:
+            load_fn(*args)
+        except Exception as e:
+            self._load_errors[name] = f"{type(e).__name__}: {e}"
+            logger.exception("%s 載入失敗: %s", name, self._load_errors[name])
+            if raise_errors:
+                raise
+            return False
+        self._ready[name].set()
+        logger.info("%s 載入時間: %.2f秒", name, time.time() - start)
+        return True
+
+    def require(self, *components: str):
+        """確認元件已就緒，否則拋出 ComponentNotReady"""
+        for name in components:
+            if not self._ready[name].is_set():
+                raise ComponentNotReady(name, self._load_errors.get(name))
+
+    def is_ready(self, *components: str) -> bool:
+        return all(self._ready[name].is_set() for name in (components or COMPONENTS))
+
+    def wait_until_ready(self, *components: str, timeout: float = None):
+        """等待元件載入完成；載入失敗時拋出 ComponentNotReady"""
+        deadline = None if timeout is None else time.time() + timeout
+        for name in components or COMPONENTS:
+            while not self._ready[name].wait(0.1):
+                if name in self._load_errors:
+                    break
+                if deadline is not None and time.time() >= deadline:
+                    break
+            self.require(name)
+
+    def status(self) -> Dict[str, Any]:
+        """各元件的載入狀態：ready / loading / failed"""
+        components = {}
+        for name in COMPONENTS:
+            if self._ready[name].is_set():
+                components[name] = {"status": "ready"}
+            elif name in self._load_errors:
+                components[name] = {"status": "failed", "error": self._load_errors[name]}
+            else:
+                components[name] = {"status": "loading"}
+        return {
+            "components": components,
+            "retrieval": self.is_ready("embedder", "index"),
+            "generation": self.is_ready(),
+            "read_only": self.read_only,
+            "index_generation": self.generation,
+            "applied_segment": self.applied_seq,
         }
-        
-        if self.device == "cuda" and load_in_8bit:
-            model_kwargs.update({
-                "device_map": "auto",
-                "load_in_8bit": True,
-            })
-        
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            **model_kwargs
+
+    def require_writable(self):
+        if self.read_only:
+            raise IndexReadOnly("This process opened the index read-only; send ingestion to the writer")
+
+    def close(self):
+        """停止背景更新、關閉 SQLite 連線並釋放寫入鎖"""
+        self._closed.set()
+        if self.docstore is not None:
+            self.docstore.close()
+        if self.chunk_registry is not None:
+            self.chunk_registry.close()
+        if self._writer_lock is not None:
+            self._writer_lock.release()
+
+    def setup_embedder(self, embed_model_name: str, embed_batch_size: int, embed_workers: int):
+        """設定嵌入模型"""
+        if self._embed_model is not None:
+            Settings.embed_model = self._embed_model
+        else:
+            Settings.embed_model = HuggingFaceEmbedding(
+                model_name=embed_model_name,
+                device=self.device
+            )
+            if self.cpu_quantization:
+                quantize_embedding_model(Settings.embed_model, self.cpu_quantization)
+
+        self.embedding_pipeline = EmbeddingPipeline(
+            Settings.embed_model,
+            batch_size=embed_batch_size,
+            num_workers=embed_workers
         )
-        
-        self.llm = HuggingFaceLLM(
-            tokenizer=tokenizer,
-            model=model,
-            device_map="auto" if self.device == "cuda" else None,
-            context_window=512,
-            max_new_tokens=128,
-            generate_kwargs={
-                "temperature": 0.3,
-                "top_p": 0.85,
-                "do_sample": True,
-                "num_beams": 3
-            }
+        # 以嵌入模型的分詞器計算節點長度，切出的塊不會在嵌入時被截斷
+        model = self.embedding_pipeline._sentence_transformer()
+        self.chunker = SourceAwareChunker(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            transcript_window_seconds=self.transcript_window_seconds,
+            tokenizer=None if model is None else (
+                lambda text: model.tokenizer.encode(text, add_special_tokens=False)
+            )
         )
-        
-        Settings.llm = self.llm
+        # reranker 屬於檢索路線，與嵌入模型一起載入
+        if self.rerank_model:
+            self.reranker = CrossEncoderReranker(
+                self.rerank_model,
+                device=self.device,
+                batch_size=self.rerank_batch_size
+            )
+
+    def setup_llm(self, model_name: str, load_in_8bit: bool):
+        """設定語言模型"""
+        llm = self._llm
+        if llm is None and self.llm_url:
+            # 生成由 generation_server 行程負責，這裡只載入分詞器計算提示長度
+            tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+            llm = RemoteLLM(self.llm_url, tokenizer)
+            llm.wait_until_ready(stop=self._closed)
+        elif llm is None:
+            llm = load_generation_llm(
+                model_name,
+                self.device,
+                load_in_8bit=load_in_8bit,
+                cpu_quantization=self.cpu_quantization,
+                max_batch_size=self.llm_batch_size,
+                batch_window_ms=self.llm_batch_window_ms
+            )
+        # compact 模式用來計算提示長度
+        self.llm_tokenizer = llm.tokenizer
+        self.llm = Settings.llm = llm
         
     def setup_prompts(self):
         """設定提示模板"""
@@ -106,102 +538,892 @@ class MultiModalRAG:
         )
         
     def load_or_create_index(self):
-        """載入或創建索引"""
-        if os.path.exists(self.index_folder):
-            self.storage_context = StorageContext.from_defaults(
-                persist_dir=self.index_folder
+        """載入或創建索引：目前世代的完整索引，再重播之後的分段"""
+        if self.docstore_backend == "sqlite" and self.docstore is None:
+            self.docstore = SQLiteDocumentStore.from_index_folder(self.index_folder, read_only=self.read_only)
+        generation, compacted_through = self.segment_log.state()
+        self._switch_generation(generation, compacted_through)
+        self._replay_segments()
+
+    def _open_generation(self, generation: int):
+        """載入某個世代的完整索引，回傳 (storage_context, index, bm25_index)，不更動目前狀態"""
+        persist_dir = self.segment_log.generation_dir(generation)
+        bm25_index = BM25Index() if self.hybrid_search else None
+        # 只有壓縮過的完整索引才會有 index_store.json
+        if not os.path.exists(os.path.join(persist_dir, "index_store.json")):
+            return None, None, bm25_index
+        storage_context = StorageContext.from_defaults(
+            persist_dir=persist_dir,
+            docstore=self._open_docstore(persist_dir),
+            vector_store=self._load_vector_store(persist_dir)
+        )
+        index = load_index_from_storage(
+            storage_context=storage_context
+        )
+        self._rebuild_metadata_index(storage_context)
+        if bm25_index is not None:
+            self._load_bm25_index(bm25_index, index, persist_dir)
+        return storage_context, index, bm25_index
+
+    def _open_docstore(self, persist_dir: str):
+        """依世代目錄決定文件庫，回傳 None 表示由 StorageContext 載入 docstore.json"""
+        json_path = os.path.join(persist_dir, "docstore.json")
+        if os.path.exists(json_path):
+            if self.docstore is None or self.read_only:
+                return None
+            # 舊版的 JSON 文件庫匯入 SQLite；下次壓縮寫出的世代就不再有 docstore.json
+            start = time.time()
+            legacy = SimpleDocumentStore.from_persist_path(json_path)
+            self.docstore.add_documents(list(legacy.docs.values()))
+            self.docstore.commit()
+            logger.info("匯入 docstore.json 到 SQLite: %.2f秒", time.time() - start)
+            return self.docstore
+        if self.docstore is not None:
+            return self.docstore
+        # json 後端讀取 SQLite 後端寫出的世代
+        docstore = SimpleDocumentStore()
+        source = SQLiteDocumentStore.from_index_folder(self.index_folder, read_only=True)
+        docstore.add_documents(list(source.iter_nodes()))
+        source.close()
+        return docstore
+
+    def _switch_generation(self, generation: int, compacted_through: int):
+        """在旁邊載入好新世代後一次替換，查詢不需要等待載入"""
+        storage_context, index, bm25_index = self._open_generation(generation)
+        if self.read_only and self.docstore is not None:
+            # 新世代已包含之前重播的分段，寫入端也已提交這些節點
+            self.docstore.clear_overlay()
+        with self._engine_lock:
+            self.storage_context = storage_context
+            self.index = index
+            self.bm25_index = bm25_index
+            self.generation = generation
+            self.applied_seq = compacted_through
+            self._invalidate_query_engines()
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
+
+    def _replay_segments(self):
+        """重播尚未套用的分段，節點已帶有向量因此不會重新嵌入"""
+        for seq, nodes in self.segment_log.replay(after=self.applied_seq):
+            self._insert_nodes(nodes)
+            if self.answer_cache is not None:
+                self.answer_cache.invalidate_for(
+                    [node.embedding for node in nodes],
+                    [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+                )
+            self.applied_seq = seq
+
+    def refresh(self) -> bool:
+        """唯讀模式：套用寫入端新的世代或分段，回傳索引是否有變動"""
+        with self._write_lock:
+            generation, compacted_through = self.segment_log.state()
+            applied = (self.generation, self.applied_seq)
+            if generation != self.generation:
+                start = time.time()
+                self._switch_generation(generation, compacted_through)
+                logger.info("切換到索引世代 %d: %.2f秒", generation, time.time() - start)
+            self._replay_segments()
+            return (self.generation, self.applied_seq) != applied
+
+    def _refresh_loop(self):
+        while not self._closed.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # 例如剛好讀到被刪除的舊世代，下次輪詢再試
+                logger.warning("索引更新失敗: %s: %s", type(e).__name__, e)
+
+    def _rebuild_metadata_index(self, storage_context):
+        """舊版索引沒有 metadata 倒排索引時，依 docstore 中的節點重建"""
+        vector_store = storage_context.vector_store
+        if not isinstance(vector_store, NumpyVectorStore) or not vector_store.needs_metadata_rebuild:
+            return
+        docstore = storage_context.docstore
+        metadatas = []
+        for row in range(vector_store.n_rows):
+            node = docstore.get_node(vector_store.node_id_at(row), raise_error=False)
+            metadatas.append(node.metadata if node is not None else {})
+        vector_store.rebuild_metadata(metadatas)
+
+    @staticmethod
+    def _load_bm25_index(bm25_index: BM25Index, index, persist_dir: str, batch_size: int = 1000):
+        """載入 BM25 索引；沒有或與索引的節點數不一致時（如舊版索引）依 docstore 分批重建"""
+        node_ids = list(index.index_struct.nodes_dict.values())
+        if bm25_index.load(persist_dir) and bm25_index.n_docs == len(node_ids):
+            return
+        bm25_index.reset()
+        for start in range(0, len(node_ids), batch_size):
+            nodes = [
+                node for node in index.docstore.get_nodes(node_ids[start:start + batch_size], raise_error=False)
+                if node is not None
+            ]
+            bm25_index.add(
+                [node.node_id for node in nodes],
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
             )
-            self.index = load_index_from_storage(
-                storage_context=self.storage_context
+
+    def _new_ann(self):
+        if self.ann_index != "ivf":
+            return None
+        return IVFFlatIndex(
+            nprobe=self.ann_nprobe,
+            min_train_size=self.ann_min_train_size
+        )
+
+    def _load_vector_store(self, persist_dir: str):
+        """依後端載入已寫出的向量庫，回傳 None 表示用 llama_index 預設"""
+        if self.vector_backend != "numpy":
+            return None
+        if NumpyVectorStore.exists(persist_dir):
+            return NumpyVectorStore.from_persist_dir(
+                persist_dir,
+                dtype=self.vector_dtype,
+                ann=self._new_ann()
             )
-        else:
-            self.index = None
-    
-    def add_documents(self, documents: List[MultiModalDocument]):
-        """添加文檔到索引"""
-        parser = SimpleNodeParser.from_defaults(
-            chunk_size=256,
-            chunk_overlap=30,
-            include_metadata=True
+        # 舊版以 JSON 寫出的向量庫，轉換後下次壓縮時改寫成 .npy
+        return NumpyVectorStore.from_simple_vector_store(
+            SimpleVectorStore.from_persist_dir(persist_dir),
+            dtype=self.vector_dtype,
+            ann=self._new_ann()
         )
-        
-        # 將 MultiModalDocument 轉換為 llama_index Document
-        llama_docs = [
-            Document(
-                text=doc.text,
-                metadata={
-                    **doc.metadata,
-                    "source_type": doc.source_type,
-                    "page_number": doc.page_number,
-                    "timestamp": doc.timestamp
-                }
-            )
-            for doc in documents
-        ]
-        
-        nodes = parser.get_nodes_from_documents(llama_docs)
-        
+
+    def _insert_nodes(self, nodes):
+        """把已嵌入的節點插入索引"""
+        self._invalidate_query_engines()
         if self.index is None:
+            vector_store = None
+            if self.vector_backend == "numpy":
+                vector_store = NumpyVectorStore(
+                    dtype=self.vector_dtype,
+                    ann=self._new_ann()
+                )
+            self.storage_context = StorageContext.from_defaults(
+                docstore=self.docstore,
+                vector_store=vector_store
+            )
+            # 節點已帶有向量，嵌入進度由 EmbeddingPipeline 回報
             self.index = VectorStoreIndex(
                 nodes,
-                show_progress=True
+                storage_context=self.storage_context
             )
         else:
             self.index.insert_nodes(nodes)
-            
-        if not os.path.exists(self.index_folder):
-            os.makedirs(self.index_folder)
-        self.index.storage_context.persist(persist_dir=self.index_folder)
+        if isinstance(self.index.docstore, SQLiteDocumentStore):
+            # VectorStoreIndex 逐一寫入節點，整批寫完才提交一次
+            self.index.docstore.commit()
+        if self.bm25_index is not None:
+            self.bm25_index.add(
+                [node.node_id for node in nodes],
+                [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            )
+
+    def add_documents(self, documents: List[MultiModalDocument], persist: bool = True):
+        """添加文檔到索引，persist=False 時只寫入記憶體，待之後呼叫 persist()"""
+        self.require("embedder", "index")
+        self.require_writable()
+        with METRICS.stage("add_documents"):
+            # 字幕合併成時間視窗、PDF 依段落與標題打包，其餘依句子切分
+            with METRICS.stage("chunk"):
+                nodes = self.chunker.get_nodes(documents)
+                contents = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+            METRICS.inc("ingested_documents", len(documents))
+            with self._write_lock:
+                with METRICS.stage("dedupe"):
+                    nodes, contents = self._drop_duplicate_nodes(nodes, contents)
+                if nodes:
+                    # 先取得向量，分段日誌才能連同向量一起寫出
+                    self._embed_nodes(nodes, contents)
+
+                    with METRICS.stage("index_insert"):
+                        self._insert_nodes(nodes)
+                    if self.answer_cache is not None:
+                        self.answer_cache.invalidate_for([node.embedding for node in nodes], contents)
+                    self._unpersisted_nodes.extend(nodes)
+                    self._unpersisted_hashes.update(content_hash(c) for c in contents)
+                    METRICS.inc("ingested_nodes", len(nodes))
+                if persist:
+                    self.persist()
+
+    def _drop_duplicate_nodes(self, nodes, contents):
+        """略過內容完全相同的節點（同一批內重複或已在索引中）"""
+        if not self.dedupe:
+            return nodes, contents
+        hashes = [content_hash(content) for content in contents]
+        seen = self.chunk_registry.indexed(hashes) | self._unpersisted_hashes
+        kept_nodes, kept_contents = [], []
+        for node, content, chunk_hash in zip(nodes, contents, hashes):
+            if chunk_hash in seen:
+                continue
+            seen.add(chunk_hash)
+            kept_nodes.append(node)
+            kept_contents.append(content)
+        if len(kept_nodes) < len(nodes):
+            METRICS.inc("duplicate_nodes", len(nodes) - len(kept_nodes))
+            logger.debug("略過重複節點: %d 個", len(nodes) - len(kept_nodes))
+        return kept_nodes, kept_contents
+
+    def _embed_nodes(self, nodes, contents):
+        """取得節點向量：先查嵌入快取，只嵌入未命中的節點"""
+        keys = None
+        missing = list(range(len(nodes)))
+        if self.embedding_cache is not None:
+            keys = [self.embedding_cache.embedding_key(content) for content in contents]
+            cached = self.embedding_cache.get_many(keys)
+            missing = []
+            for i, node in enumerate(nodes):
+                if keys[i] in cached:
+                    node.embedding = cached[keys[i]]
+                else:
+                    missing.append(i)
+            METRICS.inc("embedding_cache_lookups", len(nodes) - len(missing), result="hit")
+            METRICS.inc("embedding_cache_lookups", len(missing), result="miss")
+
+        if not missing:
+            return
+        embeddings = self.embedding_pipeline.embed([contents[i] for i in missing])
+        for i, embedding in zip(missing, embeddings):
+            nodes[i].embedding = embedding
+        if self.embedding_cache is not None:
+            self.embedding_cache.put_many({keys[i]: nodes[i].embedding for i in missing})
+
+    def persist(self):
+        """寫出尚未持久化的節點：分段模式只寫新節點，完整模式重寫整個索引"""
+        self.require("index")
+        self.require_writable()
+        with self._write_lock:
+            if self.index is None or not self._unpersisted_nodes:
+                return
+            if self.persist_mode == "full":
+                self.compact()
+                return
+
+            with METRICS.stage("persist_segment"):
+                self.applied_seq = self.segment_log.append(self._unpersisted_nodes)
+            self._mark_persisted()
+            if self.segment_log.needs_compaction():
+                self.compact()
+
+    def compact(self):
+        """把索引完整寫成新的世代，再切換 manifest 並合併所有分段"""
+        self.require_writable()
+        with self._write_lock:
+            if self.index is None:
+                return
+            start = time.time()
+            generation = self.generation + 1
+            persist_dir = self.segment_log.generation_dir(generation)
+            # 上次壓縮中途當機時可能留下未切換的同名目錄
+            shutil.rmtree(persist_dir, ignore_errors=True)
+            os.makedirs(persist_dir)
+            self.index.storage_context.persist(persist_dir=persist_dir)
+            if self.bm25_index is not None:
+                self.bm25_index.save(persist_dir)
+            self.applied_seq = self.segment_log.mark_compacted(generation)
+            self.generation = generation
+            self._mark_persisted()
+            METRICS.observe("compact", time.time() - start)
+
+    def _mark_persisted(self):
+        # 寫出之後才記錄為已索引，當機時未寫出的內容下次會重新匯入
+        if self.chunk_registry is not None and self._unpersisted_hashes:
+            self.chunk_registry.mark_indexed(list(self._unpersisted_hashes))
+        self._unpersisted_nodes = []
+        self._unpersisted_hashes = set()
     
-    def add_pdf(self, pdf_path: str):
-        """添加 PDF 文件"""
-        documents = self.doc_processor.process_pdf(pdf_path)
-        self.add_documents(documents)
+    def add_pdf(self, pdf_path: str, batch_pages: int = 32, workers: int = 1):
+        """添加 PDF 文件，以固定頁數的批次串流寫入索引"""
+        self.require("embedder", "index")
+        self.require_writable()
+        with METRICS.stage("add_pdf"):
+            batch = []
+            for document in self.doc_processor.iter_pdf(pdf_path, workers=workers):
+                batch.append(document)
+                if len(batch) >= batch_pages:
+                    self.add_documents(batch, persist=False)
+                    batch = []
+            self.add_documents(batch)
         
     def add_video(self, video_path: str, transcript_path: str):
         """添加影片及其字幕"""
-        documents = self.doc_processor.process_video_transcript(
-            transcript_path,
-            video_path
-        )
-        self.add_documents(documents)
+        self.require("embedder", "index")
+        self.require_writable()
+        with METRICS.stage("add_video"):
+            documents = self.doc_processor.process_video_transcript(
+                transcript_path,
+                video_path
+            )
+            self.add_documents(documents)
     
-    def query(
+    def _invalidate_query_engines(self):
+        """索引變動後清空查詢引擎與檢索器快取"""
+        with self._engine_lock:
+            self._query_engines.clear()
+            self._retrievers.clear()
+
+    def _get_retriever(self, top_k: int) -> VectorIndexRetriever:
+        with self._engine_lock:
+            retriever = self._retrievers.get(top_k)
+            if retriever is None:
+                retriever = VectorIndexRetriever(
+                    index=self.index,
+                    similarity_top_k=top_k
+                )
+                self._retrievers[top_k] = retriever
+        return retriever
+
+    def _get_query_engine(
+        self,
+        top_k: int,
+        response_mode: str,
+        streaming: bool = False
+    ) -> RetrieverQueryEngine:
+        """取得快取的查詢引擎，沒有時才建立檢索器與查詢引擎"""
+        key = (top_k, response_mode, streaming)
+        with self._engine_lock:
+            query_engine = self._query_engines.get(key)
+            if query_engine is None:
+                query_engine = RetrieverQueryEngine.from_args(
+                    retriever=self._get_retriever(top_k),
+                    text_qa_template=self.qa_template,
+                    response_mode=response_mode,
+                    streaming=streaming
+                )
+                self._query_engines[key] = query_engine
+        return query_engine
+
+    @staticmethod
+    def _format_sources(nodes) -> List[Dict[str, Any]]:
+        """score 為向量餘弦相似度；混合檢索另附 fused_score（RRF），重新排序另附 rerank_score"""
+        sources = []
+        for node in nodes:
+            source = {
+                "text": node.text,
+                "score": node.score if hasattr(node, 'score') else None,
+                "metadata": node.metadata
+            }
+            for name in ("fused_score", "rerank_score"):
+                value = getattr(node, name, None)
+                if value is not None:
+                    source[name] = value
+            sources.append(source)
+        return sources
+
+    def _build_compact_prompt(self, query_text: str, nodes) -> str:
+        """把檢索到的片段依分數順序整段放進 context_window，組成單一提示
+
+        放不下的片段直接略過（較短的後續片段仍可能放得下），
+        只有連第一個片段都放不下時才截斷它。
+        """
+        tokenizer = self.llm_tokenizer
+        empty_prompt = self.qa_template.format(context_str="", query_str=query_text)
+        budget = (
+            self.llm.context_window
+            - self.llm.max_new_tokens
+            - len(tokenizer.encode(empty_prompt))
+        )
+        separator = "\n\n"
+        separator_tokens = len(tokenizer.encode(separator, add_special_tokens=False))
+
+        chunks = []
+        used = 0
+        for node in nodes:
+            text = node.get_content(metadata_mode=MetadataMode.LLM)
+            token_ids = tokenizer.encode(text, add_special_tokens=False)
+            cost = len(token_ids) + (separator_tokens if chunks else 0)
+            if used + cost <= budget:
+                chunks.append(text)
+                used += cost
+            elif not chunks and budget > 0:
+                chunks.append(tokenizer.decode(token_ids[:budget], skip_special_tokens=True))
+                used = budget
+        return self.qa_template.format(context_str=separator.join(chunks), query_str=query_text)
+
+    def _retrieve_nodes(self, query_bundle: QueryBundle, top_k: int, filters=None, dense=None):
+        """檢索 top_k 個片段；有 reranker 時先取 rerank_candidates 個候選，再以 cross-encoder 排序
+
+        dense 為批次查詢預先算好的向量檢索結果（至少 _dense_pool_size(top_k) 個），有值時不再查向量庫。
+        """
+        with METRICS.stage("retrieve"):
+            if self.reranker is None:
+                return self._retrieve_candidates(query_bundle, top_k, filters, dense)
+            candidates = self._retrieve_candidates(query_bundle, max(top_k, self.rerank_candidates), filters, dense)
+            with METRICS.stage("rerank"):
+                return self.reranker.rerank(query_bundle.query_str, candidates, top_k)
+
+    def _dense_pool_size(self, top_k: int) -> int:
+        """_retrieve_nodes 需要的向量檢索結果數"""
+        k = max(top_k, self.rerank_candidates) if self.reranker is not None else top_k
+        return max(k, self.hybrid_candidates) if self.bm25_index is not None else k
+
+    def _retrieve_candidates(self, query_bundle: QueryBundle, top_k: int, filters=None, dense=None):
+        """向量檢索；啟用混合檢索時同時查 BM25，在時間預算內完成才以 RRF 融合"""
+        if self.bm25_index is None:
+            if dense is not None:
+                return dense[:top_k]
+            return self._dense_retrieve(query_bundle, top_k, filters)
+
+        # BM25 超過同一個期限也會自行放棄，逾時的工作不會在背景繼續佔住索引
+        deadline = time.monotonic() + self.hybrid_budget_ms / 1000
+        pool_size = max(top_k, self.hybrid_candidates)
+        # 複製 context，BM25 執行緒的耗時也記入這個請求的 timings
+        sparse_future = self._sparse_executor.submit(
+            contextvars.copy_context().run,
+            self._sparse_retrieve,
+            query_bundle.query_str,
+            pool_size,
+            filters,
+            deadline
+        )
+        if dense is not None:
+            dense = dense[:pool_size]
+        else:
+            dense = self._dense_retrieve(query_bundle, pool_size, filters)
+        try:
+            sparse = sparse_future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            sparse = None
+        if sparse is None:
+            self.hybrid_timeouts += 1
+            METRICS.inc("hybrid_timeouts")
+            return dense[:top_k]
+        return self._fuse(query_bundle, dense, sparse, top_k)
+
+    def _sparse_retrieve(self, query_text: str, k: int, filters=None, deadline: float = None):
+        """BM25 檢索；超過 deadline 而放棄時回傳 None 並計入 hybrid_dropped"""
+        with METRICS.stage("retrieve_sparse"):
+            if filters is None:
+                results = self.bm25_index.search(query_text, k, deadline=deadline)
+            else:
+                results = self._sparse_retrieve_filtered(query_text, k, filters, deadline)
+        if results is None:
+            METRICS.inc("hybrid_dropped")
+        return results
+
+    def _sparse_retrieve_filtered(self, query_text: str, k: int, filters, deadline: float = None):
+        vector_store = self.index.vector_store
+        if isinstance(vector_store, NumpyVectorStore):
+            # 以 metadata 倒排索引一次算出符合條件的節點，不必逐一讀取節點
+            allowed = vector_store.node_ids_matching(filters)
+            if allowed is not None:
+                return self.bm25_index.search(query_text, k, allowed=allowed, deadline=deadline)
+        return self._sparse_retrieve_scan(query_text, k, filters, deadline)
+
+    def _sparse_retrieve_scan(self, query_text: str, k: int, filters, deadline: float = None):
+        """沒有 metadata 索引時（simple 後端）：分批取出排名候選，整批從文件庫讀出再檢查條件"""
+        want = k * 4
+        while True:
+            hits = self.bm25_index.search(query_text, want, deadline=deadline)
+            if hits is None:
+                return None
+            nodes = self.index.docstore.get_nodes([node_id for node_id, _ in hits], raise_error=False)
+            results = [
+                hit for hit, node in zip(hits, nodes)
+                if node is not None and metadata_matches(node.metadata, filters)
+            ]
+            if len(results) >= k or len(hits) < want:
+                return results[:k]
+            want *= 4
+
+    def _fuse(self, query_bundle: QueryBundle, dense, sparse, top_k: int):
+        """reciprocal rank fusion
+
+        依 RRF 分數排序，分數放在 fused_score；score 仍是向量餘弦相似度，
+        只由 BM25 找到的節點另外計算（simple 後端時為 None），問答快取才能以相似度判斷失效。
+        """
+        fused: Dict[str, float] = {}
+        cosine: Dict[str, Optional[float]] = {}
+        nodes = {}
+        for rank, node_with_score in enumerate(dense):
+            node_id = node_with_score.node.node_id
+            fused[node_id] = 1 / (self.rrf_k + rank + 1)
+            cosine[node_id] = node_with_score.score
+            nodes[node_id] = node_with_score.node
+        for rank, (node_id, _) in enumerate(sparse):
+            fused[node_id] = fused.get(node_id, 0.0) + 1 / (self.rrf_k + rank + 1)
+
+        ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+        missing = [node_id for node_id in ranked if node_id not in nodes]
+        if missing:
+            for node in self.index.docstore.get_nodes(missing, raise_error=False):
+                if node is not None:
+                    nodes[node.node_id] = node
+            vector_store = self.index.vector_store
+            if isinstance(vector_store, NumpyVectorStore) and query_bundle.embedding is not None:
+                cosine.update(zip(missing, vector_store.score_node_ids(missing, query_bundle.embedding)))
+        return [
+            RankedNode(node=nodes[node_id], score=cosine.get(node_id), fused_score=fused[node_id])
+            for node_id in ranked if node_id in nodes
+        ]
+
+    def _dense_retrieve(self, query_bundle: QueryBundle, top_k: int, filters=None):
+        """有過濾條件時每次建立帶條件的檢索器，否則使用快取的檢索器"""
+        with METRICS.stage("retrieve_dense"):
+            if filters is None:
+                return self._get_retriever(top_k).retrieve(query_bundle)
+            retriever = VectorIndexRetriever(
+                index=self.index,
+                similarity_top_k=top_k,
+                filters=filters
+            )
+            return retriever.retrieve(query_bundle)
+
+    def _dense_retrieve_batch(self, query_bundles: List[QueryBundle], top_k: int, filters=None):
+        """多個查詢的向量檢索：numpy 後端一次矩陣相乘計分，所有命中的節點以一次查詢從文件庫取回"""
+        vector_store = self.index.vector_store
+        if not isinstance(vector_store, NumpyVectorStore):
+            return [self._dense_retrieve(bundle, top_k, filters) for bundle in query_bundles]
+
+        with METRICS.stage("retrieve_dense_batch"):
+            results = vector_store.query_batch(
+                np.asarray([bundle.embedding for bundle in query_bundles]),
+                top_k,
+                filters
+            )
+            nodes_dict = self.index.index_struct.nodes_dict
+            node_ids = list(dict.fromkeys(
+                nodes_dict[vector_id] for result in results for vector_id in result.ids
+            ))
+            nodes = {
+                node.node_id: node
+                for node in self.index.docstore.get_nodes(node_ids, raise_error=False)
+                if node is not None
+            }
+            return [
+                [
+                    NodeWithScore(node=nodes[nodes_dict[vector_id]], score=score)
+                    for vector_id, score in zip(result.ids, result.similarities)
+                    if nodes_dict[vector_id] in nodes
+                ]
+                for result in results
+            ]
+
+    def retrieve(
         self,
         query_text: str,
         top_k: int = 3,
-        response_mode: str = "tree_summarize"
+        filters: Optional[Dict[str, Any]] = None,
+        include_timings: bool = False
     ) -> Dict[str, Any]:
-        """查詢系統"""
+        """只做檢索，不呼叫 LLM，回傳依分數排序的片段與 metadata（頁碼、影片時間）"""
+        self.require("embedder", "index")
         if not self.index:
             raise ValueError("索引尚未建立，請先添加文件")
-            
+
         start = time.time()
-        retriever = VectorIndexRetriever(
-            index=self.index,
-            similarity_top_k=top_k
+        with request_trace() as timings:
+            nodes = self._retrieve_nodes(
+                QueryBundle(query_str=query_text),
+                top_k,
+                build_metadata_filters(filters)
+            )
+        retrieval_ms = (time.time() - start) * 1000
+        logger.debug("檢索時間: %.3f秒", retrieval_ms / 1000)
+        result = {
+            "sources": self._format_sources(nodes),
+            "retrieval_ms": retrieval_ms
+        }
+        if include_timings:
+            result["timings_ms"] = timings
+        return result
+
+    def _lookup_answer(self, query_text: str, top_k: int, response_mode: str, scope: str = ""):
+        """查問答快取；查詢向量同時交給檢索器，不會重複嵌入"""
+        if self.answer_cache is None:
+            return None, None
+        with METRICS.stage("query_embed"):
+            query_embedding = Settings.embed_model.get_query_embedding(query_text)
+        cached = self.answer_cache.lookup(
+            query_text,
+            query_embedding,
+            top_k,
+            response_mode,
+            scope
         )
-        print(f"設定檢索器時間: {time.time() - start:.2f}秒")
-        
-        t1 = time.time()
-        query_engine = RetrieverQueryEngine.from_args(
-            retriever=retriever,
-            text_qa_template=self.qa_template,
-            response_mode=response_mode
+        return query_embedding, cached
+
+    def _store_answer(self, query_text, query_embedding, top_k, response_mode, result, scope: str = ""):
+        if self.answer_cache is not None:
+            self.answer_cache.store(
+                query_text,
+                query_embedding,
+                top_k,
+                response_mode,
+                result,
+                scope
+            )
+
+    @staticmethod
+    def _filters_scope(filters) -> str:
+        """過濾條件不同的查詢在問答快取中分開存放"""
+        return "" if filters is None else filters.model_dump_json()
+
+    def query(
+        self,
+        query_text: str,
+        top_k: int = 3,
+        response_mode: str = COMPACT_MODE,
+        filters: Optional[Dict[str, Any]] = None,
+        include_timings: bool = False
+    ) -> Dict[str, Any]:
+        """查詢系統
+
+        response_mode 預設為 compact：片段塞進單一提示，只呼叫一次 LLM；
+        其他值（如 tree_summarize、refine）交給 llama_index 的回應合成器。
+        filters 限制只檢索 metadata 符合條件的片段，格式見 build_metadata_filters。
+        include_timings 時在結果中附上本次查詢各階段的耗時（timings_ms）。
+        """
+        self.require(*COMPONENTS)
+        if not self.index:
+            raise ValueError("索引尚未建立，請先添加文件")
+
+        with request_trace() as timings:
+            with METRICS.stage("query"):
+                result = self._answer(query_text, top_k, response_mode, build_metadata_filters(filters))
+        if include_timings:
+            # 快取中的結果是共用的，不直接修改
+            result = {**result, "timings_ms": timings}
+        return result
+
+    def _answer(self, query_text: str, top_k: int, response_mode: str, filters) -> Dict[str, Any]:
+        scope = self._filters_scope(filters)
+        query_embedding, cached = self._lookup_answer(query_text, top_k, response_mode, scope)
+        if cached is not None:
+            return cached
+
+        t2 = time.time()
+        query_bundle = QueryBundle(query_str=query_text, embedding=query_embedding)
+        nodes = self._retrieve_nodes(query_bundle, top_k, filters)
+        if response_mode == COMPACT_MODE:
+            with METRICS.stage("prompt_build"):
+                prompt = self._build_compact_prompt(query_text, nodes)
+            with METRICS.stage("generate"):
+                response_text = self.llm.complete(prompt).text
+            self._count_tokens(prompt, response_text)
+        else:
+            query_engine = self._get_query_engine(top_k, response_mode)
+            with METRICS.stage("generate"):
+                response_text = str(query_engine.synthesize(query_bundle, nodes))
+        logger.debug("生成回答時間: %.2f秒", time.time() - t2)
+
+        result = {
+            "response": response_text,
+            "sources": self._format_sources(nodes)
+        }
+        self._store_answer(query_text, query_embedding, top_k, response_mode, result, scope)
+        return result
+
+    def _count_tokens(self, prompt: str, response_text: str):
+        """累計 compact 模式的提示與生成 token 數；其他模式的多次呼叫由 llama_index 處理，不計入"""
+        METRICS.inc("llm_prompt_tokens", len(self.llm_tokenizer.encode(prompt)))
+        METRICS.inc("llm_completion_tokens", len(self.llm_tokenizer.encode(response_text, add_special_tokens=False)))
+
+    def stream_query(
+        self,
+        query_text: str,
+        top_k: int = 3,
+        response_mode: str = COMPACT_MODE,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """串流查詢：先回傳檢索來源，再逐段回傳生成的文字
+
+        依序產生 {"event": "sources"}、多個 {"event": "token"}，
+        最後是含完整回答與首字延遲（ttft_ms）的 {"event": "done"}。
+        """
+        self.require(*COMPONENTS)
+        if not self.index:
+            raise ValueError("索引尚未建立，請先添加文件")
+
+        start = time.time()
+        filters = build_metadata_filters(filters)
+        scope = self._filters_scope(filters)
+        query_embedding, cached = self._lookup_answer(query_text, top_k, response_mode, scope)
+        if cached is not None:
+            yield {"event": "sources", "sources": cached["sources"]}
+            yield {"event": "token", "text": cached["response"]}
+            elapsed_ms = (time.time() - start) * 1000
+            METRICS.observe("stream_query", elapsed_ms / 1000)
+            yield {
+                "event": "done",
+                "response": cached["response"],
+                "ttft_ms": elapsed_ms,
+                "total_ms": elapsed_ms,
+                "cached": True
+            }
+            return
+
+        query_bundle = QueryBundle(query_str=query_text, embedding=query_embedding)
+        nodes = self._retrieve_nodes(query_bundle, top_k, filters)
+        sources = self._format_sources(nodes)
+        yield {
+            "event": "sources",
+            "sources": sources,
+            "retrieval_ms": (time.time() - start) * 1000
+        }
+
+        prompt = None
+        if response_mode == COMPACT_MODE:
+            with METRICS.stage("prompt_build"):
+                prompt = self._build_compact_prompt(query_text, nodes)
+            deltas = (r.delta for r in self.llm.stream_complete(prompt))
+        else:
+            query_engine = self._get_query_engine(top_k, response_mode, streaming=True)
+            deltas = query_engine.synthesize(query_bundle, nodes).response_gen
+
+        text = ""
+        ttft_ms = None
+        for delta in deltas:
+            if not delta:
+                continue
+            if ttft_ms is None:
+                ttft_ms = (time.time() - start) * 1000
+            text += delta
+            yield {"event": "token", "text": delta}
+
+        total_ms = (time.time() - start) * 1000
+        METRICS.observe("stream_ttft", (ttft_ms or total_ms) / 1000)
+        METRICS.observe("stream_query", total_ms / 1000)
+        if prompt is not None:
+            self._count_tokens(prompt, text)
+        logger.debug("首字延遲: %.2f秒, 生成回答時間: %.2f秒", (ttft_ms or total_ms) / 1000, total_ms / 1000)
+
+        self._store_answer(
+            query_text,
+            query_embedding,
+            top_k,
+            response_mode,
+            {"response": text, "sources": sources},
+            scope
         )
-        print(f"建立查詢引擎時間: {time.time() - t1:.2f}秒")
-        
+        yield {
+            "event": "done",
+            "response": text,
+            "ttft_ms": ttft_ms,
+            "total_ms": total_ms,
+            "cached": False
+        }
+
+    def query_batch(
+        self,
+        queries: List[str],
+        top_k: int = 3,
+        response_mode: str = COMPACT_MODE,
+        filters: Optional[Dict[str, Any]] = None,
+        batch_generation: bool = True
+    ) -> Iterator[Dict[str, Any]]:
+        """批次查詢，供評測等一次送出大量問題的離線工作使用
+
+        相同的問題只處理一次；所有問題以一次批次前向運算嵌入，向量檢索以矩陣對矩陣乘法一起計分。
+        每完成一個問題就產生 {"event": "result", "index": ...}（index 為在 queries 中的位置，
+        重複的問題各自一筆），完成順序不保證與輸入相同；生成失敗的問題產生 {"event": "error"}，
+        最後是 {"event": "done"}。
+        batch_generation 時 compact 模式的提示一次全部送進 LLM 的批次佇列（BatchedHuggingFaceLLM），
+        每批湊滿 llm_batch_size 個；否則逐一生成。
+        """
+        self.require(*COMPONENTS)
+        if not self.index:
+            raise ValueError("索引尚未建立，請先添加文件")
+
+        start = time.time()
+        filters = build_metadata_filters(filters)
+        scope = self._filters_scope(filters)
+        positions: Dict[str, List[int]] = {}
+        for index, query_text in enumerate(queries):
+            positions.setdefault(query_text, []).append(index)
+        unique = list(positions)
+        METRICS.inc("batch_queries", len(queries))
+        METRICS.inc("batch_duplicate_queries", len(queries) - len(unique))
+
+        def events(query_text: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+            for index in positions[query_text]:
+                yield {"index": index, "query": query_text, **payload}
+
+        n_cached = 0
+        bundles = []
+        for query_text, embedding in zip(unique, self.embedding_pipeline.embed_queries(unique)):
+            cached = None
+            if self.answer_cache is not None:
+                cached = self.answer_cache.lookup(query_text, embedding, top_k, response_mode, scope)
+            if cached is not None:
+                n_cached += 1
+                yield from events(query_text, {"event": "result", **cached, "cached": True})
+            else:
+                bundles.append(QueryBundle(query_str=query_text, embedding=embedding))
+
         t2 = time.time()
-        response = query_engine.query(query_text)
-        print(f"生成回答時間: {time.time() - t2:.2f}秒")
-        
-        sources = [{
-            "text": node.text,
-            "score": node.score if hasattr(node, 'score') else None,
-            "metadata": node.metadata
-        } for node in response.source_nodes]
-        
-        return {
-            "response": str(response),
-            "sources": sources
-        }
\ No newline at end of file
+        dense = self._dense_retrieve_batch(bundles, self._dense_pool_size(top_k), filters) if bundles else []
+        nodes_list = [
+            self._retrieve_nodes(bundle, top_k, filters, candidates)
+            for bundle, candidates in zip(bundles, dense)
+        ]
+        logger.debug("批次檢索 %d 個問題: %.2f秒", len(bundles), time.time() - t2)
+
+        n_errors = 0
+        for i, prompt, response_text, error in self._generate_batch(
+            bundles, nodes_list, top_k, response_mode, batch_generation
+        ):
+            query_text = bundles[i].query_str
+            if error is not None:
+                n_errors += 1
+                yield from events(query_text, {"event": "error", "detail": str(error)})
+                continue
+            if prompt is not None:
+                self._count_tokens(prompt, response_text)
+            result = {
+                "response": response_text,
+                "sources": self._format_sources(nodes_list[i])
+            }
+            self._store_answer(query_text, bundles[i].embedding, top_k, response_mode, result, scope)
+            yield from events(query_text, {"event": "result", **result, "cached": False})
+
+        total = time.time() - start
+        METRICS.observe("query_batch", total)
+        logger.debug("批次查詢 %d 個問題（%d 個不重複，%d 個命中快取）: %.2f秒", len(queries), len(unique), n_cached, total)
+        yield {
+            "event": "done",
+            "queries": len(queries),
+            "unique": len(unique),
+            "cached": n_cached,
+            "errors": n_errors,
+            "total_ms": total * 1000
+        }
+
+    def _generate_batch(
+        self,
+        bundles: List[QueryBundle],
+        nodes_list,
+        top_k: int,
+        response_mode: str,
+        batch_generation: bool
+    ) -> Iterator[Tuple[int, Optional[str], Optional[str], Optional[Exception]]]:
+        """依完成順序產生 (位置, compact 提示, 回答, 例外)"""
+        if response_mode != COMPACT_MODE:
+            query_engine = self._get_query_engine(top_k, response_mode)
+            for i, (bundle, nodes) in enumerate(zip(bundles, nodes_list)):
+                try:
+                    yield i, None, str(query_engine.synthesize(bundle, nodes)), None
+                except Exception as e:
+                    yield i, None, None, e
+            return
+
+        with METRICS.stage("prompt_build_batch"):
+            prompts = [
+                self._build_compact_prompt(bundle.query_str, nodes)
+                for bundle, nodes in zip(bundles, nodes_list)
+            ]
+        if batch_generation and isinstance(self.llm, (BatchedHuggingFaceLLM, RemoteLLM)):
+            futures = {self.llm.submit(prompt): i for i, prompt in enumerate(prompts)}
+            for future in as_completed(futures):
+                i = futures[future]
+                error = future.exception()
+                yield i, prompts[i], None if error else future.result(), error
+            return
+
+        for i, prompt in enumerate(prompts):
+            try:
+                with METRICS.stage("generate"):
+                    response_text = self.llm.complete(prompt).text
+            except Exception as e:
+                yield i, prompt, None, e
+                continue
+            yield i, prompt, response_text, None
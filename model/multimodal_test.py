@@ -158,7 +158,7 @@ def test_query():
             for source in result["sources"]:
                 metadata = source["metadata"]
                 if metadata["source_type"] == "pdf":
-                    print(f"- [PDF] {metadata['file_name']} (第 {metadata['page']} 頁)")
+                    print(f"- [PDF] {metadata['file_name']} (第 {metadata.get('page_number', metadata.get('page'))} 頁)")
                 elif metadata["source_type"] == "video":
                     print(f"- [Video] {metadata['file_name']} (時間: {metadata.get('start_time', '')} - {metadata.get('end_time', '')})")
                 print(f"  內容: {source['text']}\n")
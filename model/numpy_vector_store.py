@@ -0,0 +1,535 @@
+from typing import List, Any, Dict, Optional, Sequence, Set, Tuple
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from ann_index import IVFFlatIndex
+from metadata_index import MetadataIndex
+import numpy as np
+import os
+import threading
+
+VECTORS_FNAME = "vectors.npy"
+NODE_IDS_FNAME = "vector_node_ids.npy"
+REF_DOC_IDS_FNAME = "vector_ref_doc_ids.npy"
+
+# float16 矩陣分塊轉成 float32 再相乘，避免一次複製整個矩陣
+_SCORE_BLOCK_ROWS = 65536
+# 批次查詢時每塊分數矩陣（列數 × 查詢數）的元素上限，約 64MB
+_BATCH_SCORE_ELEMENTS = 1 << 24
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _save_npy_atomic(path: str, array: np.ndarray):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    # 已經 mmap 舊檔的行程仍持有舊的 inode，不受替換影響
+    os.replace(tmp_path, path)
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """以 argpartition 取出分數最高的 k 列，並依分數排序"""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        rows = np.argpartition(-scores, k - 1)[:k]
+    else:
+        rows = np.arange(scores.shape[0])
+    return rows[np.argsort(-scores[rows], kind="stable")]
+
+
+class NumpyVectorStore(BasePydanticVectorStore):
+    """以 mmap NumPy 矩陣保存向量的向量庫
+
+    已寫出的向量放在 vectors.npy，以唯讀 mmap 開啟，多個行程共用同一份
+    分頁快取；之後新增的向量放在記憶體中的尾端緩衝區，直到下次寫出。
+    節點 id 與 ref_doc_id 以側邊陣列保存，列號對應矩陣的列。
+    """
+
+    stores_text: bool = False
+    dtype: str = "float32"
+
+    _base: Optional[np.ndarray] = PrivateAttr(default=None)
+    _base_node_ids: Optional[np.ndarray] = PrivateAttr(default=None)
+    _base_ref_doc_ids: Optional[np.ndarray] = PrivateAttr(default=None)
+    _tail: Optional[np.ndarray] = PrivateAttr(default=None)
+    _tail_size: int = PrivateAttr(default=0)
+    _tail_node_ids: List[str] = PrivateAttr(default_factory=list)
+    _tail_ref_doc_ids: List[str] = PrivateAttr(default_factory=list)
+    _deleted: set = PrivateAttr(default_factory=set)
+    _lock: Any = PrivateAttr(default=None)
+    _ann: Optional[IVFFlatIndex] = PrivateAttr(default=None)
+    _metadata: Optional[MetadataIndex] = PrivateAttr(default=None)
+    # 節點 id -> 列號，第一次以 id 查分數時才建立
+    _row_of: Optional[Dict[str, int]] = PrivateAttr(default=None)
+
+    def __init__(
+        self,
+        dtype: str = "float32",
+        ann: Optional[IVFFlatIndex] = None,
+        **kwargs: Any
+    ):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported dtype: {dtype}")
+        super().__init__(dtype=dtype, **kwargs)
+        self._lock = threading.Lock()
+        self._ann = ann
+        self._metadata = MetadataIndex()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "NumpyVectorStore"
+
+    @classmethod
+    def from_persist_dir(
+        cls,
+        persist_dir: str,
+        dtype: str = "float32",
+        ann: Optional[IVFFlatIndex] = None
+    ) -> "NumpyVectorStore":
+        """以 mmap 開啟已寫出的向量，幾乎不花啟動時間"""
+        store = cls(dtype=dtype, ann=ann)
+        vectors_path = os.path.join(persist_dir, VECTORS_FNAME)
+        if os.path.exists(vectors_path):
+            store._load_base(persist_dir)
+            if ann is not None and not ann.load(persist_dir, store.base_size):
+                store._maintain_ann()
+            # 沒有 metadata 索引的舊資料由呼叫端以 rebuild_metadata 重建
+            store._metadata.load(persist_dir, store.base_size)
+        return store
+
+    @classmethod
+    def from_simple_vector_store(
+        cls,
+        simple_store,
+        dtype: str = "float32",
+        ann: Optional[IVFFlatIndex] = None
+    ) -> "NumpyVectorStore":
+        """從舊的 SimpleVectorStore 轉換"""
+        store = cls(dtype=dtype, ann=ann)
+        data = simple_store.data
+        node_ids = list(data.embedding_dict.keys())
+        if node_ids:
+            store.add_embeddings(
+                np.asarray([data.embedding_dict[i] for i in node_ids], dtype=np.float32),
+                node_ids,
+                [data.text_id_to_ref_doc_id.get(i, "None") for i in node_ids]
+            )
+            # SimpleVectorStore 沒有節點的 metadata，留待依 docstore 重建，
+            # 不能讓空白的列被當成已同步的索引
+            store._metadata.reset()
+        return store
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.exists(os.path.join(persist_dir, VECTORS_FNAME))
+
+    def _load_base(self, persist_dir: str):
+        self._base = np.load(os.path.join(persist_dir, VECTORS_FNAME), mmap_mode="r")
+        self._base_node_ids = np.load(os.path.join(persist_dir, NODE_IDS_FNAME), mmap_mode="r")
+        self._base_ref_doc_ids = np.load(os.path.join(persist_dir, REF_DOC_IDS_FNAME), mmap_mode="r")
+        self._row_of = None
+
+    @property
+    def client(self) -> None:
+        return None
+
+    @property
+    def ann(self) -> Optional[IVFFlatIndex]:
+        return self._ann
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        return self._metadata
+
+    @property
+    def needs_metadata_rebuild(self) -> bool:
+        return self._metadata.n_rows != self.n_rows
+
+    def rebuild_metadata(self, metadatas: List[Dict[str, Any]]):
+        """依列號順序重建 metadata 索引（舊版索引或從 SimpleVectorStore 轉換時）"""
+        with self._lock:
+            if len(metadatas) != self.n_rows:
+                raise ValueError("metadata count does not match the number of rows")
+            self._metadata.reset()
+            self._metadata.add(metadatas, 0)
+
+    @property
+    def dim(self) -> Optional[int]:
+        if self._base is not None:
+            return self._base.shape[1]
+        if self._tail is not None:
+            return self._tail.shape[1]
+        return None
+
+    @property
+    def base_size(self) -> int:
+        return 0 if self._base is None else self._base.shape[0]
+
+    @property
+    def n_rows(self) -> int:
+        """列數，包含已標記刪除但尚未寫出的列"""
+        return self.base_size + self._tail_size
+
+    @property
+    def count(self) -> int:
+        """存活的向量數（不能用 __len__，StorageContext 會以真假值判斷向量庫）"""
+        return self.base_size + self._tail_size - len(self._deleted)
+
+    def node_id_at(self, row: int) -> str:
+        if row < self.base_size:
+            return str(self._base_node_ids[row])
+        return self._tail_node_ids[row - self.base_size]
+
+    def add_embeddings(
+        self,
+        embeddings: np.ndarray,
+        node_ids: List[str],
+        ref_doc_ids: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ):
+        """直接以矩陣新增向量（不經過節點物件）"""
+        embeddings = _normalize(embeddings.astype(np.float32)).astype(self.dtype)
+        with self._lock:
+            start_row = self.base_size + self._tail_size
+            n_new = embeddings.shape[0]
+            if self._tail is None:
+                self._tail = np.empty((max(n_new, 1024), embeddings.shape[1]), dtype=self.dtype)
+            elif self._tail_size + n_new > self._tail.shape[0]:
+                # 容量倍增，攤銷後每次新增為 O(批次大小)
+                capacity = max(self._tail.shape[0] * 2, self._tail_size + n_new)
+                grown = np.empty((capacity, self._tail.shape[1]), dtype=self.dtype)
+                grown[:self._tail_size] = self._tail[:self._tail_size]
+                self._tail = grown
+            self._tail[self._tail_size:self._tail_size + n_new] = embeddings
+            self._tail_node_ids.extend(node_ids)
+            if self._row_of is not None:
+                self._row_of.update(zip(node_ids, range(start_row, start_row + n_new)))
+            self._tail_ref_doc_ids.extend(ref_doc_ids)
+            self._tail_size += n_new
+            # 等待重建的 metadata 索引不追加，重建時會一併補上
+            if self._metadata.n_rows == start_row:
+                self._metadata.add(metadatas or [{}] * n_new, start_row)
+
+            if self._ann is not None:
+                if self._ann.is_trained:
+                    self._ann.add(embeddings, start_row)
+                elif self._ann.needs_retrain(start_row + n_new):
+                    self._ann.train(self._all_rows())
+
+    def _all_rows(self) -> np.ndarray:
+        parts = []
+        if self._base is not None:
+            parts.append(np.asarray(self._base))
+        if self._tail is not None and self._tail_size:
+            parts.append(self._tail[:self._tail_size])
+        return np.concatenate(parts)
+
+    def _maintain_ann(self):
+        """資料量成長太多時重新訓練 IVF 質心"""
+        n_rows = self.base_size + self._tail_size
+        if self._ann is not None and n_rows and self._ann.needs_retrain(n_rows):
+            self._ann.train(self._all_rows())
+
+    def add(self, nodes: Sequence[BaseNode], **add_kwargs: Any) -> List[str]:
+        """新增節點向量"""
+        if not nodes:
+            return []
+        embeddings = np.asarray([node.get_embedding() for node in nodes], dtype=np.float32)
+        node_ids = [node.node_id for node in nodes]
+        self.add_embeddings(
+            embeddings,
+            node_ids,
+            [node.ref_doc_id or "None" for node in nodes],
+            [node.metadata for node in nodes]
+        )
+        return node_ids
+
+    def _rows_for_ref_doc(self, ref_doc_id: str) -> List[int]:
+        rows = []
+        if self._base is not None:
+            rows.extend(np.nonzero(self._base_ref_doc_ids == ref_doc_id)[0].tolist())
+        rows.extend(
+            self.base_size + i
+            for i, ref in enumerate(self._tail_ref_doc_ids)
+            if ref == ref_doc_id
+        )
+        return rows
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """刪除某個來源文件的所有向量（標記刪除，寫出時才真正移除）"""
+        with self._lock:
+            self._deleted.update(self._rows_for_ref_doc(ref_doc_id))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._base = None
+            self._base_node_ids = None
+            self._base_ref_doc_ids = None
+            self._tail = None
+            self._tail_size = 0
+            self._tail_node_ids = []
+            self._tail_ref_doc_ids = []
+            self._deleted = set()
+            self._row_of = None
+            self._metadata.reset()
+            if self._ann is not None:
+                self._ann.reset()
+
+    def node_ids_matching(self, filters) -> Optional[Set[str]]:
+        """符合過濾條件且未刪除的節點 id；metadata 索引需要重建時回傳 None"""
+        if self.needs_metadata_rebuild:
+            return None
+        rows = self._metadata.candidates(filters)
+        with self._lock:
+            if self._deleted:
+                rows = rows[~np.isin(rows, list(self._deleted))]
+            base_size = self.base_size
+            node_ids = set(self._base_node_ids[rows[rows < base_size]].tolist()) if base_size else set()
+            node_ids.update(self._tail_node_ids[row - base_size] for row in rows[rows >= base_size].tolist())
+        return node_ids
+
+    def score_node_ids(self, node_ids: List[str], query_embedding) -> List[Optional[float]]:
+        """指定節點的餘弦相似度；不在向量庫或已刪除的節點為 None"""
+        with self._lock:
+            if self._row_of is None:
+                base_ids = [] if self._base is None else self._base_node_ids.tolist()
+                self._row_of = {node_id: row for row, node_id in enumerate(base_ids + self._tail_node_ids)}
+            rows = [self._row_of.get(node_id) for node_id in node_ids]
+        found = np.asarray([row for row in rows if row is not None], dtype=np.int64)
+        scores = dict(zip(found.tolist(), self.score_rows(found, query_embedding).tolist())) if found.size else {}
+        return [
+            scores[row] if row is not None and np.isfinite(scores[row]) else None
+            for row in rows
+        ]
+
+    def _snapshot(self) -> Tuple[Optional[np.ndarray], Optional[np.ndarray], int, frozenset]:
+        with self._lock:
+            tail = None if self._tail is None else self._tail[:self._tail_size]
+            return self._base, tail, self.base_size, frozenset(self._deleted)
+
+    @staticmethod
+    def _score_matrix(matrix: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """matrix (n, d) 對 queries (d,) 或 (d, m) 的內積"""
+        if matrix.dtype == np.float32:
+            return matrix @ queries
+        blocks = [
+            matrix[start:start + _SCORE_BLOCK_ROWS].astype(np.float32) @ queries
+            for start in range(0, matrix.shape[0], _SCORE_BLOCK_ROWS)
+        ]
+        return np.concatenate(blocks, axis=0)
+
+    def score_all(self, query_embedding: np.ndarray) -> np.ndarray:
+        """計算查詢向量對所有列的餘弦相似度，已刪除的列為 -inf
+
+        query_embedding 為 (m, d) 的多個查詢時回傳 (n, m)，一次矩陣對矩陣相乘。
+        """
+        base, tail, base_size, deleted = self._snapshot()
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32)).T
+        parts = []
+        if base is not None:
+            parts.append(self._score_matrix(base, query))
+        if tail is not None and tail.shape[0]:
+            parts.append(self._score_matrix(tail, query))
+        if not parts:
+            return np.empty(0, dtype=np.float32)
+        scores = np.concatenate(parts)
+        if deleted:
+            scores[list(deleted)] = -np.inf
+        return scores
+
+    def score_rows(self, rows: np.ndarray, query_embedding: np.ndarray) -> np.ndarray:
+        """只計算指定列的餘弦相似度，已刪除的列為 -inf；多個查詢時回傳 (len(rows), m)"""
+        base, tail, base_size, deleted = self._snapshot()
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32)).T
+        scores = np.empty((rows.shape[0],) + query.shape[1:], dtype=np.float32)
+        in_base = rows < base_size
+        if in_base.any():
+            scores[in_base] = np.asarray(base[rows[in_base]], dtype=np.float32) @ query
+        if (~in_base).any():
+            scores[~in_base] = np.asarray(tail[rows[~in_base] - base_size], dtype=np.float32) @ query
+        if deleted:
+            scores[np.isin(rows, list(deleted))] = -np.inf
+        return scores
+
+    def _result(self, rows: np.ndarray, scores: np.ndarray, k: int) -> VectorStoreQueryResult:
+        top = top_k_rows(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return VectorStoreQueryResult(
+            similarities=scores[top].tolist(),
+            ids=[self.node_id_at(int(row)) for row in rows[top]]
+        )
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        """單次矩陣乘法加上 argpartition 取 top-k；啟用 IVF 時只掃描候選列表
+
+        有 metadata 過濾條件時先由倒排索引取出符合的列，只計算這些列的分數。
+        """
+        if query.query_embedding is None:
+            raise ValueError("NumpyVectorStore requires a query embedding")
+        query_vector = _normalize(np.asarray(query.query_embedding, dtype=np.float32))
+        use_ann = self._ann is not None and self._ann.is_trained
+
+        if query.filters is not None:
+            if self.needs_metadata_rebuild:
+                raise ValueError("metadata index is out of sync; call rebuild_metadata first")
+            rows = self._metadata.candidates(query.filters)
+            if not rows.size:
+                return VectorStoreQueryResult(similarities=[], ids=[])
+            # 條件比 IVF 掃描的列數還寬鬆時，才與 IVF 候選取交集
+            if use_ann and rows.size > self._ann_scan_size(kwargs.get("nprobe")):
+                candidate_rows = np.intersect1d(
+                    self._ann.candidates(query_vector, kwargs.get("nprobe")),
+                    rows,
+                    assume_unique=True
+                )
+                if candidate_rows.size >= query.similarity_top_k:
+                    rows = candidate_rows
+            elif rows.size * 2 > self.n_rows:
+                # 條件很寬鬆時，整塊矩陣相乘比逐列取出還快
+                scores = self.score_all(query_vector)
+                return self._result(rows, scores[rows], query.similarity_top_k)
+            return self._result(rows, self.score_rows(rows, query_vector), query.similarity_top_k)
+
+        if use_ann:
+            rows = np.sort(self._ann.candidates(query_vector, kwargs.get("nprobe")))
+            return self._result(rows, self.score_rows(rows, query_vector), query.similarity_top_k)
+
+        scores = self.score_all(query_vector)
+        return self._result(np.arange(scores.shape[0]), scores, query.similarity_top_k)
+
+    def query_batch(
+        self,
+        query_embeddings: np.ndarray,
+        k: int,
+        filters=None,
+        nprobe: Optional[int] = None
+    ) -> List[VectorStoreQueryResult]:
+        """多個查詢一起計分，依序回傳各自的 top-k
+
+        查詢分塊與整個矩陣（或過濾後的列）做矩陣對矩陣乘法，每塊的分數矩陣不超過
+        _BATCH_SCORE_ELEMENTS 個元素；啟用 IVF 時各查詢的候選列不同，逐一查詢。
+        """
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        if self._ann is not None and self._ann.is_trained:
+            return [
+                self.query(
+                    VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=k, filters=filters),
+                    nprobe=nprobe
+                )
+                for query in queries
+            ]
+
+        if not self.n_rows:
+            return [VectorStoreQueryResult(similarities=[], ids=[]) for _ in queries]
+        rows = None
+        if filters is not None:
+            if self.needs_metadata_rebuild:
+                raise ValueError("metadata index is out of sync; call rebuild_metadata first")
+            rows = self._metadata.candidates(filters)
+            if not rows.size:
+                return [VectorStoreQueryResult(similarities=[], ids=[]) for _ in queries]
+            if rows.size * 2 > self.n_rows:
+                # 與 query 相同：條件很寬鬆時整塊矩陣相乘再取出
+                def score_block(block: np.ndarray) -> np.ndarray:
+                    return self.score_all(block)[rows]
+            else:
+                def score_block(block: np.ndarray) -> np.ndarray:
+                    return self.score_rows(rows, block)
+        else:
+            score_block = self.score_all
+
+        block_size = max(1, _BATCH_SCORE_ELEMENTS // (self.n_rows if rows is None else rows.size))
+        results = []
+        for start in range(0, queries.shape[0], block_size):
+            scores = score_block(queries[start:start + block_size])
+            # 與 query 相同：未過濾時列號取自 score_all 的快照，計分前新增的列也涵蓋在內
+            block_rows = np.arange(scores.shape[0]) if rows is None else rows
+            results.extend(self._results(block_rows, scores, k))
+        return results
+
+    def _results(self, rows: np.ndarray, scores: np.ndarray, k: int) -> List[VectorStoreQueryResult]:
+        """scores (len(rows), m) 各欄的 top-k，一次 argpartition 處理所有查詢"""
+        scores = np.ascontiguousarray(scores.T)
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return [VectorStoreQueryResult(similarities=[], ids=[]) for _ in range(scores.shape[0])]
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        results = []
+        for query_top, query_scores in zip(top, top_scores):
+            alive = np.isfinite(query_scores)
+            results.append(VectorStoreQueryResult(
+                similarities=query_scores[alive].tolist(),
+                ids=[self.node_id_at(int(row)) for row in rows[query_top[alive]]]
+            ))
+        return results
+
+    def _ann_scan_size(self, nprobe: Optional[int]) -> float:
+        """IVF 查詢平均會掃描的列數"""
+        n_lists = self._ann.centroids.shape[0]
+        return self._ann.size * min(nprobe or self._ann.nprobe, n_lists) / n_lists
+
+    def persist(self, persist_path: str, fs: Any = None) -> None:
+        """把存活的向量寫成單一 .npy 並重新以 mmap 開啟"""
+        persist_dir = os.path.dirname(persist_path)
+        os.makedirs(persist_dir, exist_ok=True)
+        with self._lock:
+            base, tail = self._base, self._tail
+            matrices, node_ids, ref_doc_ids = [], [], []
+            if base is not None:
+                matrices.append(np.asarray(base))
+                node_ids.append(np.asarray(self._base_node_ids))
+                ref_doc_ids.append(np.asarray(self._base_ref_doc_ids))
+            if tail is not None and self._tail_size:
+                matrices.append(tail[:self._tail_size])
+                node_ids.append(np.asarray(self._tail_node_ids))
+                ref_doc_ids.append(np.asarray(self._tail_ref_doc_ids))
+            if not matrices:
+                return
+
+            matrix = np.concatenate(matrices)
+            all_node_ids = np.concatenate(node_ids)
+            all_ref_doc_ids = np.concatenate(ref_doc_ids)
+            if self._deleted:
+                alive = np.ones(matrix.shape[0], dtype=bool)
+                alive[list(self._deleted)] = False
+                matrix = matrix[alive]
+                all_node_ids = all_node_ids[alive]
+                all_ref_doc_ids = all_ref_doc_ids[alive]
+                if self._ann is not None:
+                    self._ann.compact(alive)
+                if not self.needs_metadata_rebuild:
+                    self._metadata.compact(alive)
+
+            _save_npy_atomic(os.path.join(persist_dir, NODE_IDS_FNAME), all_node_ids)
+            _save_npy_atomic(os.path.join(persist_dir, REF_DOC_IDS_FNAME), all_ref_doc_ids)
+            _save_npy_atomic(os.path.join(persist_dir, VECTORS_FNAME), matrix)
+
+            self._load_base(persist_dir)
+            self._tail = None
+            self._tail_size = 0
+            self._tail_node_ids = []
+            self._tail_ref_doc_ids = []
+            self._deleted = set()
+
+            self._maintain_ann()
+            if self._ann is not None:
+                self._ann.save(persist_dir)
+            if not self.needs_metadata_rebuild:
+                self._metadata.save(persist_dir)
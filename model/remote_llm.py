@@ -0,0 +1,100 @@
+from typing import Any, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from llama_index.core.base.llms.types import CompletionResponse, CompletionResponseGen, LLMMetadata
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+import httpx
+import json
+import threading
+
+
+class RemoteLLM(CustomLLM):
+    """把生成交給 generation_server 行程，多個查詢工作者共用同一份模型
+
+    查詢工作者只載入分詞器（compact 模式計算提示長度）；各工作者同時送出的提示
+    在生成行程的 GenerationBatcher 中合併成批。context_window 與 max_new_tokens
+    在 wait_until_ready 時取自生成行程。
+    """
+
+    base_url: str
+    context_window: int = 512
+    max_new_tokens: int = 128
+    timeout: float = 300.0
+    max_concurrency: int = 16  # submit() 同時送出的請求數，應不小於生成端的批次大小
+
+    _tokenizer: Any = PrivateAttr(default=None)
+    _client: Any = PrivateAttr(default=None)
+    _pool: Any = PrivateAttr(default=None)
+
+    def __init__(self, base_url: str, tokenizer, client: Optional[httpx.Client] = None, **kwargs: Any):
+        super().__init__(base_url=base_url, **kwargs)
+        self._tokenizer = tokenizer
+        self._client = client or httpx.Client(base_url=base_url, timeout=self.timeout)
+        self._pool = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="remote-llm")
+
+    @property
+    def tokenizer(self):
+        return self._tokenizer
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.max_new_tokens,
+            model_name=self.base_url
+        )
+
+    def wait_until_ready(self, stop: threading.Event = None, interval: float = 1.0):
+        """等待生成行程載入模型；載入失敗或 stop 被設定時拋出 RuntimeError"""
+        while True:
+            try:
+                response = self._client.get("/ready")
+            except httpx.TransportError:
+                # 生成行程可能還在啟動
+                response = None
+            if response is not None:
+                body = response.json()
+                if response.status_code == 200:
+                    self.context_window = body["context_window"]
+                    self.max_new_tokens = body["max_new_tokens"]
+                    return
+                if body.get("status") == "failed":
+                    raise RuntimeError(f"Generation server failed to load: {body.get('error')}")
+            if stop is not None and stop.wait(interval):
+                raise RuntimeError("Stopped waiting for the generation server")
+            if stop is None:
+                threading.Event().wait(interval)
+
+    @staticmethod
+    def _check(response: httpx.Response):
+        if response.status_code != 200:
+            response.read()
+            raise RuntimeError(f"Generation server returned {response.status_code}: {response.text}")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = self._client.post("/generate", json={"prompt": prompt, "formatted": formatted})
+        self._check(response)
+        return CompletionResponse(text=response.json()["text"])
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            with self._client.stream("POST", "/generate_stream", json={"prompt": prompt, "formatted": formatted}) as response:
+                self._check(response)
+                text = ""
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if "error" in event:
+                        raise RuntimeError(event["error"])
+                    text += event["delta"]
+                    yield CompletionResponse(text=text, delta=event["delta"])
+
+        return gen()
+
+    def submit(self, prompt: str, formatted: bool = False) -> Future:
+        """與 BatchedHuggingFaceLLM.submit 相同：不等待結果，Future 的值為生成的文字"""
+        return self._pool.submit(lambda: self.complete(prompt, formatted=formatted).text)
@@ -0,0 +1,117 @@
+from typing import Dict, List, Optional
+from collections import OrderedDict
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from sentence_transformers import CrossEncoder
+from embedding_cache import content_hash
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class RankedNode(NodeWithScore):
+    """檢索結果的節點：score 維持向量餘弦相似度，RRF 融合與 cross-encoder 的分數另外存放"""
+
+    fused_score: Optional[float] = None
+    rerank_score: Optional[float] = None
+
+
+class CrossEncoderReranker:
+    """以 cross-encoder 為檢索候選重新排序
+
+    查詢與每個片段成對送進模型，依批次大小一次評分多對；
+    (查詢, 片段內容) 的分數以 LRU 快取，重複的查詢或片段不必再跑模型。
+    """
+
+    def __init__(
+        self,
+        model_name: str = "BAAI/bge-reranker-base",
+        device: str = None,
+        batch_size: int = 16,
+        max_length: int = 512,
+        cache_size: int = 4096
+    ):
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @staticmethod
+    def _key(query_text: str, text: str) -> str:
+        return content_hash(f"{query_text}\0{text}")
+
+    def score(self, query_text: str, texts: List[str]) -> List[float]:
+        """回傳每個片段與查詢的相關分數，只對快取未命中的片段跑模型"""
+        keys = [self._key(query_text, text) for text in texts]
+        scores: Dict[str, float] = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[key] = self._cache[key]
+            # 同一批候選中內容相同的片段只評分一次
+            missing = {key: text for key, text in zip(keys, texts) if key not in scores}
+            self.cache_hits += len(keys) - len(missing)
+            self.cache_misses += len(missing)
+
+        if missing:
+            start = time.time()
+            predicted = self.model.predict(
+                [(query_text, text) for text in missing.values()],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+                convert_to_numpy=True
+            )
+            logger.debug("重新排序 %d 個片段: %.3f秒", len(missing), time.time() - start)
+            with self._lock:
+                for key, value in zip(missing, predicted.tolist()):
+                    scores[key] = value
+                    self._cache[key] = value
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return [scores[key] for key in keys]
+
+    def rerank(
+        self,
+        query_text: str,
+        nodes: List[NodeWithScore],
+        top_n: Optional[int] = None
+    ) -> List[NodeWithScore]:
+        """依 cross-encoder 分數排序候選，回傳前 top_n 個
+
+        cross-encoder 分數放在 rerank_score；score 保留原本的向量相似度，
+        問答快取以它判斷新文件是否會改變檢索結果（cross-encoder 的 logit 沒有固定範圍）。
+        """
+        if not nodes:
+            return []
+        texts = [node.node.get_content(metadata_mode=MetadataMode.NONE) for node in nodes]
+        scores = self.score(query_text, texts)
+        order = sorted(range(len(nodes)), key=lambda i: scores[i], reverse=True)[:top_n]
+        return [
+            RankedNode(
+                node=nodes[i].node,
+                score=nodes[i].score,
+                fused_score=getattr(nodes[i], "fused_score", None),
+                rerank_score=scores[i]
+            )
+            for i in order
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.cache_hits + self.cache_misses
+            return {
+                "cache_entries": len(self._cache),
+                "cache_hits": self.cache_hits,
+                "cache_misses": self.cache_misses,
+                "cache_hit_rate": self.cache_hits / total if total else 0.0,
+            }
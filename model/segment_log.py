@@ -0,0 +1,144 @@
+from typing import List, Dict, Any, Iterator, Optional, Sequence, Tuple
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+import json
+import os
+import re
+import shutil
+
+SEGMENT_DIR = "segments"
+GENERATION_DIR = "generations"
+MANIFEST_FNAME = "manifest.json"
+_SEGMENT_PATTERN = re.compile(r"^seg-(\d{8})\.jsonl$")
+_GENERATION_PATTERN = re.compile(r"^gen-(\d{8})$")
+
+
+class SegmentLog:
+    """索引的追加式分段日誌
+
+    每次新增文件只把新的節點與其向量寫成一個新的分段檔，
+    寫入成本只與批次大小有關；定期壓縮時才完整寫出索引。
+    每次壓縮寫到新的世代目錄，manifest 記錄目前的世代，
+    改寫 manifest 即原子地切換版本，讀取端不會看到寫到一半的索引。
+    世代 0 是舊版直接寫在 index_folder 的索引。
+    """
+
+    def __init__(self, index_folder: str, compact_every: int = 16):
+        self.index_folder = index_folder
+        self.segment_dir = os.path.join(index_folder, SEGMENT_DIR)
+        self.manifest_path = os.path.join(self.segment_dir, MANIFEST_FNAME)
+        self.compact_every = compact_every
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if not os.path.exists(self.manifest_path):
+            return {"compacted_through": 0, "generation": 0}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def state(self) -> Tuple[int, int]:
+        """回傳 (目前世代, 已壓縮到的分段序號)"""
+        manifest = self._read_manifest()
+        return manifest.get("generation", 0), manifest["compacted_through"]
+
+    def generation_dir(self, generation: int) -> str:
+        if generation == 0:
+            return self.index_folder
+        return os.path.join(self.index_folder, GENERATION_DIR, f"gen-{generation:08d}")
+
+    def _list_segments(self, after: Optional[int] = None) -> List[int]:
+        """列出尚未被壓縮（且序號大於 after）的分段序號"""
+        if not os.path.exists(self.segment_dir):
+            return []
+        start = self._read_manifest()["compacted_through"]
+        if after is not None:
+            start = max(start, after)
+        seqs = []
+        for name in os.listdir(self.segment_dir):
+            match = _SEGMENT_PATTERN.match(name)
+            if match and int(match.group(1)) > start:
+                seqs.append(int(match.group(1)))
+        return sorted(seqs)
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.segment_dir, f"seg-{seq:08d}.jsonl")
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._list_segments())
+
+    def needs_compaction(self) -> bool:
+        return self.pending_count >= self.compact_every
+
+    def append(self, nodes: Sequence[BaseNode]) -> int:
+        """把已嵌入的節點寫成新的分段，回傳分段序號"""
+        os.makedirs(self.segment_dir, exist_ok=True)
+        seqs = self._list_segments()
+        last_seq = seqs[-1] if seqs else self._read_manifest()["compacted_through"]
+        seq = last_seq + 1
+
+        path = self._segment_path(seq)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for node in nodes:
+                node_without_embedding = node.model_copy()
+                node_without_embedding.embedding = None
+                record = {
+                    "node": doc_to_json(node_without_embedding),
+                    "embedding": node.embedding,
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        # 改名是原子操作，讀取端不會看到寫到一半的分段
+        os.replace(tmp_path, path)
+        return seq
+
+    def replay(self, after: Optional[int] = None) -> Iterator[Tuple[int, List[BaseNode]]]:
+        """依序讀出每個未壓縮分段的 (序號, 節點)，節點含向量"""
+        for seq in self._list_segments(after):
+            nodes = []
+            path = self._segment_path(seq)
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except FileNotFoundError:
+                # 讀取端列出後寫入端剛好壓縮並刪除，新世代已包含這些節點
+                return
+            with f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    node = json_to_doc(record["node"])
+                    node.embedding = record["embedding"]
+                    nodes.append(node)
+            yield seq, nodes
+
+    def mark_compacted(self, generation: int) -> int:
+        """新世代的完整索引寫出後切換 manifest，刪除已合併的分段，回傳已壓縮到的序號"""
+        seqs = self._list_segments()
+        compacted_through = seqs[-1] if seqs else self._read_manifest()["compacted_through"]
+        os.makedirs(self.segment_dir, exist_ok=True)
+        self._write_manifest({"compacted_through": compacted_through, "generation": generation})
+        for seq in seqs:
+            os.remove(self._segment_path(seq))
+        self._prune_generations(generation)
+        return compacted_through
+
+    def _prune_generations(self, generation: int):
+        """保留目前與前一個世代：讀取端可能剛讀到舊 manifest、正要載入前一個世代"""
+        root = os.path.join(self.index_folder, GENERATION_DIR)
+        if not os.path.exists(root):
+            return
+        for name in os.listdir(root):
+            match = _GENERATION_PATTERN.match(name)
+            if match and int(match.group(1)) < generation - 1:
+                # 已用 mmap 開啟舊檔的行程仍持有 inode，不受刪除影響
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
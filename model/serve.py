@@ -0,0 +1,63 @@
+"""以一個匯入寫入端、一個生成行程與 N 個唯讀查詢工作者啟動服務
+
+    cd model
+    python serve.py --workers 4 --port 8000 --writer-port 8001 --generator-port 8002
+
+寫入端（RAG_ROLE=writer）持有 storage/writer.lock，負責 /add_* 與 /bulk_ingest；
+生成行程（generation_server）是唯一載入 LLM 的行程；
+查詢工作者（RAG_ROLE=reader）以 mmap 唯讀共用同一份索引檔，輪詢 manifest 套用新的分段與世代，
+生成則經由 RAG_LLM_URL 交給生成行程，工作者本身只載入嵌入模型與 LLM 的分詞器。
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+def start(app: str, port: int, workers: int, host: str, **env: str) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app,
+         "--host", host, "--port", str(port), "--workers", str(workers)],
+        env={**os.environ, **env}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="查詢工作者的連接埠")
+    parser.add_argument("--writer-port", type=int, default=8001, help="匯入寫入端的連接埠")
+    parser.add_argument("--generator-port", type=int, default=8002, help="生成行程的連接埠（只在本機監聽）")
+    parser.add_argument("--workers", type=int, default=2, help="查詢工作者數量")
+    args = parser.parse_args()
+
+    processes = [
+        start("multimodal_main:app", args.writer_port, 1, args.host, RAG_ROLE="writer"),
+        start("generation_server:app", args.generator_port, 1, "127.0.0.1"),
+        start(
+            "multimodal_main:app", args.port, args.workers, args.host,
+            RAG_ROLE="reader", RAG_LLM_URL=f"http://127.0.0.1:{args.generator_port}"
+        ),
+    ]
+
+    def stop(*_):
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        # 任一組行程結束就一起關閉，交給外層的 supervisor 重啟
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+    finally:
+        stop()
+        for process in processes:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from llama_index.core.schema import BaseNode
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.docstore.utils import json_to_doc
+from llama_index.core.storage.kvstore.types import DEFAULT_BATCH_SIZE, DEFAULT_COLLECTION, BaseKVStore
+import json
+import os
+import sqlite3
+import threading
+
+DOCSTORE_FNAME = "docstore.sqlite"
+
+# 節點集合之外（doc_hash、ref_doc_info）放在通用的 kv 表
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS nodes ("
+    "node_id TEXT PRIMARY KEY, file_name TEXT, source_type TEXT, "
+    "page_number INTEGER, timestamp TEXT, data TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS nodes_file_name ON nodes (file_name)",
+    "CREATE INDEX IF NOT EXISTS nodes_source_type ON nodes (source_type)",
+    "CREATE INDEX IF NOT EXISTS nodes_page_number ON nodes (page_number)",
+    "CREATE INDEX IF NOT EXISTS nodes_timestamp ON nodes (timestamp)",
+    "CREATE TABLE IF NOT EXISTS kv ("
+    "collection TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+    "PRIMARY KEY (collection, key)) WITHOUT ROWID",
+]
+INDEXED_COLUMNS = ("file_name", "source_type", "page_number", "timestamp")
+
+
+def _dumps(value: dict) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def _columns(data: dict) -> Tuple[Any, ...]:
+    """從節點 JSON 取出索引欄位；PDF 的頁碼與影片的開始時間各有兩種舊寫法"""
+    metadata = data.get("__data__", {}).get("metadata") or {}
+    page_number = metadata.get("page_number") or metadata.get("page")
+    return (
+        metadata.get("file_name"),
+        metadata.get("source_type"),
+        page_number if isinstance(page_number, int) else None,
+        metadata.get("start_time") or metadata.get("timestamp"),
+    )
+
+
+def _chunks(items: List[str], size: int = 500) -> Iterable[List[str]]:
+    # SQLite 單一語句的參數數量有上限
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteKVStore(BaseKVStore):
+    """llama_index KV 介面的 SQLite 實作
+
+    節點集合存成 nodes 表，file_name / source_type / page_number / timestamp 另外存成有索引的欄位；
+    寫入不會自動提交，由呼叫端在一批節點寫完後 commit。
+    read_only 時以唯讀方式開啟（資料庫由寫入端建立），寫入只保留在記憶體中。
+    """
+
+    def __init__(self, db_path: str, node_collection: str, read_only: bool = False):
+        self.db_path = db_path
+        self.node_collection = node_collection
+        self.read_only = read_only
+        self._conn: Optional[sqlite3.Connection] = None
+        self._overlay: Dict[str, Dict[str, dict]] = {}
+        self._lock = threading.RLock()
+        if not read_only:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL 下只在 checkpoint 時 fsync；當機時未寫入分段的節點本來就會重新匯入
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in _SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        # 唯讀行程可能比寫入端早啟動，資料庫出現後才連線
+        if self._conn is None and os.path.exists(self.db_path):
+            self._conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+        return self._conn
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection=collection)
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection=collection)
+
+    def put_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        if not kv_pairs:
+            return
+        with self._lock:
+            if self.read_only:
+                self._overlay.setdefault(collection, {}).update(kv_pairs)
+            elif collection == self.node_collection:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO nodes (node_id, file_name, source_type, page_number, timestamp, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(key, *_columns(val), _dumps(val)) for key, val in kv_pairs]
+                )
+            else:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                    [(collection, key, _dumps(val)) for key, val in kv_pairs]
+                )
+
+    async def aput_all(
+        self,
+        kv_pairs: List[Tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.put_all(kv_pairs, collection=collection, batch_size=batch_size)
+
+    def get_many(self, keys: List[str], collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        found: Dict[str, dict] = {}
+        with self._lock:
+            overlay = self._overlay.get(collection, {})
+            missing = []
+            for key in keys:
+                if key in overlay:
+                    found[key] = overlay[key]
+                else:
+                    missing.append(key)
+            conn = self._connection()
+            if conn is None or not missing:
+                return found
+            for chunk in _chunks(missing):
+                placeholders = ",".join("?" * len(chunk))
+                if collection == self.node_collection:
+                    rows = conn.execute(f"SELECT node_id, data FROM nodes WHERE node_id IN ({placeholders})", chunk)
+                else:
+                    rows = conn.execute(
+                        f"SELECT key, value FROM kv WHERE collection = ? AND key IN ({placeholders})",
+                        [collection, *chunk]
+                    )
+                for key, value in rows.fetchall():
+                    found[key] = json.loads(value)
+        return found
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get_many([key], collection=collection).get(key)
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection=collection)
+
+    def iter_all(self, collection: str = DEFAULT_COLLECTION, batch_size: int = 1000) -> Iterator[Tuple[str, dict]]:
+        """分批讀出整個集合，不會一次把所有內容載入記憶體"""
+        if collection == self.node_collection:
+            query = "SELECT node_id, data FROM nodes WHERE node_id > ? ORDER BY node_id LIMIT ?"
+            params: List[Any] = []
+        else:
+            query = "SELECT key, value FROM kv WHERE collection = ? AND key > ? ORDER BY key LIMIT ?"
+            params = [collection]
+        last = ""
+        while True:
+            with self._lock:
+                conn = self._connection()
+                rows = conn.execute(query, [*params, last, batch_size]).fetchall() if conn else []
+            for key, value in rows:
+                yield key, json.loads(value)
+            if len(rows) < batch_size:
+                break
+            last = rows[-1][0]
+        with self._lock:
+            overlay = dict(self._overlay.get(collection, {}))
+        yield from overlay.items()
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return dict(self.iter_all(collection))
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            if self.read_only:
+                return self._overlay.get(collection, {}).pop(key, None) is not None
+            if collection == self.node_collection:
+                cursor = self._conn.execute("DELETE FROM nodes WHERE node_id = ?", (key,))
+            else:
+                cursor = self._conn.execute("DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key))
+            return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection=collection)
+
+    def count(self) -> int:
+        with self._lock:
+            conn = self._connection()
+            n_rows = conn.execute("SELECT COUNT(*) FROM nodes").fetchone()[0] if conn else 0
+            return n_rows + len(self._overlay.get(self.node_collection, {}))
+
+    def node_ids(self, **columns: Any) -> List[str]:
+        with self._lock:
+            conn = self._connection()
+            if conn is None:
+                return []
+            where = " AND ".join(f"{name} = ?" for name in columns)
+            return [row[0] for row in conn.execute(
+                "SELECT node_id FROM nodes" + (f" WHERE {where}" if where else ""),
+                list(columns.values())
+            ).fetchall()]
+
+    def commit(self):
+        with self._lock:
+            if not self.read_only:
+                self._conn.commit()
+
+    def clear_overlay(self):
+        with self._lock:
+            self._overlay = {}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                if not self.read_only:
+                    self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+class SQLiteDocumentStore(KVDocumentStore):
+    """以 SQLite 保存節點的文件庫
+
+    節點留在磁碟上，只在查詢取回 top-k 時才讀出並反序列化，
+    載入索引不需要把整個文件庫讀進記憶體，寫出也不必重寫整個檔案。
+    同一個 index_folder 的所有世代共用一個資料庫：節點只會新增，
+    舊世代用得到的節點仍在，新世代切換前寫入端已經提交。
+    """
+
+    def __init__(self, db_path: str, read_only: bool = False, namespace: Optional[str] = None):
+        namespace = namespace or "docstore"
+        self._sqlite = SQLiteKVStore(db_path, node_collection=f"{namespace}/data", read_only=read_only)
+        super().__init__(self._sqlite, namespace=namespace)
+
+    @classmethod
+    def from_index_folder(cls, index_folder: str, read_only: bool = False) -> "SQLiteDocumentStore":
+        return cls(os.path.join(index_folder, DOCSTORE_FNAME), read_only=read_only)
+
+    @staticmethod
+    def exists(index_folder: str) -> bool:
+        return os.path.exists(os.path.join(index_folder, DOCSTORE_FNAME))
+
+    def get_nodes(self, node_ids: List[str], raise_error: bool = True) -> List[Optional[BaseNode]]:
+        """一次查詢取回多個節點，依 node_ids 的順序回傳；不存在時為 None"""
+        found = self._sqlite.get_many(list(node_ids), collection=self._node_collection)
+        if raise_error:
+            missing = [node_id for node_id in node_ids if node_id not in found]
+            if missing:
+                raise ValueError(f"doc_id {missing[0]} not found.")
+        return [json_to_doc(found[node_id]) if node_id in found else None for node_id in node_ids]
+
+    def iter_nodes(self, batch_size: int = 1000) -> Iterator[BaseNode]:
+        for _, data in self._sqlite.iter_all(self._node_collection, batch_size=batch_size):
+            yield json_to_doc(data)
+
+    def count(self) -> int:
+        """資料庫中的節點數（包含尚未壓縮的分段與其他世代的節點）"""
+        return self._sqlite.count()
+
+    def node_ids(self, **columns: Any) -> List[str]:
+        """依索引欄位查詢節點，如 node_ids(file_name="a.pdf", page_number=3)"""
+        unknown = set(columns) - set(INDEXED_COLUMNS)
+        if unknown:
+            raise ValueError(f"Not an indexed column: {', '.join(sorted(unknown))}")
+        return self._sqlite.node_ids(**columns)
+
+    def commit(self):
+        self._sqlite.commit()
+
+    def clear_overlay(self):
+        """唯讀模式：切換世代後重播的節點已由寫入端提交，丟掉記憶體中的副本"""
+        self._sqlite.clear_overlay()
+
+    def persist(self, persist_path: str = None, fs=None) -> None:
+        # 內容已在資料庫中，不寫出 docstore.json
+        self.commit()
+
+    def close(self):
+        self._sqlite.close()
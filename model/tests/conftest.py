@@ -0,0 +1,59 @@
+"""pytest 共用設定：以 benchmarks.stubs 的嵌入模型與 LLM 建立 MultiModalRAG，不需網路與 GPU
+
+    cd model
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+# 與伺服器相同，從 model 資料夾匯入各模組
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from document_processor import MultiModalDocument  # noqa: E402
+
+
+def pdf_page(text: str, page: int, file_name: str = "notes.pdf", **metadata) -> MultiModalDocument:
+    return MultiModalDocument(
+        text=text,
+        metadata={"file_name": file_name, **metadata},
+        source_type="pdf",
+        page_number=page
+    )
+
+
+@pytest.fixture
+def make_rag(tmp_path):
+    """建立使用 stub 模型的 MultiModalRAG；測試結束時全部關閉"""
+    from benchmarks.stubs import StubEmbedding, StubLLM
+    from multimodal_rag import MultiModalRAG
+
+    instances = []
+
+    def factory(folder: str = "storage", **kwargs) -> MultiModalRAG:
+        kwargs.setdefault("answer_cache", False)
+        kwargs.setdefault("llm", StubLLM())
+        rag = MultiModalRAG(
+            index_folder=str(tmp_path / folder),
+            embed_model=StubEmbedding(),
+            device="cpu",
+            **kwargs
+        )
+        instances.append(rag)
+        return rag
+
+    yield factory
+    for rag in reversed(instances):
+        rag.close()
+
+
+@pytest.fixture
+def corpus():
+    """三個檔案、每個 10 頁，主題依頁碼輪替"""
+    topics = ["線性迴歸", "決策樹", "卷積神經網路", "注意力機制", "強化學習"]
+    return [
+        pdf_page(f"第{page}頁 {topics[page % len(topics)]} 的核心概念 CS{page}", page, file_name=f"course{n}.pdf")
+        for n in range(3)
+        for page in range(1, 11)
+    ]
@@ -0,0 +1,32 @@
+from answer_cache import AnswerCache
+from bm25_index import tokenize
+
+
+def cached_entry(cache, query="CS7 決策樹的核心概念"):
+    # 來源分數都很高：只有相似度 >= 0.9 的新節點會以向量條件使快取失效
+    result = {"response": "...", "sources": [{"score": 0.9}, {"score": 0.95}]}
+    cache.store(query, [1.0, 0.0], top_k=2, response_mode="compact", result=result)
+    return cache.lookup(query, [1.0, 0.0], 2, "compact")
+
+
+def test_vector_only_invalidation_ignores_low_cosine_nodes():
+    cache = AnswerCache()
+    assert cached_entry(cache)
+    cache.invalidate_for([[0.0, 1.0]], ["CS7 決策樹 新增的補充講義"])
+    assert cache.stats()["entries"] == 1
+
+
+def test_shared_bm25_terms_invalidate_low_cosine_nodes():
+    cache = AnswerCache(term_tokenizer=tokenize)
+    assert cached_entry(cache)
+    cache.invalidate_for([[0.0, 1.0]], ["線性迴歸 梯度下降"])
+    assert cache.stats()["entries"] == 1
+
+    cache.invalidate_for([[0.0, 1.0]], ["第 3 頁 CS7 補充講義"])
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_hybrid_rag_wires_term_invalidation(make_rag):
+    assert make_rag(answer_cache=True).answer_cache.term_tokenizer is tokenize
+    assert make_rag("dense", answer_cache=True, hybrid_search=False).answer_cache.term_tokenizer is None
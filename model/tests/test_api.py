@@ -0,0 +1,82 @@
+from fastapi.testclient import TestClient
+import json
+import pytest
+
+
+@pytest.fixture
+def client(make_rag, corpus):
+    import multimodal_main
+    rag = make_rag()
+    rag.add_documents(corpus)
+    # 不進入 TestClient 的 context，startup 不會執行，改用這裡建好的實例
+    multimodal_main.rag_instance = rag
+    yield TestClient(multimodal_main.app)
+    multimodal_main.rag_instance = None
+
+
+def test_query_stream_sse_framing(client):
+    with client.stream("POST", "/query_stream", json={"query": "決策樹", "top_k": 2}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = response.read().decode("utf-8")
+
+    frames = [frame for frame in body.split("\n\n") if frame]
+    events = []
+    for frame in frames:
+        event_line, data_line = frame.split("\n")
+        assert event_line.startswith("event: ") and data_line.startswith("data: ")
+        data = json.loads(data_line[len("data: "):])
+        assert data["event"] == event_line[len("event: "):]
+        events.append(data)
+    assert events[0]["event"] == "sources" and len(events[0]["sources"]) == 2
+    assert events[-1]["event"] == "done"
+    tokens = "".join(e["text"] for e in events if e["event"] == "token")
+    assert tokens == events[-1]["response"]
+
+
+def test_query_batch_ndjson(client):
+    queries = ["決策樹", "強化學習", "決策樹"]
+    with client.stream("POST", "/query_batch", json={"queries": queries, "top_k": 2}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [line for line in response.iter_lines() if line]
+
+    events = [json.loads(line) for line in lines]
+    assert events[-1] == {**events[-1], "event": "done", "queries": 3, "unique": 2}
+    assert sorted(e["index"] for e in events[:-1] if e["event"] == "result") == [0, 1, 2]
+
+
+def test_bad_filter_is_400(client):
+    for filters in ({"page": {"between": 1}}, {"page": {"gte": "abc"}}):
+        response = client.post("/retrieve", json={"query": "決策樹", "filters": filters})
+        assert response.status_code == 400
+
+
+def test_bulk_ingest_paths_stay_under_root(client, tmp_path, monkeypatch):
+    import multimodal_main
+    root = tmp_path / "ingest"
+    (root / "course").mkdir(parents=True)
+    (root / "manifest.jsonl").write_text('{"type": "pdf", "path": "../../outside.pdf"}\n', encoding="utf-8")
+    monkeypatch.setattr(multimodal_main, "INGEST_ROOT", str(root))
+
+    for body in ({"directory": str(tmp_path)}, {"directory": "../"}, {"manifest": "manifest.jsonl"}):
+        response = client.post("/bulk_ingest", json=body)
+        assert response.status_code == 400, body
+        assert "outside the ingest root" in response.json()["detail"]
+
+
+def test_one_bulk_job_at_a_time_and_finished_jobs_pruned(client, monkeypatch):
+    import multimodal_main
+
+    class FakeJob:
+        def __init__(self, finished):
+            self.finished = finished
+
+    monkeypatch.setattr(multimodal_main, "BULK_JOBS_KEEP", 2)
+    jobs = {f"done{i}": FakeJob(True) for i in range(4)}
+    monkeypatch.setattr(multimodal_main, "bulk_jobs", {**jobs, "active": FakeJob(False)})
+    assert client.post("/bulk_ingest", json={"directory": "."}).status_code == 409
+
+    multimodal_main.bulk_jobs["active"].finished = True
+    multimodal_main.prune_bulk_jobs()
+    assert list(multimodal_main.bulk_jobs) == ["done3", "active"]
@@ -0,0 +1,34 @@
+from bounded_executor import BoundedExecutor, ExecutorSaturated
+import asyncio
+import pytest
+
+
+def numbers(n):
+    yield from range(n)
+
+
+def test_stream_holds_slot_only_while_iterating():
+    executor = BoundedExecutor("test", max_workers=1, max_queue=0)
+
+    async def scenario():
+        # 從未迭代的串流（例如用戶端提早斷線）不佔名額
+        for _ in range(3):
+            executor.stream(numbers, 3)
+        assert executor.in_flight == 0
+
+        events = executor.stream(numbers, 3)
+        assert await events.__anext__() == 0
+        assert executor.in_flight == 1
+        with pytest.raises(ExecutorSaturated):
+            executor.stream(numbers, 3)
+        with pytest.raises(ExecutorSaturated):
+            await executor.run(sum, [1, 2])
+        await events.aclose()
+        assert executor.in_flight == 0
+        assert [item async for item in executor.stream(numbers, 3)] == [0, 1, 2]
+        assert await executor.run(sum, [1, 2]) == 3
+
+    asyncio.run(scenario())
+    assert executor.in_flight == 0
+    assert executor.stats()["rejected"] == 2
+    executor.shutdown()
@@ -0,0 +1,26 @@
+from bulk_ingest import BulkIngestJob
+import pytest
+
+
+def test_missing_file_is_recorded_and_job_finishes(make_rag, tmp_path):
+    rag = make_rag()
+    transcript = tmp_path / "lecture.txt"
+    transcript.write_text("00:00:01 決策樹以特徵切分資料\n00:00:09 強化學習透過獎勵學習策略\n", encoding="utf-8")
+    missing = str(tmp_path / "missing.txt")
+    items = [
+        {"type": "video", "path": missing, "video_name": "missing.mp4"},
+        {"type": "video", "path": str(transcript), "video_name": "lecture.mp4"},
+    ]
+
+    progress = BulkIngestJob(rag, items, extract_workers=1).run()
+    assert progress["status"] == "completed"
+    assert list(progress["failed"]) == [missing]
+    assert progress["processed"] == 1 and progress["documents"] > 0
+
+
+def test_failure_still_sets_terminal_status(make_rag, tmp_path):
+    rag = make_rag()
+    job = BulkIngestJob(rag, [{"type": "video"}])
+    with pytest.raises(KeyError):
+        job.run()
+    assert job.finished and job.progress()["status"] == "failed"
@@ -0,0 +1,36 @@
+from conftest import pdf_page
+import pytest
+import sqlite3
+
+
+def node_count(rag):
+    return len(rag.index.index_struct.nodes_dict)
+
+
+def test_dedupe_without_embedding_cache(make_rag):
+    pages = [pdf_page("CS101 程式設計", 1), pdf_page("CNN 卷積神經網路", 2), pdf_page("CS101 程式設計", 1)]
+    rag = make_rag(embedding_cache=False, load_llm=False)
+    assert rag.embedding_cache is None
+    rag.add_documents(pages)
+    rag.add_documents(pages[:1])
+    assert node_count(rag) == 2
+    rag.close()
+
+    # 重新開啟後仍記得已索引的內容
+    reopened = make_rag(embedding_cache=False, load_llm=False)
+    reopened.add_documents(pages)
+    assert node_count(reopened) == 2
+
+
+def test_dedupe_can_be_turned_off(make_rag):
+    rag = make_rag(dedupe=False, load_llm=False)
+    rag.add_documents([pdf_page("CS101 程式設計", 1)])
+    rag.add_documents([pdf_page("CS101 程式設計", 1)])
+    assert node_count(rag) == 2
+
+
+def test_close_releases_registry_connection(make_rag):
+    rag = make_rag(load_llm=False)
+    rag.close()
+    with pytest.raises(sqlite3.ProgrammingError):
+        rag.chunk_registry.indexed(["x"])
@@ -0,0 +1,46 @@
+from benchmarks.stubs import StubLLM
+from fastapi.testclient import TestClient
+from remote_llm import RemoteLLM
+import pytest
+
+
+@pytest.fixture
+def remote_llm():
+    import generation_server
+    # 不進入 TestClient 的 context，startup 不會載入真正的模型
+    generation_server.llm_instance = StubLLM(max_new_tokens=64)
+    yield RemoteLLM("http://generator", StubLLM().tokenizer, client=TestClient(generation_server.app))
+    generation_server.llm_instance = None
+
+
+def test_remote_llm_reads_limits_from_generator(remote_llm):
+    remote_llm.wait_until_ready()
+    assert (remote_llm.context_window, remote_llm.max_new_tokens) == (512, 64)
+
+
+def test_readers_answer_through_the_generator(make_rag, corpus, remote_llm):
+    local = make_rag("local")
+    local.add_documents(corpus)
+    remote = make_rag("remote", llm=remote_llm)
+    remote.add_documents(corpus)
+
+    for question in ["決策樹", "強化學習 CS5"]:
+        assert remote.query(question)["response"] == local.query(question)["response"]
+        events = list(remote.stream_query(question))
+        assert events[-1]["response"] == local.query(question)["response"]
+        assert "".join(e["text"] for e in events if e["event"] == "token") == events[-1]["response"]
+
+    questions = ["決策樹", "強化學習", "決策樹"]
+    batch = {e["index"]: e["response"] for e in remote.query_batch(questions) if e["event"] == "result"}
+    assert batch == {i: local.query(q)["response"] for i, q in enumerate(questions)}
+
+
+def test_generator_not_ready(monkeypatch):
+    import generation_server
+    client = TestClient(generation_server.app)
+    assert client.get("/ready").status_code == 503
+    assert client.post("/generate", json={"prompt": "x"}).status_code == 503
+    monkeypatch.setattr(generation_server, "load_error", "OSError: no weights")
+    assert client.get("/ready").json()["status"] == "failed"
+    with pytest.raises(RuntimeError, match="no weights"):
+        RemoteLLM("http://generator", None, client=client).wait_until_ready()
@@ -0,0 +1,41 @@
+from metadata_index import build_metadata_filters, metadata_matches
+import time
+
+
+def test_sources_keep_cosine_and_fused_scores(make_rag, corpus):
+    rag = make_rag()
+    rag.add_documents(corpus)
+    sources = rag.retrieve("CS7 決策樹", top_k=3)["sources"]
+    assert sources
+    for source in sources:
+        # score 為餘弦相似度，RRF 分數另外放在 fused_score
+        assert 0 < source["score"] <= 1
+        assert 0 < source["fused_score"] < 0.05
+
+
+def test_filtered_sparse_matches_scan(make_rag, corpus):
+    rag = make_rag()
+    rag.add_documents(corpus)
+    filters = build_metadata_filters({"file_name": "course1.pdf", "page_number": {"lte": 5}})
+    got = rag._sparse_retrieve("決策樹 核心概念", 3, filters)
+    every = rag.bm25_index.search("決策樹 核心概念", rag.bm25_index.n_docs)
+    nodes = rag.index.docstore.get_nodes([node_id for node_id, _ in every])
+    expected = [hit for hit, node in zip(every, nodes) if metadata_matches(node.metadata, filters)][:3]
+    assert [score for _, score in got] == [score for _, score in expected]
+    for node in rag.index.docstore.get_nodes([node_id for node_id, _ in got]):
+        assert metadata_matches(node.metadata, filters)
+
+
+def test_bm25_gives_up_after_deadline(make_rag, corpus):
+    rag = make_rag()
+    rag.add_documents(corpus)
+    assert rag.bm25_index.search("決策樹", 3, deadline=time.monotonic() - 1) is None
+    # 另一個查詢佔住索引時，等到期限就放棄而不是排隊
+    rag.bm25_index._lock.acquire()
+    try:
+        start = time.monotonic()
+        assert rag.bm25_index.search("決策樹", 3, deadline=start + 0.05) is None
+        assert time.monotonic() - start < 1
+    finally:
+        rag.bm25_index._lock.release()
+    assert len(rag.bm25_index.search("決策樹", 3, deadline=time.monotonic() + 5)) == 3
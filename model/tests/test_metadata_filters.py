@@ -0,0 +1,53 @@
+from llama_index.core.vector_stores.types import FilterOperator
+from metadata_index import MetadataIndex, build_metadata_filters, metadata_matches
+import pytest
+
+METADATAS = [
+    {"file_name": f"course{row % 3}.pdf", "source_type": "pdf" if row % 4 else "video",
+     "page": row, "start_time": f"00:{row:02d}:00"}
+    for row in range(40)
+]
+
+
+def test_build_filters_operators():
+    filters = build_metadata_filters({
+        "course_name": "人工智慧導論",
+        "source_type": ["pdf", "video"],
+        "page": {"gte": 10, "lte": 30},
+    })
+    operators = [(f.key, f.operator) for f in filters.filters]
+    assert operators == [
+        ("course_name", FilterOperator.EQ),
+        ("source_type", FilterOperator.IN),
+        ("page", FilterOperator.GTE),
+        ("page", FilterOperator.LTE),
+    ]
+    assert build_metadata_filters(None) is None
+    assert build_metadata_filters({}) is None
+
+
+def test_unknown_operator_raises():
+    with pytest.raises(ValueError):
+        build_metadata_filters({"page": {"between": [1, 2]}})
+
+
+@pytest.mark.parametrize("bound", ["abc", None, True, [1, 2]])
+def test_bad_range_bound_raises(bound):
+    with pytest.raises(ValueError, match="Range filter on 'page'"):
+        build_metadata_filters({"page": {"gte": bound}})
+
+
+@pytest.mark.parametrize("spec", [
+    {"file_name": "course1.pdf"},
+    {"source_type": ["video"]},
+    {"page": {"gte": 10, "lt": 20}},
+    {"start_time": {"gt": "00:30:00"}},
+    {"file_name": {"ne": "course0.pdf"}, "page": {"lte": 5}},
+    {"source_type": {"nin": ["pdf"]}},
+])
+def test_index_matches_scan(spec):
+    index = MetadataIndex()
+    index.add(METADATAS, 0)
+    filters = build_metadata_filters(spec)
+    expected = [row for row, metadata in enumerate(METADATAS) if metadata_matches(metadata, filters)]
+    assert index.candidates(filters).tolist() == expected
@@ -0,0 +1,38 @@
+from benchmarks.stubs import StubEmbedding
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.schema import TextNode
+
+
+def write_legacy_index(folder, n_pages=10):
+    """以 llama_index 預設的 JSON 格式寫出舊版索引（SimpleVectorStore + docstore.json）"""
+    embed_model = StubEmbedding()
+    nodes = []
+    for page in range(1, n_pages + 1):
+        text = f"第{page}頁 課程內容 CS{page}"
+        nodes.append(TextNode(
+            text=text,
+            metadata={"file_name": "a.pdf", "page": page, "source_type": "pdf"},
+            embedding=embed_model.get_text_embedding(text)
+        ))
+    index = VectorStoreIndex(nodes, storage_context=StorageContext.from_defaults(), embed_model=embed_model)
+    index.storage_context.persist(persist_dir=str(folder))
+
+
+def retrieved_pages(rag, filters):
+    return sorted(source["metadata"]["page"] for source in rag.retrieve("CS3", top_k=10, filters=filters)["sources"])
+
+
+def test_filters_work_on_migrated_index(make_rag, tmp_path):
+    write_legacy_index(tmp_path / "storage")
+    rag = make_rag(compact_every=1, load_llm=False)
+    assert rag.index.vector_store.count == 10
+
+    assert retrieved_pages(rag, {"page": {"gte": 2}}) == list(range(2, 11))
+    assert retrieved_pages(rag, {"file_name": "a.pdf"}) == list(range(1, 11))
+
+    # 壓縮寫出新世代後，metadata 索引一起寫出，重新開啟仍可過濾
+    rag.compact()
+    rag.close()
+    reopened = make_rag(load_llm=False)
+    assert reopened.generation == 1
+    assert retrieved_pages(reopened, {"page": {"gte": 2}}) == list(range(2, 11))
@@ -0,0 +1,72 @@
+from numpy_vector_store import NumpyVectorStore
+from llama_index.core.vector_stores.types import VectorStoreQuery
+from metadata_index import build_metadata_filters
+import numpy as np
+
+
+def results(events):
+    return sorted((e for e in events if e["event"] == "result"), key=lambda e: e["index"])
+
+
+def test_duplicates_answered_once_per_position(make_rag, corpus):
+    rag = make_rag()
+    rag.add_documents(corpus)
+    queries = ["決策樹是什麼", "強化學習", "決策樹是什麼", "CS7", "決策樹是什麼"]
+
+    events = list(rag.query_batch(queries, top_k=2))
+    done = events[-1]
+    assert done["event"] == "done"
+    assert (done["queries"], done["unique"], done["errors"]) == (5, 3, 0)
+
+    batch = results(events)
+    assert [e["index"] for e in batch] == [0, 1, 2, 3, 4]
+    assert [e["query"] for e in batch] == queries
+    for event in batch:
+        single = rag.query(event["query"], top_k=2)
+        assert event["response"] == single["response"]
+        assert [s["text"] for s in event["sources"]] == [s["text"] for s in single["sources"]]
+
+
+def test_filters_apply_to_every_query(make_rag, corpus):
+    rag = make_rag()
+    rag.add_documents(corpus)
+    events = rag.query_batch(["決策樹", "注意力機制"], top_k=3, filters={"file_name": "course2.pdf"})
+    for event in results(events):
+        assert event["sources"]
+        assert {s["metadata"]["file_name"] for s in event["sources"]} == {"course2.pdf"}
+
+
+def test_vector_store_batch_matches_single_queries():
+    rng = np.random.default_rng(0)
+    store = NumpyVectorStore()
+    store.add_embeddings(
+        rng.normal(size=(500, 16)).astype(np.float32),
+        [f"n{row}" for row in range(500)],
+        ["doc"] * 500,
+        [{"page": row % 10} for row in range(500)]
+    )
+    queries = rng.normal(size=(20, 16))
+    for filters in (None, build_metadata_filters({"page": 3})):
+        batch = store.query_batch(queries, 5, filters=filters)
+        for query, result in zip(queries, batch):
+            single = store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=5, filters=filters))
+            assert result.ids == single.ids
+            assert np.allclose(result.similarities, single.similarities, atol=1e-5)
+
+
+def test_batch_sees_rows_added_before_scoring(monkeypatch):
+    rng = np.random.default_rng(1)
+    store = NumpyVectorStore()
+    store.add_embeddings(rng.normal(size=(10, 8)).astype(np.float32), [f"n{row}" for row in range(10)], ["doc"] * 10)
+    score_all = NumpyVectorStore.score_all
+    late = rng.normal(size=(1, 8)).astype(np.float32)
+
+    def add_then_score(self, block):
+        # 模擬寫入端在 query_batch 取得列數之後、計分之前新增向量
+        if self.n_rows == 10:
+            self.add_embeddings(late, ["late"], ["doc"])
+        return score_all(self, block)
+
+    monkeypatch.setattr(NumpyVectorStore, "score_all", add_then_score)
+    result = store.query_batch(late, 3)[0]
+    assert result.ids[0] == "late"
@@ -0,0 +1,41 @@
+from conftest import pdf_page
+from multimodal_rag import IndexReadOnly
+import pytest
+
+
+def texts(result):
+    return [source["text"] for source in result["sources"]]
+
+
+def test_reader_replays_segments_and_switches_generation(make_rag):
+    writer = make_rag(compact_every=2, load_llm=False)
+    # 手動呼叫 refresh，不依賴背景輪詢的時間
+    reader = make_rag(read_only=True, refresh_interval=3600, load_llm=False)
+    with pytest.raises(IndexReadOnly):
+        reader.add_documents([pdf_page("x", 1)])
+
+    writer.add_documents([pdf_page("CS101 程式設計", 1)])
+    assert writer.generation == 0
+    assert reader.refresh()
+    assert texts(reader.retrieve("CS101", top_k=1)) == ["CS101 程式設計"]
+    assert not reader.refresh()
+
+    # 第二個分段觸發壓縮，寫出新世代
+    writer.add_documents([pdf_page("CNN 卷積神經網路", 2)])
+    assert writer.generation == 1
+    assert reader.refresh()
+    assert reader.status()["index_generation"] == 1
+    assert texts(reader.retrieve("CNN", top_k=1)) == ["CNN 卷積神經網路"]
+    assert texts(reader.retrieve("CS101", top_k=1)) == ["CS101 程式設計"]
+
+
+def test_writer_reopens_from_segments(make_rag):
+    writer = make_rag(compact_every=16, load_llm=False)
+    writer.add_documents([pdf_page("CS101 程式設計", 1)])
+    writer.add_documents([pdf_page("CNN 卷積神經網路", 2)])
+    writer.close()
+
+    reopened = make_rag(compact_every=16, load_llm=False)
+    assert reopened.applied_seq == 2
+    assert len(reopened.index.index_struct.nodes_dict) == 2
+    assert texts(reopened.retrieve("CNN", top_k=1)) == ["CNN 卷積神經網路"]
@@ -0,0 +1,40 @@
+import fcntl
+import os
+
+LOCK_FNAME = "writer.lock"
+
+
+class WriterLockHeld(Exception):
+    """另一個行程已經以寫入模式開啟同一個索引"""
+
+
+class WriterLock:
+    """索引目錄的單一寫入者檔案鎖
+
+    以 flock 鎖住 index_folder/writer.lock，行程結束（包括當機）時由作業系統釋放，
+    不會留下需要手動清除的過期鎖。
+    """
+
+    def __init__(self, index_folder: str):
+        self.path = os.path.join(index_folder, LOCK_FNAME)
+        self._fd = None
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise WriterLockHeld(f"{self.path} is held by another writer process")
+        # 記錄持有者，方便排查
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None